@@ -0,0 +1,13 @@
+"""ANAM_XRI synchronized mobile video recording server.
+
+``create_app()`` builds the Flask app and its Socket.IO server. The web
+stack (Flask, Flask-SocketIO, eventlet) is only imported by that call, so
+the command-line tools (``chunkstore``, ``postprocess``, ``webm_index``)
+don't pay for it. ``python -m anam_xri`` runs the services; see ``cli``.
+"""
+
+
+def create_app(config=None):
+    """The Flask app, with the server state set up (``server.create_app``)"""
+    from .server import create_app
+    return create_app(config)
@@ -0,0 +1,48 @@
+"""Coalesce device state changes into batched deltas for admin dashboards.
+
+Instead of one Socket.IO message per registration or clock update, handlers
+record changes here and a background task flushes them at a fixed rate. Many
+updates to the same device between flushes collapse into a single entry, so
+the dashboard patches each changed card once per interval no matter how many
+phones join at the same moment.
+"""
+import threading
+
+# Default flush period (seconds)
+ADMIN_UPDATE_INTERVAL = 0.25
+
+
+class DeltaAggregator:
+    def __init__(self):
+        self._upserted = {}
+        self._removed = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of pending changes (queue depth between flushes)"""
+        return len(self._upserted) + len(self._removed)
+
+    def upsert(self, device_id, **fields):
+        """Record changed fields for a device; later calls merge into earlier"""
+        with self._lock:
+            self._removed.discard(device_id)
+            entry = self._upserted.setdefault(device_id, {'device_id': device_id})
+            entry.update(fields)
+
+    def remove(self, device_id):
+        with self._lock:
+            self._upserted.pop(device_id, None)
+            self._removed.add(device_id)
+
+    def drain(self):
+        """Return and clear pending changes, or None if nothing changed"""
+        with self._lock:
+            if not self._upserted and not self._removed:
+                return None
+            delta = {
+                'upserted': list(self._upserted.values()),
+                'removed': list(self._removed)
+            }
+            self._upserted = {}
+            self._removed = set()
+        return delta
@@ -0,0 +1,296 @@
+"""Pluggable shared-state and message-queue backends for multi-worker runs.
+
+With one process everything can live in memory (``LocalStateBackend`` and
+python-socketio's default client manager). When several workers run behind
+a load balancer with sticky sessions, device/session state and Socket.IO
+emits must be shared. ``RespStateBackend`` and ``RespPubSubManager`` speak
+the Redis wire protocol (RESP) directly over a socket, so they work against
+Redis, a compatible server, or a small local stand-in, with no extra client
+library to install.
+
+Backends are selected by URL (``SYNC_BACKEND_URL``):
+
+- ``memory://`` (or unset): single-process, in-memory
+- ``redis://host:port/db``: shared through a RESP server
+"""
+import logging
+import pickle
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+from socketio import PubSubManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESP_PORT = 6379
+
+
+class BackendError(Exception):
+    """Raised when the shared backend cannot be reached or replies with an error"""
+
+
+class LocalStateBackend:
+    """In-process implementation of the state backend interface"""
+
+    def __init__(self):
+        self._hashes = {}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def hset(self, name, field, value):
+        with self._lock:
+            self._hashes.setdefault(name, {})[field] = value
+
+    def hget(self, name, field):
+        return self._hashes.get(name, {}).get(field)
+
+    def hdel(self, name, field):
+        with self._lock:
+            self._hashes.get(name, {}).pop(field, None)
+
+    def hgetall(self, name):
+        return dict(self._hashes.get(name, {}))
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._values[key] = (value, expires)
+
+    def get(self, key):
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+            self._hashes.pop(key, None)
+
+
+class RespConnection:
+    """Minimal RESP client: one socket, request/reply and pub/sub reads"""
+
+    def __init__(self, host='localhost', port=DEFAULT_RESP_PORT, db=0, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        self._sock = None
+        self._buffer = b''
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        parsed = urlparse(url)
+        db = parsed.path.strip('/')
+        return cls(parsed.hostname or 'localhost', parsed.port or DEFAULT_RESP_PORT,
+                   int(db) if db else 0, **kwargs)
+
+    def connect(self):
+        self.close()
+        try:
+            self._sock = socket.create_connection((self.host, self.port), self.timeout)
+        except OSError as e:
+            raise BackendError(f'cannot connect to {self.host}:{self.port}: {e}')
+        self._buffer = b''
+        if self.db:
+            self.command('SELECT', self.db)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+
+    def settimeout(self, timeout):
+        if self._sock is not None:
+            self._sock.settimeout(timeout)
+
+    @staticmethod
+    def encode(*args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode('utf-8')
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def send(self, *args):
+        if self._sock is None:
+            self.connect()
+        try:
+            self._sock.sendall(self.encode(*args))
+        except OSError as e:
+            self.close()
+            raise BackendError(str(e))
+
+    def command(self, *args):
+        self.send(*args)
+        return self.read_reply()
+
+    def _fill(self):
+        try:
+            data = self._sock.recv(65536)
+        except OSError as e:
+            self.close()
+            raise BackendError(str(e))
+        if not data:
+            self.close()
+            raise BackendError('connection closed')
+        self._buffer += data
+
+    def _readline(self):
+        while b'\r\n' not in self._buffer:
+            self._fill()
+        line, self._buffer = self._buffer.split(b'\r\n', 1)
+        return line
+
+    def _read_exact(self, length):
+        while len(self._buffer) < length + 2:
+            self._fill()
+        data = self._buffer[:length]
+        self._buffer = self._buffer[length + 2:]
+        return data
+
+    def read_reply(self):
+        if self._sock is None:
+            raise BackendError('not connected')
+        line = self._readline()
+        kind, rest = line[:1], line[1:]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise BackendError(rest.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            return None if length < 0 else self._read_exact(length)
+        if kind == b'*':
+            count = int(rest)
+            return None if count < 0 else [self.read_reply() for _ in range(count)]
+        raise BackendError(f'unexpected reply: {line!r}')
+
+
+class RespStateBackend:
+    """State backend stored in a RESP server (Redis or compatible)"""
+
+    def __init__(self, url, prefix='sync:'):
+        self.prefix = prefix
+        self._conn = RespConnection.from_url(url)
+        self._lock = threading.Lock()
+
+    def _command(self, *args):
+        # One reconnect attempt, so a restarted server doesn't need a restart here
+        with self._lock:
+            try:
+                return self._conn.command(*args)
+            except BackendError:
+                self._conn.connect()
+                return self._conn.command(*args)
+
+    @staticmethod
+    def _text(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def hset(self, name, field, value):
+        self._command('HSET', self.prefix + name, field, value)
+
+    def hget(self, name, field):
+        return self._text(self._command('HGET', self.prefix + name, field))
+
+    def hdel(self, name, field):
+        self._command('HDEL', self.prefix + name, field)
+
+    def hgetall(self, name):
+        reply = self._command('HGETALL', self.prefix + name) or []
+        return {self._text(reply[i]): self._text(reply[i + 1]) for i in range(0, len(reply), 2)}
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self._command('SET', self.prefix + key, value, 'EX', max(1, round(ttl)))
+        else:
+            self._command('SET', self.prefix + key, value)
+
+    def get(self, key):
+        return self._text(self._command('GET', self.prefix + key))
+
+    def delete(self, key):
+        self._command('DEL', self.prefix + key)
+
+
+class RespPubSubManager(PubSubManager):
+    """Socket.IO client manager that fans emits out over RESP pub/sub.
+
+    Every worker publishes emits to a shared channel and relays messages it
+    receives to its own clients, so a broadcast reaches every phone whichever
+    worker it is connected to.
+    """
+    name = 'resp'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None):
+        self.url = url
+        self._publisher = RespConnection.from_url(url)
+        self._publish_lock = threading.Lock()
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def initialize(self):
+        super().initialize()
+        if self.server.async_mode == 'eventlet':
+            from eventlet.patcher import is_monkey_patched
+            if not is_monkey_patched('socket'):
+                raise RuntimeError('RESP message queue requires eventlet monkey patching')
+
+    def _publish(self, data):
+        payload = pickle.dumps(data)
+        with self._publish_lock:
+            for attempt in (1, 2):
+                try:
+                    return self._publisher.command('PUBLISH', self.channel, payload)
+                except BackendError:
+                    logger.error('Cannot publish to message queue (attempt %d)', attempt)
+                    self._publisher.close()
+
+    def _listen(self):
+        retry_sleep = 1
+        while True:
+            conn = RespConnection.from_url(self.url)
+            try:
+                conn.connect()
+                conn.send('SUBSCRIBE', self.channel)
+                # No timeout on the subscription socket; it idles between emits
+                conn.settimeout(None)
+                retry_sleep = 1
+                while True:
+                    reply = conn.read_reply()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b'message':
+                        yield reply[2]
+            except BackendError:
+                logger.error('Cannot receive from message queue, retrying in %s secs', retry_sleep)
+                conn.close()
+                time.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 60)
+
+
+def create_backends(url=None):
+    """Return (state_backend, client_manager) for a backend URL.
+
+    The client manager is None for the in-memory backend, which leaves
+    python-socketio's default single-process manager in place.
+    """
+    if not url or url.startswith('memory://'):
+        return LocalStateBackend(), None
+    scheme = urlparse(url).scheme
+    if scheme == 'redis':
+        return RespStateBackend(url), RespPubSubManager(url)
+    raise ValueError(f'unsupported backend URL: {url}')
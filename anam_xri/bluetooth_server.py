@@ -0,0 +1,440 @@
+"""Multi-client Bluetooth RFCOMM server with a framed message protocol.
+
+One selector loop serves every connected device: sockets are non-blocking,
+reads are split into frames as bytes arrive, and each connection has its own
+outbound buffer, so a slow phone never stalls the others. Frames are a
+4-byte big-endian length followed by a UTF-8 JSON object
+``{"event": ..., "data": {...}}`` using the same event names as the
+Socket.IO client (``register_device``, ``heartbeat``, ``clock_sync_ping``,
+``clock_sync_report``, ``sync_command_ack``, ``recording_started``).
+
+``BluetoothBridge`` maps those messages onto a ``DeviceRegistry``. When it
+is started with the web server (``python -m anam_xri serve``) it shares the
+web server's registry, so Bluetooth devices get clock-corrected start
+commands through the same path as browsers. Everything that touches the
+registry is then queued for the web server's event loop; only clock sync
+pings are answered on the server thread. Run on its own
+(``python -m anam_xri bluetooth``), it serves devices with a private
+registry (useful for discovery and testing).
+
+``FramedServer`` works on any stream socket; tests can attach one end of a
+``socket.socketpair()`` with ``add_connection`` instead of a radio.
+"""
+import collections
+import json
+import logging
+import selectors
+import socket
+import struct
+import threading
+import time
+
+from .registry import (DeviceRegistry, HEARTBEAT_INTERVAL, TRANSPORT_BLUETOOTH, device_group,
+                       valid_group)
+
+logger = logging.getLogger(__name__)
+
+BLUETOOTH_NAME = 'ANAM_XRI'
+# Pending connections the RFCOMM socket queues before accept()
+LISTEN_BACKLOG = 16
+# Largest frame accepted from a device
+MAX_FRAME_BYTES = 64 * 1024
+# A device whose unsent output grows past this is disconnected
+MAX_OUTBOX_BYTES = 1024 * 1024
+# Prefix for connection ids, which double as registry sids
+CONNECTION_PREFIX = 'bt:'
+
+_HEADER = struct.Struct('!I')
+
+
+class FrameError(ValueError):
+    """Raised for oversized or undecodable frames"""
+
+
+def encode_frame(message):
+    payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    if len(payload) > MAX_FRAME_BYTES:
+        raise FrameError('frame too large')
+    return _HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """Incremental decoder: feed received bytes, get complete messages back"""
+
+    def __init__(self, max_frame=MAX_FRAME_BYTES):
+        self.max_frame = max_frame
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+        messages = []
+        while len(self._buffer) >= _HEADER.size:
+            (length,) = _HEADER.unpack_from(self._buffer)
+            if length > self.max_frame:
+                raise FrameError(f'frame of {length} bytes exceeds limit')
+            end = _HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            payload = bytes(self._buffer[_HEADER.size:end])
+            del self._buffer[:end]
+            try:
+                message = json.loads(payload.decode('utf-8'))
+            except (UnicodeDecodeError, ValueError) as e:
+                raise FrameError(f'bad frame payload: {e}')
+            if not isinstance(message, dict):
+                raise FrameError('frame payload must be an object')
+            messages.append(message)
+        return messages
+
+
+class _Connection:
+    def __init__(self, conn_id, sock, info):
+        self.id = conn_id
+        self.sock = sock
+        self.info = info
+        self.decoder = FrameDecoder()
+        self.outbox = bytearray()
+        self.events = selectors.EVENT_READ
+
+
+class FramedServer:
+    """Selector-driven server for many framed stream connections.
+
+    ``on_message(conn_id, message)``, ``on_connect(conn_id, info)`` and
+    ``on_disconnect(conn_id)`` run on the server thread. ``send`` may be
+    called from any thread.
+    """
+
+    def __init__(self, listen_sock=None, on_message=None, on_connect=None, on_disconnect=None):
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self._selector = selectors.DefaultSelector()
+        self._connections = {}
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._stopped = False
+        self._thread = None
+        self._loop_thread_id = None
+
+        # Written to by send() so a blocked select() picks up new output at once
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ, 'wakeup')
+
+        self._listen_sock = listen_sock
+        if listen_sock is not None:
+            listen_sock.setblocking(False)
+            self._selector.register(listen_sock, selectors.EVENT_READ, 'listen')
+
+    def __len__(self):
+        return len(self._connections)
+
+    def add_connection(self, sock, info=None):
+        """Serve an already-connected socket. Call from the server thread or before start()."""
+        sock.setblocking(False)
+        self._next_id += 1
+        conn = _Connection(f'{CONNECTION_PREFIX}{self._next_id}', sock, info)
+        self._connections[conn.id] = conn
+        self._selector.register(sock, conn.events, conn)
+        if self.on_connect:
+            self.on_connect(conn.id, info)
+        return conn.id
+
+    def send(self, conn_id, message):
+        """Queue a message for a connection. Returns False if it is not connected."""
+        if conn_id not in self._connections:
+            return False
+        frame = encode_frame(message)
+        if threading.get_ident() == self._loop_thread_id:
+            # Already on the loop: write straight away
+            conn = self._connections[conn_id]
+            conn.outbox += frame
+            self._flush(conn)
+            return True
+        with self._lock:
+            self._pending.append((conn_id, frame))
+        try:
+            self._wakeup_send.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # A wakeup is already pending
+        return True
+
+    def poll(self, timeout=None):
+        """Run one round of the selector loop"""
+        for key, mask in self._selector.select(timeout):
+            if key.data == 'listen':
+                self._accept()
+            elif key.data == 'wakeup':
+                self._drain_wakeup()
+            else:
+                conn = key.data
+                if mask & selectors.EVENT_READ:
+                    self._read(conn)
+                if mask & selectors.EVENT_WRITE and conn.id in self._connections:
+                    self._flush(conn)
+        self._deliver_pending()
+
+    def serve_forever(self, poll_interval=1.0):
+        self._loop_thread_id = threading.get_ident()
+        while not self._stopped:
+            self.poll(poll_interval)
+
+    def start(self):
+        """Run the loop on a daemon thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name='bluetooth-server',
+                                        daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stopped = True
+        try:
+            self._wakeup_send.send(b'\0')
+        except OSError:
+            pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def close(self):
+        for conn_id in list(self._connections):
+            self.close_connection(conn_id)
+        if self._listen_sock is not None:
+            self._selector.unregister(self._listen_sock)
+            self._listen_sock.close()
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+    def close_connection(self, conn_id):
+        conn = self._connections.pop(conn_id, None)
+        if conn is None:
+            return
+        self._selector.unregister(conn.sock)
+        try:
+            conn.sock.close()
+        except OSError:
+            pass
+        if self.on_disconnect:
+            self.on_disconnect(conn_id)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, info = self._listen_sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.error('accept failed: %s', e)
+                return
+            logger.info('Accepted connection from %s', info)
+            self.add_connection(sock, info)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _deliver_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, collections.deque()
+        for conn_id, frame in pending:
+            conn = self._connections.get(conn_id)
+            if conn is not None:
+                conn.outbox += frame
+        for conn_id in {conn_id for conn_id, _ in pending}:
+            conn = self._connections.get(conn_id)
+            if conn is not None:
+                self._flush(conn)
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.close_connection(conn.id)
+            return
+        try:
+            messages = conn.decoder.feed(data)
+        except FrameError as e:
+            logger.warning('Dropping %s: %s', conn.id, e)
+            self.close_connection(conn.id)
+            return
+        for message in messages:
+            if self.on_message is None:
+                continue
+            try:
+                self.on_message(conn.id, message)
+            except Exception:
+                logger.exception('Error handling %r from %s', message.get('event'), conn.id)
+            if conn.id not in self._connections:
+                return
+
+    def _flush(self, conn):
+        if conn.outbox:
+            try:
+                sent = conn.sock.send(conn.outbox)
+                del conn.outbox[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self.close_connection(conn.id)
+                return
+        if len(conn.outbox) > MAX_OUTBOX_BYTES:
+            logger.warning('Dropping %s: not reading its output', conn.id)
+            self.close_connection(conn.id)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.outbox else 0)
+        if events != conn.events:
+            conn.events = events
+            self._selector.modify(conn.sock, events, conn)
+
+
+def _call_now(func, *args):
+    func(*args)
+
+
+class BluetoothBridge:
+    """Registers framed-protocol devices in a DeviceRegistry.
+
+    Registration, heartbeats and clock sync are answered here, as the
+    Socket.IO handlers answer them for browsers. After the registry is
+    updated every event (and ``disconnect``) is passed to
+    ``on_event(device, event, data)`` for application-level handling.
+
+    Clock sync pings are answered on the server thread, so their
+    timestamps don't wait on anything. Every other message is handed to
+    ``schedule(func, *args)``, which must run ``func(*args)`` in order on
+    the thread that owns the registry. By default that is the server
+    thread itself.
+    """
+
+    def __init__(self, registry, server=None, on_event=None, schedule=_call_now):
+        self.registry = registry
+        self.server = server if server is not None else FramedServer()
+        self.server.on_message = self._handle_message
+        self.server.on_disconnect = self._handle_disconnect
+        self.on_event = on_event
+        self.schedule = schedule
+
+    def send(self, sid, event, data):
+        """Send an event to the device connected as ``sid``"""
+        return self.server.send(sid, {'event': event, 'data': data})
+
+    def _notify(self, device, event, data):
+        if self.on_event is not None:
+            self.on_event(device, event, data)
+
+    def _handle_message(self, conn_id, message):
+        event = message.get('event')
+        data = message.get('data') or {}
+        if event == 'clock_sync_ping':
+            received_at = time.time()
+            self.send(conn_id, 'clock_sync_pong', {
+                't0': data.get('t0'),
+                't1': received_at,
+                't2': time.time()
+            })
+            return
+        self.schedule(self._handle_event, conn_id, event, data)
+
+    def _handle_event(self, conn_id, event, data):
+        if event == 'register_device':
+            device_id = str(data.get('device_id') or '')
+            if not device_id:
+                self.send(conn_id, 'error', {'error': 'device_id required'})
+                return
+            info = {'user_agent': data.get('user_agent')}
+            if valid_group(data.get('group')):
+                info['group'] = data['group']
+            device, reconnected = self.registry.register(conn_id, device_id, info,
+                                                         transport=TRANSPORT_BLUETOOTH)
+            self.send(conn_id, 'registration_confirmed', {
+                'device_id': device_id,
+                'reconnected': reconnected,
+                'group': device_group(device),
+                'heartbeat_interval': HEARTBEAT_INTERVAL
+            })
+            self._notify(device, event, data)
+            return
+
+        if event == 'heartbeat':
+            device, revived = self.registry.heartbeat(conn_id)
+            if device is None:
+                self.send(conn_id, 'reregister', {})
+            elif revived:
+                self._notify(device, event, data)
+            return
+
+        device = self.registry.get_by_sid(conn_id)
+        if device is None:
+            self.send(conn_id, 'reregister', {})
+            return
+
+        if event == 'clock_sync_report':
+            estimate = device['clock']
+            if not estimate.update(data.get('samples')):
+                self.send(conn_id, 'clock_sync_result', {'error': 'no usable samples'})
+                return
+            self.registry.save(device)
+            self.send(conn_id, 'clock_sync_result', estimate.as_dict())
+        self._notify(device, event, data)
+
+    def _handle_disconnect(self, conn_id):
+        self.schedule(self._disconnect, conn_id)
+
+    def _disconnect(self, conn_id):
+        device = self.registry.disconnect(conn_id)
+        if device is not None:
+            self._notify(device, 'disconnect', {})
+
+
+def open_rfcomm_socket(name=BLUETOOTH_NAME):
+    """Bind, listen and advertise an RFCOMM serial-port service"""
+    # pybluez is only needed when a real adapter is used
+    import bluetooth
+
+    server_sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+    server_sock.bind(("", bluetooth.PORT_ANY))
+    server_sock.listen(LISTEN_BACKLOG)
+    bluetooth.advertise_service(
+        server_sock,
+        name,
+        service_classes=[bluetooth.SERIAL_PORT_CLASS],
+        profiles=[bluetooth.SERIAL_PORT_PROFILE]
+    )
+    return server_sock
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    server_sock = open_rfcomm_socket()
+    port = server_sock.getsockname()[1]
+
+    # Set the Bluetooth name (Windows: set in OS Bluetooth settings, not via code)
+    print(f"Set your Bluetooth name to '{BLUETOOTH_NAME}' in Windows Bluetooth settings.")
+    print(f"Waiting for connections on RFCOMM channel {port}...")
+
+    def log_event(device, event, data):
+        logger.info('%s %s: %s', device['device_id'], event, data)
+
+    bridge = BluetoothBridge(DeviceRegistry(), FramedServer(server_sock), on_event=log_event)
+    try:
+        bridge.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bridge.server.close()
+        print("Server stopped.")
+
+
+if __name__ == '__main__':
+    main()
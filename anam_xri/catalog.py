@@ -0,0 +1,365 @@
+"""Persistent catalog of sessions, devices, takes and recorded files.
+
+Everything the server learns about a shoot is written to a SQLite database
+in WAL mode, so past sessions survive restarts and can be browsed without
+scanning the recordings directory. Handlers never touch the database
+directly. ``record_*`` calls put upserts on a queue, and one writer thread
+commits them in batches (one transaction per batch). Only that thread
+writes. Readers use their own connection, which under WAL never waits
+for the writer.
+
+List queries use keyset pagination: each page returns an opaque
+``next_cursor`` made from the last row's sort key, so fetching page 100 is
+as cheap as page 1. A missing timestamp sorts as ``NO_TIME`` (oldest), so
+rows such as a take acked but never started still page through.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .metrics import original_module
+
+logger = logging.getLogger(__name__)
+
+# Most upserts committed in one transaction
+WRITE_BATCH_SIZE = 500
+# Longest a queued write waits for more to batch with (seconds)
+WRITE_BATCH_DELAY = 0.2
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Sort value of a NULL timestamp: the -1 in the COALESCE of the indexes and list queries
+NO_TIME = -1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    start_time REAL,
+    mode TEXT,
+    status TEXT,
+    device_count INTEGER,
+    synced_devices INTEGER,
+    max_sync_error REAL,
+    readiness TEXT,
+    device_group TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_created ON sessions (created_at, session_id);
+
+CREATE TABLE IF NOT EXISTS devices (
+    device_id TEXT PRIMARY KEY,
+    first_seen REAL NOT NULL,
+    last_seen REAL,
+    transport TEXT,
+    user_agent TEXT,
+    capabilities TEXT
+);
+CREATE INDEX IF NOT EXISTS devices_last_seen ON devices (COALESCE(last_seen, -1), device_id);
+
+CREATE TABLE IF NOT EXISTS takes (
+    session_id TEXT NOT NULL,
+    take INTEGER NOT NULL DEFAULT 0,
+    device_id TEXT NOT NULL,
+    started_at REAL,
+    clock_synced INTEGER,
+    error_bound REAL,
+    profile TEXT,
+    state TEXT,
+    stopped_at REAL,
+    preroll REAL,
+    quality TEXT,
+    PRIMARY KEY (session_id, take, device_id)
+);
+CREATE INDEX IF NOT EXISTS takes_device ON takes (device_id, COALESCE(started_at, -1), session_id,
+                                                  take);
+
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    take INTEGER NOT NULL DEFAULT 0,
+    device_id TEXT,
+    kind TEXT NOT NULL,
+    size INTEGER,
+    chunks INTEGER,
+    complete INTEGER,
+    duration REAL,
+    updated_at REAL,
+    checksum TEXT,
+    verified TEXT
+);
+CREATE INDEX IF NOT EXISTS files_session ON files (session_id, take);
+CREATE INDEX IF NOT EXISTS files_device ON files (device_id, updated_at);
+'''
+
+# Upsert keys and the columns callers may set, per table
+TABLES = {
+    'sessions': (('session_id',), ('created_at', 'start_time', 'mode', 'status', 'device_count',
+                                   'synced_devices', 'max_sync_error', 'readiness',
+                                   'device_group')),
+    'devices': (('device_id',), ('first_seen', 'last_seen', 'transport', 'user_agent',
+                                 'capabilities')),
+    'takes': (('session_id', 'take', 'device_id'), ('started_at', 'clock_synced', 'error_bound',
+                                                    'profile', 'state', 'stopped_at', 'preroll',
+                                                    'quality')),
+    'files': (('path',), ('session_id', 'take', 'device_id', 'kind', 'size', 'chunks', 'complete',
+                          'duration', 'updated_at', 'checksum', 'verified')),
+}
+# Columns only written when the row is first inserted. Writes that leave them
+# out only update a row that already exists.
+INSERT_ONLY = {'created_at', 'first_seen'}
+JSON_COLUMNS = {'readiness', 'capabilities', 'profile', 'quality'}
+# Columns added after the first release: (table, column, type), applied with ALTER TABLE
+MIGRATIONS = (
+    ('takes', 'state', 'TEXT'),
+    ('takes', 'stopped_at', 'REAL'),
+    ('takes', 'preroll', 'REAL'),
+    ('sessions', 'device_group', 'TEXT'),
+    ('files', 'checksum', 'TEXT'),
+    ('files', 'verified', 'TEXT'),
+    ('takes', 'quality', 'TEXT'),
+)
+
+
+class CatalogError(ValueError):
+    """Raised for invalid queries (unknown table/column, bad cursor)"""
+
+
+def _encode_cursor(*values):
+    return json.dumps(values, separators=(',', ':'))
+
+
+def _decode_cursor(cursor, length):
+    try:
+        values = json.loads(cursor)
+    except (TypeError, ValueError):
+        raise CatalogError('invalid cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise CatalogError('invalid cursor')
+    return values
+
+
+def _row_dict(row):
+    item = dict(row)
+    for column in JSON_COLUMNS.intersection(item):
+        if item[column] is not None:
+            item[column] = json.loads(item[column])
+    return item
+
+
+class Catalog:
+    def __init__(self, path, batch_size=WRITE_BATCH_SIZE, batch_delay=WRITE_BATCH_DELAY):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        # Real OS thread and queue even under eventlet, so commits never block the loop
+        self._threading = original_module('threading')
+        self._queue_module = original_module('queue')
+        self._queue = self._queue_module.Queue()
+        self._writer = None
+        self._start_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self.written = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._reader = self._connect()
+        self._reader.executescript(SCHEMA)
+        self._migrate(self._reader)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        # WAL makes NORMAL durable against application crashes
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @staticmethod
+    def _migrate(conn):
+        """Add columns missing from a catalog created by an older version"""
+        with conn:
+            for table, column, kind in MIGRATIONS:
+                existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {kind}')
+
+    def pending(self):
+        """Queued writes not yet committed"""
+        return self._queue.qsize()
+
+    # Writes (queued, applied by the writer thread)
+
+    def _enqueue(self, table, fields):
+        keys, columns = TABLES[table]
+        unknown = set(fields) - set(keys) - set(columns)
+        if unknown:
+            raise CatalogError(f'unknown {table} columns: {sorted(unknown)}')
+        if self._writer is None:
+            with self._start_lock:
+                if self._writer is None:
+                    self._writer = self._threading.Thread(target=self._write_loop,
+                                                          name='catalog-writer', daemon=True)
+                    self._writer.start()
+        self._queue.put((table, fields))
+
+    def record_session(self, session_id, **fields):
+        self._enqueue('sessions', dict(fields, session_id=session_id))
+
+    def record_device(self, device_id, **fields):
+        self._enqueue('devices', dict(fields, device_id=device_id))
+
+    def record_take(self, session_id, device_id, take=0, **fields):
+        self._enqueue('takes', dict(fields, session_id=session_id, device_id=device_id, take=take))
+
+    def record_file(self, path, **fields):
+        self._enqueue('files', dict(fields, path=path))
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is committed"""
+        if self._writer is None:
+            return True
+        done = self._threading.Event()
+        self._queue.put(('flush', done))
+        return done.wait(timeout)
+
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        self._reader.close()
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except self._queue_module.Empty:
+                    break
+            stop = batch[-1] is None
+            self._apply(conn, [item for item in batch if item is not None])
+            if stop:
+                conn.close()
+                return
+
+    def _apply(self, conn, batch):
+        # Flush waiters are released even if the batch fails
+        waiters = [fields for table, fields in batch if table == 'flush']
+        try:
+            with conn:
+                for table, fields in batch:
+                    if table != 'flush':
+                        self._upsert(conn, table, fields)
+            self.written += len(batch) - len(waiters)
+        except sqlite3.Error:
+            logger.exception('Catalog batch of %d writes failed', len(batch))
+        for waiter in waiters:
+            waiter.set()
+
+    @staticmethod
+    def _upsert(conn, table, fields):
+        keys, _ = TABLES[table]
+        values = {column: json.dumps(value) if column in JSON_COLUMNS and value is not None
+                  else value for column, value in fields.items()}
+        columns = list(values)
+        updates = [c for c in columns if c not in keys and c not in INSERT_ONLY]
+        if not INSERT_ONLY.intersection(TABLES[table][1]) <= set(columns):
+            # Partial update of an existing row (e.g. a session's status): the
+            # NOT NULL insert-only columns are missing, so it can't insert
+            if updates:
+                conn.execute(f'UPDATE {table} SET {", ".join(f"{c} = ?" for c in updates)} '
+                             f'WHERE {" AND ".join(f"{k} = ?" for k in keys)}',
+                             [values[c] for c in updates] + [values[k] for k in keys])
+            return
+        sql = (f'INSERT INTO {table} ({", ".join(columns)}) '
+               f'VALUES ({", ".join("?" for _ in columns)}) '
+               f'ON CONFLICT ({", ".join(keys)}) DO ')
+        if updates:
+            sql += 'UPDATE SET ' + ', '.join(f'{c} = excluded.{c}' for c in updates)
+        else:
+            sql += 'NOTHING'
+        conn.execute(sql, [values[c] for c in columns])
+
+    # Reads
+
+    def _query(self, sql, params=()):
+        with self._read_lock:
+            return [_row_dict(row) for row in self._reader.execute(sql, params).fetchall()]
+
+    @staticmethod
+    def _page_size(limit):
+        try:
+            limit = int(limit or DEFAULT_PAGE_SIZE)
+        except (TypeError, ValueError):
+            raise CatalogError('invalid limit')
+        return max(1, min(limit, MAX_PAGE_SIZE))
+
+    def list_sessions(self, limit=None, cursor=None):
+        """Newest sessions first; returns {'items': [...], 'next_cursor': str|None}"""
+        limit = self._page_size(limit)
+        sql = ('SELECT s.*, (SELECT COUNT(*) FROM files f WHERE f.session_id = s.session_id) '
+               'AS file_count FROM sessions s')
+        params = []
+        if cursor:
+            created_at, session_id = _decode_cursor(cursor, 2)
+            sql += ' WHERE (s.created_at, s.session_id) < (?, ?)'
+            params += [created_at, session_id]
+        sql += ' ORDER BY s.created_at DESC, s.session_id DESC LIMIT ?'
+        items = self._query(sql, params + [limit + 1])
+        return self._page(items, limit, ('created_at', 'session_id'))
+
+    def list_devices(self, limit=None, cursor=None):
+        """Most recently seen devices first"""
+        limit = self._page_size(limit)
+        sql = 'SELECT * FROM devices'
+        params = []
+        if cursor:
+            last_seen, device_id = _decode_cursor(cursor, 2)
+            sql += ' WHERE (COALESCE(last_seen, -1), device_id) < (?, ?)'
+            params += [last_seen, device_id]
+        sql += ' ORDER BY COALESCE(last_seen, -1) DESC, device_id DESC LIMIT ?'
+        items = self._query(sql, params + [limit + 1])
+        return self._page(items, limit, ('last_seen', 'device_id'))
+
+    def list_takes(self, device_id, limit=None, cursor=None):
+        """A device's takes, newest first"""
+        limit = self._page_size(limit)
+        sql = 'SELECT * FROM takes WHERE device_id = ?'
+        params = [device_id]
+        if cursor:
+            started_at, session_id, take = _decode_cursor(cursor, 3)
+            sql += ' AND (COALESCE(started_at, -1), session_id, take) < (?, ?, ?)'
+            params += [started_at, session_id, take]
+        sql += ' ORDER BY COALESCE(started_at, -1) DESC, session_id DESC, take DESC LIMIT ?'
+        items = self._query(sql, params + [limit + 1])
+        return self._page(items, limit, ('started_at', 'session_id', 'take'))
+
+    @staticmethod
+    def _page(items, limit, sort_key):
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            next_cursor = _encode_cursor(*(NO_TIME if last[column] is None else last[column]
+                                           for column in sort_key))
+        return {'items': items, 'next_cursor': next_cursor}
+
+    def get_session(self, session_id):
+        """One session with its takes and files, or None"""
+        sessions = self._query('SELECT * FROM sessions WHERE session_id = ?', (session_id,))
+        if not sessions:
+            return None
+        session = sessions[0]
+        session['takes'] = self._query(
+            'SELECT * FROM takes WHERE session_id = ? ORDER BY take, device_id', (session_id,))
+        session['files'] = self._query(
+            'SELECT * FROM files WHERE session_id = ? ORDER BY take, kind, device_id', (session_id,))
+        return session
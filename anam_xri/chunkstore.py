@@ -0,0 +1,318 @@
+"""Content-addressed storage and integrity checks for uploaded chunks.
+
+Every chunk is stored once, keyed by its BLAKE2b-128 digest, under
+``<root>/.chunks/<ab>/<digest>`` (written to a temporary file, then
+renamed). While uploads are in flight, a chunk that is already stored
+costs no disk space, for example when a phone resends it after a
+reconnect. Stored chunks only live until their take is assembled, so this
+does not reach across finished takes: the bytes then live on in the
+take's ``.webm`` alone, and the same footage uploaded again as another
+take is stored again. (A finished take resent to its own stream is
+acknowledged by ``ingest`` as duplicates and never written.)
+
+Each device's take links its chunks in through:
+
+* a staging directory ``<device_id>.chunks/`` holding one hard link per
+  sequence number, so the filesystem's link count says how many uploads
+  use a stored chunk;
+* an append-only manifest ``<device_id>.webm.manifest`` with one
+  ``<seq> <digest> <size>`` line per chunk.
+
+When the take is complete, ``assemble`` concatenates its chunks into
+``<device_id>.webm``. It re-hashes each chunk on the way, so a damaged
+chunk fails the assembly, and it computes the checksum of the whole file
+in the same pass. The staging links are then removed, and ``release``
+deletes stored chunks that no other upload links to. A chunk that another
+upload links at the same moment keeps its data through that link.
+
+``verify_stream`` checks one take file against its recorded checksum. For
+a file the indexer has since rewritten, the check uses the checksum in its
+``webm_index`` index instead. An unfinished upload is checked chunk by
+chunk. ``verify_session`` runs it for every stream of a session in
+parallel worker processes:
+
+    python -m anam_xri.chunkstore verify recordings/<session_id> [--workers N]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from . import webm_index
+
+CHUNKS_DIR = '.chunks'
+MANIFEST_SUFFIX = '.manifest'
+STAGING_SUFFIX = '.chunks'
+DIGEST_SIZE = 16
+# Block size for hashing and copying files
+READ_BLOCK_SIZE = 1024 * 1024
+
+VERIFIED = 'verified'
+INCOMPLETE = 'incomplete'
+CORRUPT = 'corrupt'
+MISSING = 'missing'
+# Complete uploads from before checksums were recorded
+UNKNOWN = 'unknown'
+
+
+class ChunkError(ValueError):
+    """Raised when a stored chunk is missing or doesn't match its digest"""
+
+
+def new_hash():
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+
+def file_digest(path):
+    digest = new_hash()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_path(stream_path):
+    return stream_path + MANIFEST_SUFFIX
+
+
+def staging_dir(stream_path):
+    return stream_path[:-len('.webm')] + STAGING_SUFFIX
+
+
+def staged_chunk(stream_path, seq):
+    return os.path.join(staging_dir(stream_path), str(seq))
+
+
+def append_manifest(stream_path, seq, digest, size):
+    with open(manifest_path(stream_path), 'a') as f:
+        f.write(f'{seq} {digest} {size}\n')
+
+
+def read_manifest(stream_path, next_seq):
+    """``[(seq, digest, size)]`` for chunks ``0..next_seq-1``.
+
+    Lines at or past ``next_seq`` were never committed; for a sequence
+    number written twice (a chunk that failed assembly and was resent) the
+    last line wins.
+    """
+    entries = {}
+    try:
+        with open(manifest_path(stream_path)) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 3:
+                    continue
+                seq = int(parts[0])
+                if seq < next_seq:
+                    entries[seq] = (seq, parts[1], int(parts[2]))
+    except FileNotFoundError:
+        pass
+    return [entries.get(seq, (seq, None, 0)) for seq in range(next_seq)]
+
+
+class ChunkStore:
+    def __init__(self, root):
+        self.root = os.path.join(root, CHUNKS_DIR)
+        # Bytes this process didn't write because the chunk was already stored
+        self.deduplicated_bytes = 0
+
+    def object_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _tmp_path(self):
+        return os.path.join(self.root, f'tmp-{os.getpid()}-{threading.get_ident()}')
+
+    def _link_existing(self, digest, link_path):
+        try:
+            os.link(self.object_path(digest), link_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _install(self, tmp_path, digest, link_path):
+        # Linked before it is published, so release() never sees it unused
+        os.link(tmp_path, link_path)
+        os.makedirs(os.path.dirname(self.object_path(digest)), exist_ok=True)
+        os.replace(tmp_path, self.object_path(digest))
+
+    def _prepare_link(self, link_path):
+        os.makedirs(os.path.dirname(link_path), exist_ok=True)
+        os.makedirs(self.root, exist_ok=True)
+        # A link left by an attempt that didn't commit
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+
+    def add(self, data, link_path):
+        """Store ``data`` (unless already stored) and link it at ``link_path``; returns its digest"""
+        digest = new_hash()
+        digest.update(data)
+        digest = digest.hexdigest()
+        self._prepare_link(link_path)
+        if self._link_existing(digest, link_path):
+            self.deduplicated_bytes += len(data)
+            return digest
+        tmp_path = self._tmp_path()
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        self._install(tmp_path, digest, link_path)
+        return digest
+
+    def discard(self, digest):
+        """Remove a stored chunk whatever links to it"""
+        try:
+            os.remove(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def release(self, digests):
+        """Delete stored chunks that no upload links to any more"""
+        for digest in set(digests):
+            path = self.object_path(digest)
+            try:
+                if os.stat(path).st_nlink <= 1:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def assemble(stream_path, entries):
+    """Concatenate staged chunks into ``stream_path``; returns the file's checksum.
+
+    Raises ``ChunkError`` (with the failing ``seq``) for a missing or
+    damaged chunk, leaving the existing file and staging untouched.
+    """
+    total = new_hash()
+    tmp_path = stream_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as out:
+            for seq, digest, _ in entries:
+                chunk = new_hash()
+                try:
+                    with open(staged_chunk(stream_path, seq), 'rb') as f:
+                        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+                            chunk.update(block)
+                            total.update(block)
+                            out.write(block)
+                except FileNotFoundError:
+                    raise ChunkError(seq)
+                if chunk.hexdigest() != digest:
+                    raise ChunkError(seq)
+        os.replace(tmp_path, stream_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return total.hexdigest()
+
+
+def remove_staging(stream_path):
+    directory = staging_dir(stream_path)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+def stream_labels(stream_path):
+    """(session_id, take, device_id) from a take file's path"""
+    directory, name = os.path.split(os.path.abspath(stream_path))
+    parent = os.path.basename(directory)
+    take = 0
+    if parent.startswith('take') and parent[4:].isdigit():
+        take = int(parent[4:])
+        directory = os.path.dirname(directory)
+    return os.path.basename(directory), take, name[:-len('.webm')]
+
+
+def find_streams(session_dir):
+    """Take files of every upload in a session, including unfinished ones"""
+    directories = [session_dir] + sorted(
+        os.path.join(session_dir, name) for name in os.listdir(session_dir)
+        if name.startswith('take') and os.path.isdir(os.path.join(session_dir, name)))
+    return [os.path.join(directory, name[:-len('.idx')])
+            for directory in directories for name in sorted(os.listdir(directory))
+            if name.endswith('.webm.idx')]
+
+
+def verify_stream(stream_path):
+    """Integrity status of one device's take: verified, incomplete, corrupt, missing or unknown"""
+    session_id, take, device_id = stream_labels(stream_path)
+    result = {'path': stream_path, 'session_id': session_id, 'take': take,
+              'device_id': device_id, 'detail': None}
+    try:
+        with open(stream_path + '.idx') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return dict(result, status=MISSING, detail='no upload state')
+
+    if not state.get('complete'):
+        entries = read_manifest(stream_path, state.get('next_seq', 0))
+        damaged = []
+        for seq, digest, _ in entries:
+            try:
+                if file_digest(staged_chunk(stream_path, seq)) != digest:
+                    damaged.append(seq)
+            except FileNotFoundError:
+                damaged.append(seq)
+        if damaged:
+            return dict(result, status=CORRUPT, detail=f'damaged chunks: {damaged}')
+        return dict(result, status=INCOMPLETE,
+                    detail=f'{len(entries)} chunks, {state.get("size", 0)} bytes received')
+
+    # The indexer may be swapping in a rewritten file
+    with webm_index.recording_lock(stream_path, shared=True):
+        try:
+            size = os.path.getsize(stream_path)
+        except FileNotFoundError:
+            return dict(result, status=MISSING, detail='file not found')
+        expected = state.get('checksum')
+        try:
+            with open(webm_index.index_path(stream_path)) as f:
+                index = json.load(f)
+            # Rewritten by the indexer: its checksum replaces the upload's
+            if index.get('digest') and index.get('size') == size:
+                expected = index['digest']
+        except (OSError, ValueError):
+            pass
+        if expected is None:
+            return dict(result, status=UNKNOWN, detail='no checksum recorded')
+        actual = file_digest(stream_path)
+        if actual != expected:
+            return dict(result, status=CORRUPT, detail=f'checksum {actual} != {expected}')
+        return dict(result, status=VERIFIED, detail=f'{size} bytes')
+
+
+def verify_session(session_dir, workers=None):
+    """``verify_stream`` for every upload of a session, in parallel processes"""
+    streams = find_streams(session_dir)
+    if not streams:
+        return []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(verify_stream, streams))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Content-addressed chunk store tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    verify = commands.add_parser('verify', help='check every upload of a session')
+    verify.add_argument('sessions', nargs='+', help='session directories')
+    verify.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for session_dir in args.sessions:
+        for result in verify_session(session_dir, args.workers):
+            print(f'{result["session_id"]} take {result["take"]} {result["device_id"]}: '
+                  f'{result["status"]} ({result["detail"]})')
+            failed = failed or result['status'] in (CORRUPT, MISSING)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
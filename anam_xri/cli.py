@@ -0,0 +1,79 @@
+"""Command-line entry point: ``python -m anam_xri <command>``.
+
+* ``serve`` runs the web server with the Bluetooth bridge in one process,
+  so Bluetooth devices share the web session (web only if Bluetooth isn't
+  available).
+* ``web`` runs just the web server (bridging Bluetooth only with
+  ``BLUETOOTH_ENABLED=1``).
+* ``bluetooth`` runs the standalone RFCOMM server with its own registry.
+
+Only the modules a command needs are imported, and ``prepare_environment``
+trims eventlet's import. Without ``--debug`` the server runs without
+Werkzeug's reloader, which would import and set up everything twice.
+"""
+import argparse
+import os
+import sys
+
+
+def prepare_environment():
+    """Defaults that make eventlet import faster; set them before importing the server"""
+    if sys.version_info < (3, 12):
+        # eventlet imports distutils; setuptools' replacement for it is far
+        # slower to import than the standard library's copy
+        os.environ.setdefault('SETUPTOOLS_USE_DISTUTILS', 'stdlib')
+    # Green DNS stays on: without it every lookup blocks the event loop. Its
+    # dnspython import can be skipped with EVENTLET_NO_GREENDNS=yes where the
+    # server makes no lookups (no shared backend, or one given by IP address).
+
+
+def run_web(args, bluetooth):
+    prepare_environment()
+    from . import server
+
+    app = server.create_app()
+    bluetooth = bluetooth or app.config['BLUETOOTH_ENABLED']
+    print("🎬 Synchronized Video Recording System")
+    print("=" * 50)
+    print(f"📱 Mobile clients: http://YOUR_IP:{args.port}")
+    print(f"🖥️  Admin dashboard: http://localhost:{args.port}/admin")
+    # With the reloader, only the child process that actually serves binds RFCOMM
+    if bluetooth and (not args.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        try:
+            print(f"🔵 Bluetooth devices: RFCOMM channel {server.start_bluetooth()}")
+        except (ImportError, OSError) as e:
+            print(f"🔵 Bluetooth unavailable ({e}); serving web clients only")
+    print("=" * 50)
+    server.socketio.run(app, host=args.host, port=args.port, debug=args.debug)
+
+
+def run_bluetooth():
+    from . import bluetooth_server
+    try:
+        bluetooth_server.main()
+    except ImportError as e:
+        sys.exit(f'Bluetooth needs pybluez ({e})')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m anam_xri',
+                                     description='Synchronized mobile video recording server')
+    commands = parser.add_subparsers(dest='command')
+    for name, help_text in (('serve', 'web server and Bluetooth bridge (default)'),
+                            ('web', 'web server only')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--host', default='0.0.0.0')
+        command.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+        command.add_argument('--debug', action='store_true',
+                             help='Flask debug mode with the auto-reloader and request log')
+    commands.add_parser('bluetooth', help='standalone Bluetooth RFCOMM server')
+    args = parser.parse_args(argv)
+
+    if args.command == 'bluetooth':
+        run_bluetooth()
+    elif args.command == 'web':
+        run_web(args, bluetooth=False)
+    else:
+        if args.command is None:
+            args = parser.parse_args(['serve'])
+        run_web(args, bluetooth=True)
@@ -0,0 +1,144 @@
+"""NTP-style clock offset estimation between the server and each device.
+
+The client sends bursts of timestamped pings. Each completed ping gives four
+timestamps (t0 client send, t1 server receive, t2 server send, t3 client
+receive), from which we derive a round trip time and a clock offset. Only the
+lowest-RTT samples are trusted, since queueing delay on congested Wi-Fi is
+asymmetric and inflates the offset error.
+
+Offsets are expressed as ``server_time - client_time`` in seconds.
+"""
+import math
+import time
+from collections import deque
+
+# Number of lowest-RTT samples used for a single estimate
+BEST_SAMPLES = 4
+# Samples read from one report; the client sends its best few of a burst of 10
+MAX_SAMPLES = 32
+# Number of past estimates kept for drift tracking
+HISTORY_SIZE = 16
+# Minimum time span (seconds) before a drift estimate is trusted
+MIN_DRIFT_SPAN = 20.0
+
+
+def compute_sample(t0, t1, t2, t3):
+    """Return (offset, rtt) for one ping/pong exchange"""
+    rtt = (t3 - t0) - (t2 - t1)
+    offset = ((t1 - t0) + (t2 - t3)) / 2.0
+    return offset, rtt
+
+
+class ClockEstimate:
+    """Offset, error bound and drift for a single device"""
+
+    def __init__(self):
+        self.offset = None
+        self.error_bound = None
+        self.rtt = None
+        self.drift = 0.0
+        self.reference_time = None
+        self.updated_at = None
+        self.history = deque(maxlen=HISTORY_SIZE)
+
+    @property
+    def synced(self):
+        return self.offset is not None
+
+    def update(self, samples, now=None):
+        """Update the estimate from raw [t0, t1, t2, t3] samples.
+
+        Only the first ``MAX_SAMPLES`` are read; samples with a missing or
+        non-finite timestamp are skipped. Returns False if none were usable.
+        """
+        now = time.time() if now is None else now
+        if not isinstance(samples, (list, tuple)):
+            return False
+        computed = []
+        for sample in samples[:MAX_SAMPLES]:
+            try:
+                t0, t1, t2, t3 = (float(v) for v in sample)
+            except (TypeError, ValueError):
+                continue
+            if not all(math.isfinite(t) for t in (t0, t1, t2, t3)):
+                continue
+            offset, rtt = compute_sample(t0, t1, t2, t3)
+            if rtt < 0:
+                continue
+            computed.append((rtt, offset, t1))
+
+        if not computed:
+            return False
+
+        computed.sort(key=lambda s: s[0])
+        best = computed[:BEST_SAMPLES]
+        min_rtt = best[0][0]
+        offsets = [s[1] for s in best]
+
+        # Median of the best samples; the error bound is half the best RTT
+        # widened by how much the kept samples disagree with each other.
+        offsets.sort()
+        mid = len(offsets) // 2
+        if len(offsets) % 2:
+            offset = offsets[mid]
+        else:
+            offset = (offsets[mid - 1] + offsets[mid]) / 2.0
+        spread = offsets[-1] - offsets[0]
+
+        self.history.append((best[0][2], offset))
+        self.offset = offset
+        self.rtt = min_rtt
+        self.error_bound = min_rtt / 2.0 + spread / 2.0
+        self.reference_time = best[0][2]
+        self.updated_at = now
+        self.drift = self._estimate_drift()
+        return True
+
+    def _estimate_drift(self):
+        """Least-squares slope of offset over server time (seconds/second)"""
+        if len(self.history) < 2:
+            return 0.0
+        times = [h[0] for h in self.history]
+        if times[-1] - times[0] < MIN_DRIFT_SPAN:
+            return self.drift
+        offsets = [h[1] for h in self.history]
+        mean_t = sum(times) / len(times)
+        mean_o = sum(offsets) / len(offsets)
+        denom = sum((t - mean_t) ** 2 for t in times)
+        if denom == 0:
+            return 0.0
+        return sum((t - mean_t) * (o - mean_o) for t, o in zip(times, offsets)) / denom
+
+    def offset_at(self, server_ts):
+        """Predicted offset at a server timestamp, including drift"""
+        if self.offset is None:
+            return None
+        return self.offset + self.drift * (server_ts - self.reference_time)
+
+    def to_device_time(self, server_ts):
+        """Convert a server timestamp to the device's local clock"""
+        offset = self.offset_at(server_ts)
+        if offset is None:
+            return None
+        return server_ts - offset
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild an estimate (without history) from ``as_dict`` output"""
+        estimate = cls()
+        data = data or {}
+        estimate.offset = data.get('offset')
+        estimate.error_bound = data.get('error_bound')
+        estimate.rtt = data.get('rtt')
+        estimate.drift = data.get('drift') or 0.0
+        estimate.reference_time = data.get('reference_time')
+        return estimate
+
+    def as_dict(self):
+        return {
+            'offset': self.offset,
+            'error_bound': self.error_bound,
+            'rtt': self.rtt,
+            'drift': self.drift,
+            'reference_time': self.reference_time,
+        }
@@ -0,0 +1,317 @@
+"""Blocking work offloaded from the event loop.
+
+Every Socket.IO handler runs on the single eventlet hub, so a handler that
+writes a large chunk or waits on SQLite delays everything else, including
+the start-command fan-out. Handlers instead hand blocking work to a
+``Dispatcher`` and return:
+
+* ``io`` is a bounded pool of real OS threads for file and database I/O.
+  Tasks that share a ``key`` (for example one upload stream) run one at a
+  time in submission order; unrelated keys run in parallel.
+* ``cpu`` is a process pool for CPU-heavy work (post-processing).
+
+Both pools apply backpressure: once ``max_pending`` tasks are queued or
+running, ``submit`` raises ``DispatchBusy`` instead of queueing more, so a
+flood of uploads fails fast with a retryable error rather than growing
+memory. Results come back to the loop through ``run_callbacks``, which a
+background task calls every few milliseconds; callbacks therefore run on
+the loop and may emit. ``call`` waits for a result cooperatively, for HTTP
+routes that must answer inline.
+
+``StallDetector`` watches the loop from an OS thread. The loop beats a
+heartbeat; when a beat is late by more than the threshold, the watcher logs
+what the loop thread is stuck in, and the late beat reports the stall.
+"""
+import collections
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .metrics import original_module
+
+logger = logging.getLogger(__name__)
+
+IO_WORKERS = 8
+# Tasks queued or running per pool before submit() refuses more
+MAX_PENDING = 256
+# How often call() checks for its result (seconds)
+CALL_POLL_INTERVAL = 0.002
+# How often the loop runs callbacks of finished tasks (seconds)
+CALLBACK_INTERVAL = 0.005
+# Event loop blocked longer than this is a stall (seconds)
+STALL_THRESHOLD = 0.1
+# Loop heartbeat period (seconds)
+HEARTBEAT_INTERVAL = 0.05
+# Frames of the blocked loop's stack included in a stall warning
+STALL_STACK_DEPTH = 8
+
+
+class DispatchBusy(RuntimeError):
+    """Raised when a pool already has ``max_pending`` tasks"""
+
+
+class Task:
+    __slots__ = ('pool', 'fn', 'args', 'key', 'callback', 'queued_at', 'started_at',
+                 'finished_at', 'result', 'error', 'done')
+
+    def __init__(self, pool, fn, args, key, callback):
+        self.pool = pool
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.callback = callback
+        self.queued_at = time.monotonic()
+        self.started_at = self.finished_at = None
+        self.result = self.error = None
+        self.done = False
+
+    @property
+    def wait_time(self):
+        return self.started_at - self.queued_at
+
+    @property
+    def run_time(self):
+        return self.finished_at - self.started_at
+
+
+class ThreadPool:
+    """OS-thread pool with per-key ordering and a pending-task cap"""
+
+    def __init__(self, name, workers, max_pending, completions):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rejected = 0
+        # Real threads and queues even under eventlet, so work never runs on the hub
+        self._threading = original_module('threading')
+        self._queue = original_module('queue').Queue()
+        self._completions = completions
+        self._lock = self._threading.Lock()
+        # key -> tasks waiting behind the one currently queued or running
+        self._keyed = {}
+        self._pending = 0
+        self._threads = []
+
+    def depth(self):
+        """Tasks queued or running"""
+        return self._pending
+
+    def submit(self, fn, *args, key=None, callback=None, force=False):
+        """Queue ``fn(*args)``; ``callback(result, error)`` later runs on the loop.
+
+        ``force`` accepts the task even when the pool is full, for small
+        writes that must not be dropped.
+        """
+        task = Task(self.name, fn, args, key, callback)
+        with self._lock:
+            if self._pending >= self.max_pending and not force:
+                self.rejected += 1
+                raise DispatchBusy(f'{self.name} pool has {self._pending} tasks pending')
+            self._pending += 1
+            if key is not None:
+                waiting = self._keyed.get(key)
+                if waiting is not None:
+                    waiting.append(task)
+                    return task
+                self._keyed[key] = collections.deque()
+            if len(self._threads) < self.workers:
+                thread = self._threading.Thread(target=self._run, daemon=True,
+                                                name=f'dispatch-{self.name}-{len(self._threads)}')
+                self._threads.append(thread)
+                thread.start()
+        self._queue.put(task)
+        return task
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            task.started_at = time.monotonic()
+            try:
+                task.result = task.fn(*task.args)
+            except Exception as e:
+                task.error = e
+            task.finished_at = time.monotonic()
+            following = None
+            with self._lock:
+                self._pending -= 1
+                if task.key is not None:
+                    waiting = self._keyed[task.key]
+                    if waiting:
+                        following = waiting.popleft()
+                    else:
+                        del self._keyed[task.key]
+            if following is not None:
+                self._queue.put(following)
+            task.done = True
+            self._completions.put(task)
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        self._threads = []
+
+
+class ProcessPool:
+    """Process pool with a pending-job cap; returns concurrent futures"""
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rejected = 0
+        self._executor = None
+        self._futures = set()
+
+    def depth(self):
+        return len(self._futures)
+
+    def submit(self, fn, *args):
+        if len(self._futures) >= self.max_pending:
+            self.rejected += 1
+            raise DispatchBusy(f'cpu pool has {len(self._futures)} jobs pending')
+        # Created lazily so importing the app doesn't fork workers
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        future = self._executor.submit(fn, *args)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return future
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _waited(result, error):
+    pass
+
+
+class Dispatcher:
+    def __init__(self, io_workers=IO_WORKERS, cpu_workers=None, max_pending=MAX_PENDING,
+                 sleep=time.sleep):
+        self._queue_module = original_module('queue')
+        self._completions = self._queue_module.Queue()
+        self.io = ThreadPool('io', io_workers, max_pending, self._completions)
+        self.cpu = ProcessPool(cpu_workers or os.cpu_count() or 1, max_pending)
+        # Cooperative sleep of the caller's event loop (socketio.sleep)
+        self.sleep = sleep
+
+    def submit(self, fn, *args, key=None, callback=None, force=False):
+        """Run ``fn(*args)`` on the I/O pool"""
+        return self.io.submit(fn, *args, key=key, callback=callback, force=force)
+
+    def call(self, fn, *args, key=None):
+        """Run ``fn(*args)`` on the I/O pool and wait for it without blocking the loop"""
+        # The caller sees the error, so run_callbacks doesn't log it
+        task = self.io.submit(fn, *args, key=key, callback=_waited)
+        while not task.done:
+            self.sleep(CALL_POLL_INTERVAL)
+        if task.error is not None:
+            raise task.error
+        return task.result
+
+    def run_callbacks(self):
+        """Run callbacks of finished I/O tasks on the calling thread; returns the tasks"""
+        finished = []
+        while True:
+            try:
+                task = self._completions.get_nowait()
+            except self._queue_module.Empty:
+                return finished
+            finished.append(task)
+            if task.callback is None:
+                if task.error is not None:
+                    logger.error('Offloaded %s failed', getattr(task.fn, '__name__', task.fn),
+                                 exc_info=task.error)
+                continue
+            try:
+                task.callback(task.result, task.error)
+            except Exception:
+                logger.exception('Dispatch callback for %s failed',
+                                 getattr(task.fn, '__name__', task.fn))
+
+    def depths(self):
+        return {'io': self.io.depth(), 'cpu': self.cpu.depth()}
+
+    def shutdown(self):
+        self.io.shutdown()
+        self.cpu.shutdown()
+
+
+class StallDetector:
+    """Reports event-loop stalls longer than ``threshold`` seconds"""
+
+    def __init__(self, threshold=STALL_THRESHOLD, interval=HEARTBEAT_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._last_beat = None
+        self._reported = False
+        self._thread = None
+        self._stop = None
+        self._target = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start watching the calling (event-loop) thread"""
+        if self.running:
+            return False
+        os_threading = original_module('threading')
+        self._target = os_threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop = os_threading.Event()
+        self._thread = os_threading.Thread(target=self._watch, name='stall-detector',
+                                           daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._stop.set()
+        self._thread.join()
+        return True
+
+    def beat(self):
+        """Called by the loop every ``interval``; returns how late this beat was"""
+        now = time.monotonic()
+        last, self._last_beat = self._last_beat, now
+        if last is None:
+            return 0.0
+        lag = max(0.0, now - last - self.interval)
+        if lag > self.threshold:
+            self.stalls += 1
+            self.max_lag = max(self.max_lag, lag)
+            logger.warning('Event loop was blocked for %.0f ms', lag * 1000)
+        self._reported = False
+        return lag
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            late = time.monotonic() - self._last_beat - self.interval
+            if late > self.threshold and not self._reported:
+                self._reported = True
+                logger.warning('Event loop blocked for %.0f ms so far in:\n%s',
+                               late * 1000, self.loop_stack())
+
+    def loop_stack(self, depth=STALL_STACK_DEPTH):
+        """Innermost frames of the loop thread, innermost last"""
+        frame = sys._current_frames().get(self._target)
+        lines = []
+        while frame is not None and len(lines) < depth:
+            code = frame.f_code
+            lines.append(f'  {code.co_name} ({code.co_filename}:{frame.f_lineno})')
+            frame = frame.f_back
+        return '\n'.join(reversed(lines))
+
+    def status(self):
+        return {'running': self.running, 'threshold': self.threshold,
+                'stalls': self.stalls, 'max_lag': self.max_lag}
@@ -0,0 +1,218 @@
+"""Chunked upload ingest for MediaRecorder output.
+
+Each device streams its recording as numbered chunks, which end up in
+``<root>/<session_id>/<device_id>.webm``. Chunks must arrive in sequence;
+duplicates are acknowledged without being written again and gaps are
+rejected with the sequence number the server expects next, so a client that
+reconnects simply resumes from there. Only one chunk is held in memory at a
+time. Calls for one stream must not overlap; the server runs them on its
+I/O pool keyed by ``stream_path``. Cached stream state is dropped by
+``forget`` once a stream completes, and by ``sweep`` once it has been idle
+for ``STREAM_IDLE_TIMEOUT`` (a phone that never finishes its upload).
+
+Chunks go to a content-addressed ``chunkstore.ChunkStore`` and are linked
+into the take through its manifest, so identical chunks of uploads in
+flight are stored once.
+``finalize`` assembles the file once every chunk has arrived and records
+its checksum. If a chunk turns out to be damaged, the stream rewinds to it
+and the client resends from there.
+
+A small ``.idx`` sidecar next to each file records the next expected
+sequence number, the committed byte size and, once complete, the checksum.
+A chunk is committed when the sidecar says so; a crash before that leaves
+a staged link and manifest line that the resent chunk replaces. Once a
+stream is complete it is never written again: every later chunk is a
+duplicate, because the indexer may already have rewritten the file.
+
+The first take of a session lives directly in the session directory; later
+takes get ``<session_id>/take<N>/`` so each take directory is a complete
+input for post-processing.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+from . import chunkstore
+
+# Largest chunk accepted from a single upload
+MAX_CHUNK_BYTES = 8 * 1024 * 1024
+# Seconds without a call before a stream's cached state is dropped; the
+# sidecar stays on disk, so a late chunk just reloads it
+STREAM_IDLE_TIMEOUT = 600
+
+_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+STATUS_OK = 'ok'
+STATUS_DUPLICATE = 'duplicate'
+STATUS_OUT_OF_ORDER = 'out_of_order'
+
+
+class IngestError(ValueError):
+    """Raised for invalid ids or oversized chunks"""
+
+
+def validate_id(value):
+    value = str(value or '')
+    if not _ID_PATTERN.match(value):
+        raise IngestError(f'invalid id: {value!r}')
+    return value
+
+
+def validate_take(value):
+    try:
+        take = int(value or 0)
+    except (TypeError, ValueError):
+        raise IngestError(f'invalid take: {value!r}')
+    if take < 0:
+        raise IngestError(f'invalid take: {value!r}')
+    return take
+
+
+class ChunkIngest:
+    def __init__(self, root, idle_timeout=STREAM_IDLE_TIMEOUT):
+        self.root = root
+        self.store = chunkstore.ChunkStore(root)
+        self.idle_timeout = idle_timeout
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._streams)
+
+    def take_dir(self, session_id, take=0):
+        take = validate_take(take)
+        session_dir = os.path.join(self.root, validate_id(session_id))
+        return session_dir if take == 0 else os.path.join(session_dir, f'take{take}')
+
+    def stream_path(self, session_id, device_id, take=0):
+        return os.path.join(self.take_dir(session_id, take), validate_id(device_id) + '.webm')
+
+    def _index_path(self, path):
+        return path + '.idx'
+
+    def _state(self, session_id, device_id, take=0):
+        key = (validate_id(session_id), validate_id(device_id), validate_take(take))
+        with self._lock:
+            state = self._streams.get(key)
+        if state is None:
+            path = self.stream_path(*key)
+            state = {'path': path, 'next_seq': 0, 'size': 0, 'complete': False}
+            try:
+                with open(self._index_path(path)) as f:
+                    state.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+            with self._lock:
+                self._streams[key] = state
+        state['used_at'] = time.time()
+        return state
+
+    def _commit(self, state):
+        index_path = self._index_path(state['path'])
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'next_seq': state['next_seq'],
+                'size': state['size'],
+                'complete': state['complete'],
+                'checksum': state.get('checksum')
+            }, f)
+        os.replace(tmp_path, index_path)
+
+    def next_seq(self, session_id, device_id, take=0):
+        state = self._state(session_id, device_id, take)
+        return {'next_seq': state['next_seq'], 'size': state['size'],
+                'complete': state['complete'], 'checksum': state.get('checksum')}
+
+    def _check_seq(self, state, seq):
+        if seq < state['next_seq'] or state['complete']:
+            return STATUS_DUPLICATE
+        if seq > state['next_seq']:
+            return STATUS_OUT_OF_ORDER
+        return STATUS_OK
+
+    def _record(self, state, seq, digest, size):
+        chunkstore.append_manifest(state['path'], seq, digest, size)
+        state['size'] += size
+        state['next_seq'] = seq + 1
+        self._commit(state)
+
+    def append(self, session_id, device_id, seq, data, take=0):
+        """Append one in-memory chunk. Returns (status, next_seq)."""
+        state = self._state(session_id, device_id, take)
+        seq = int(seq)
+        if len(data) > MAX_CHUNK_BYTES:
+            raise IngestError('chunk too large')
+
+        status = self._check_seq(state, seq)
+        if status != STATUS_OK:
+            return status, state['next_seq']
+
+        digest = self.store.add(data, chunkstore.staged_chunk(state['path'], seq))
+        self._record(state, seq, digest, len(data))
+        return STATUS_OK, state['next_seq']
+
+    def finalize(self, session_id, device_id, total_chunks, take=0):
+        """Assemble and mark a stream complete if every chunk up to total_chunks arrived"""
+        state = self._state(session_id, device_id, take)
+        if state['complete'] or state['next_seq'] < int(total_chunks):
+            return self.next_seq(session_id, device_id, take)
+        entries = chunkstore.read_manifest(state['path'], state['next_seq'])
+        try:
+            checksum = chunkstore.assemble(state['path'], entries)
+        except chunkstore.ChunkError as e:
+            seq = e.args[0]
+            if entries[seq][1] is not None:
+                # The stored copy is damaged too: don't link it again
+                self.store.discard(entries[seq][1])
+            state['next_seq'] = seq
+            state['size'] = sum(size for _, _, size in entries[:seq])
+            self._commit(state)
+            return self.next_seq(session_id, device_id, take)
+        state['complete'] = True
+        state['checksum'] = checksum
+        self._commit(state)
+        chunkstore.remove_staging(state['path'])
+        self.store.release(digest for _, digest, _ in entries)
+        return self.next_seq(session_id, device_id, take)
+
+    def metadata_path(self, session_id, device_id=None, take=0):
+        """``session.json`` for the take, or ``<device_id>.meta.json``"""
+        name = validate_id(device_id) + '.meta.json' if device_id else 'session.json'
+        return os.path.join(self.take_dir(session_id, take), name)
+
+    def update_metadata(self, session_id, fields, device_id=None, take=0):
+        """Merge fields into a take's session or device metadata file"""
+        path = self.metadata_path(session_id, device_id, take)
+        metadata = self.read_metadata(session_id, device_id, take)
+        metadata.update(fields)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, path)
+        return metadata
+
+    def read_metadata(self, session_id, device_id=None, take=0):
+        try:
+            with open(self.metadata_path(session_id, device_id, take)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def forget(self, session_id, device_id, take=0):
+        """Drop cached state for a finished stream (the sidecar stays on disk)"""
+        with self._lock:
+            self._streams.pop((session_id, device_id, validate_take(take)), None)
+
+    def sweep(self, now=None):
+        """Drop cached state of streams idle for ``idle_timeout``. Returns their keys."""
+        now = time.time() if now is None else now
+        with self._lock:
+            removed = [key for key, state in self._streams.items()
+                       if now - state['used_at'] > self.idle_timeout]
+            for key in removed:
+                del self._streams[key]
+        return removed
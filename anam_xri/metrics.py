@@ -0,0 +1,275 @@
+"""In-process metrics with Prometheus text exposition, plus a sampling profiler.
+
+Counters, gauges and histograms are plain Python objects updated inline on
+the hot path (a dict lookup and an addition under a lock). ``render()``
+produces the Prometheus text format for the ``/metrics`` endpoint. Gauges
+can be backed by a callback so values such as the device count are read at
+scrape time rather than maintained on every change.
+
+``SamplingProfiler`` periodically captures the stack of the event-loop
+thread from a real OS thread and aggregates them as collapsed stacks
+(flame graph input). It is off by default and can be switched on at runtime.
+"""
+import collections
+import functools
+import importlib
+import sys
+import threading
+import time
+
+# Latency buckets (seconds) tuned for sub-millisecond to multi-second handlers
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = collections.defaultdict(float)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        for key, value in list(self._values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        # callback() returns a number, or {label_tuple: number} for labelled gauges
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        values = self._values
+        if self.callback is not None:
+            result = self.callback()
+            values = result if isinstance(result, dict) else {(): result}
+        for key, value in list(values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._counts = {}
+        self._sums = collections.defaultdict(float)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] += value
+
+    def time(self, **labels):
+        """Context manager observing the elapsed time of its block"""
+        return _Timer(self, labels)
+
+    def samples(self):
+        for key, counts in list(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       _format_labels(self.labelnames, key, ('le', _format_value(bound))),
+                       cumulative)
+            yield self.name + '_count', _format_labels(self.labelnames, key), cumulative
+            yield self.name + '_sum', _format_labels(self.labelnames, key), self._sums[key]
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'duplicate metric {metric.name}')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._add(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def instrument_event(event, counter, histogram):
+    """Decorator counting and timing a Socket.IO event handler"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args):
+            started = time.perf_counter()
+            try:
+                return handler(*args)
+            finally:
+                histogram.observe(time.perf_counter() - started, event=event)
+                counter.inc(event=event)
+        return wrapper
+    return decorator
+
+
+def original_module(name):
+    """The unpatched stdlib module, even when eventlet has monkey patched it"""
+    # Nothing can be patched before eventlet is imported; don't import it just to check
+    patcher = sys.modules.get('eventlet.patcher')
+    if patcher is None:
+        return importlib.import_module(name)
+    return patcher.original(name)
+
+
+class SamplingProfiler:
+    """Collapsed-stack sampler for one thread (the event loop by default)"""
+
+    def __init__(self, max_stacks=5000):
+        self.max_stacks = max_stacks
+        self.interval = None
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._thread = None
+        self._stop = None
+        self._target = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=0.005, thread_id=None):
+        if self.running:
+            return False
+        os_threading, os_time = original_module('threading'), original_module('time')
+        self.interval = interval
+        self._target = thread_id or threading.main_thread().ident
+        self._stop = os_threading.Event()
+        self._thread = os_threading.Thread(target=self._run, args=(os_time,),
+                                           name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._stop.set()
+        self._thread.join()
+        return True
+
+    def reset(self):
+        self.samples = 0
+        self.stacks.clear()
+
+    def _run(self, os_time):
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename}:{frame.f_lineno})')
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                # Cap distinct stacks so a long session can't grow without bound
+                if key in self.stacks or len(self.stacks) < self.max_stacks:
+                    self.stacks[key] += 1
+                self.samples += 1
+            os_time.sleep(self.interval)
+
+    def collapsed(self):
+        """Stacks in the ``frame;frame;frame count`` format used by flamegraph tools"""
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+    def status(self):
+        return {'running': self.running, 'interval': self.interval,
+                'samples': self.samples, 'distinct_stacks': len(self.stacks)}
@@ -0,0 +1,90 @@
+"""Review playback of a take's recordings.
+
+``RecordingFiles`` keeps per-file metadata for the playback routes: size,
+modification time, a validator ETag and the cached ``webm_index`` index. A
+player issues many Range requests for one file, and each one costs a
+single ``stat``; the index JSON is read again only once the file has
+changed. Entries are evicted least recently used.
+
+``take_angles`` describes every complete upload of a take on one timeline:
+second 0 is when the earliest device started recording, and each angle's
+``offset`` is when it started, from the start times the devices reported
+(on the server clock). The admin player seeks angle *i* to ``t - offset_i``,
+so every angle shows the same moment.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from . import webm_index
+from .postprocess import load_session
+
+MAX_CACHED_FILES = 512
+# Read size for streaming files from servers without their own file wrapper
+PLAYBACK_BLOCK_SIZE = 256 * 1024
+
+
+class RecordingFiles:
+    def __init__(self, max_entries=MAX_CACHED_FILES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Metadata for ``path``, or None if it doesn't exist"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._entries.pop(path, None)
+            return None
+        version = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry['version'] == version:
+                self._entries.move_to_end(path)
+                return entry
+        entry = {
+            'version': version,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'etag': f'{stat.st_size:x}-{stat.st_mtime_ns:x}',
+            # None until the file has been indexed
+            'index': webm_index.load_index(path)
+        }
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+def take_angles(files, take_dir):
+    """Every complete upload of a take, with its offset on the take's timeline"""
+    session, clips = load_session(take_dir)
+    starts = [clip['started_at'] for clip in clips if clip['started_at'] is not None]
+    origin = min(starts) if starts else None
+    angles = []
+    for clip in clips:
+        entry = files.get(clip['path'])
+        if entry is None:
+            continue
+        index = entry['index']
+        angles.append({
+            'device_id': clip['device_id'],
+            'offset': (clip['started_at'] - origin
+                       if origin is not None and clip['started_at'] is not None else 0.0),
+            'duration': index['duration'] if index else None,
+            'seekable': index is not None,
+            'size': entry['size']
+        })
+    ends = [a['offset'] + a['duration'] for a in angles if a['duration'] is not None]
+    return {
+        'origin': origin,
+        # Where the take's shared start falls on the timeline (after any pre-roll)
+        'start': (session['start_time'] - origin
+                  if origin is not None and session.get('start_time') else 0.0),
+        'duration': max(ends) if ends else None,
+        'angles': angles
+    }
@@ -0,0 +1,567 @@
+"""Multi-angle alignment and stitching of session recordings.
+
+For a take directory (``recordings/<session_id>/`` for the first take,
+``recordings/<session_id>/take<N>/`` for later ones) this lines up every
+device's upload:
+
+1. Coarse alignment from the start times each device reported, converted to
+   the server clock (``<device_id>.meta.json``).
+2. Sub-frame refinement by cross-correlating a short window of each clip's
+   audio against a reference angle (needs numpy; skipped otherwise).
+3. Trimming every clip to the common span into ``aligned/<device_id>.webm``
+   and, optionally, a grid mosaic ``aligned/mosaic.webm``.
+
+A paused MediaRecorder leaves the paused time out of its file, and each
+phone pauses and resumes at a slightly different moment. The pause and
+resume times each device reported (the ``events`` of its metadata) map
+server time to each clip's own timeline. The common span is then the
+stretches every angle was recording, and each clip is cut to those
+segments and joined back together.
+
+Before alignment each upload is made seekable by ``webm_index`` (Duration
+and Cues written in place), which also gives its duration without an
+ffprobe pass over every packet. The same stage runs on its own as an
+``index`` job as soon as an upload completes. ``verify`` jobs check one
+upload against its checksums (``chunkstore.verify_stream``). Verify and
+align jobs wait for a pending index job on their uploads, and every stage
+holds the file's ``webm_index.recording_lock`` while it reads or rewrites.
+
+All media work is done by ffmpeg subprocesses, so whole videos are never
+loaded into Python; audio for refinement is streamed from an ffmpeg pipe in
+fixed-size blocks. Sessions are processed by a process-pool job queue so
+several sessions run in parallel on all cores.
+
+Run standalone with ``python -m anam_xri.postprocess recordings/<session_id> [--mosaic]``.
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import chunkstore
+from . import webm_index
+
+# Only audio refinement needs numpy: imported on first use by load_numpy()
+np = None
+_numpy_missing = False
+
+# Audio used for refinement: sample rate, window length and search range
+REFINE_SAMPLE_RATE = 8000
+REFINE_WINDOW = 10.0
+REFINE_MAX_LAG = 0.5
+PCM_BLOCK_BYTES = 64 * 1024
+
+ALIGNED_DIR = 'aligned'
+# Stretches every angle recorded that are shorter than this are left out (seconds)
+MIN_SEGMENT = 0.1
+# Finished jobs remembered for status queries
+MAX_FINISHED_JOBS = 200
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Job kinds: align a whole take, index one upload or verify one upload
+JOB_ALIGN = 'align'
+JOB_INDEX = 'index'
+JOB_VERIFY = 'verify'
+
+
+class PipelineError(RuntimeError):
+    """Raised when a session cannot be aligned"""
+
+
+def load_numpy():
+    """numpy, or None if it isn't installed"""
+    global np, _numpy_missing
+    if np is None and not _numpy_missing:
+        try:
+            import numpy
+        except ImportError:
+            _numpy_missing = True
+        else:
+            np = numpy
+    return np
+
+
+def require_tool(name):
+    path = shutil.which(name)
+    if path is None:
+        raise PipelineError(f'{name} not found on PATH')
+    return path
+
+
+def probe_duration(path):
+    """Container duration in seconds, via ffprobe (decodes if no Duration)"""
+    output = subprocess.run(
+        [require_tool('ffprobe'), '-v', 'error', '-show_entries', 'format=duration',
+         '-of', 'default=noprint_wrappers=1:nokey=1', path],
+        capture_output=True, text=True, check=True).stdout.strip()
+    try:
+        return float(output)
+    except ValueError:
+        # MediaRecorder output often has no Duration: count decoded packets
+        output = subprocess.run(
+            [require_tool('ffprobe'), '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'packet=pts_time', '-of', 'csv=p=0', path],
+            capture_output=True, text=True, check=True).stdout.split()
+        times = [float(t) for t in output if t and t != 'N/A']
+        if not times:
+            raise PipelineError(f'cannot determine duration of {path}')
+        return max(times)
+
+
+def clip_duration(path):
+    """Duration from the WebM index, making the file seekable first; ffprobe otherwise"""
+    try:
+        return webm_index.make_seekable(path)['duration']
+    except webm_index.WebMError:
+        return probe_duration(path)
+
+
+def index_recording(path, session_id, take, device_id):
+    """Index stage on its own, for one finished upload. Returns a summary dict."""
+    index = webm_index.make_seekable(path)
+    return {
+        'session_id': session_id,
+        'take': take,
+        'device_id': device_id,
+        'path': path,
+        'size': index['size'],
+        'duration': index['duration'],
+        'clusters': len(index['clusters']),
+        'cue_points': len(index['keyframes']),
+        'elapsed': index.get('elapsed', 0.0),
+    }
+
+
+def read_audio_window(path, start, duration, sample_rate=REFINE_SAMPLE_RATE):
+    """Mono 16-bit PCM for [start, start + duration), streamed from ffmpeg"""
+    process = subprocess.Popen(
+        [require_tool('ffmpeg'), '-v', 'error', '-ss', f'{start:.6f}', '-i', path,
+         '-t', f'{duration:.6f}', '-vn', '-ac', '1', '-ar', str(sample_rate),
+         '-f', 's16le', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    blocks = []
+    try:
+        while True:
+            block = process.stdout.read(PCM_BLOCK_BYTES)
+            if not block:
+                break
+            blocks.append(np.frombuffer(block, dtype='<i2'))
+    finally:
+        process.stdout.close()
+        process.wait()
+    if not blocks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(blocks).astype(np.float32)
+
+
+def estimate_lag(reference, other, sample_rate=REFINE_SAMPLE_RATE, max_lag=REFINE_MAX_LAG):
+    """Seconds by which ``other`` lags ``reference``, with sub-sample precision.
+
+    Uses FFT cross-correlation restricted to +/- max_lag and parabolic
+    interpolation around the peak. Returns None if either signal is silent.
+    """
+    if len(reference) == 0 or len(other) == 0:
+        return None
+    reference = reference - reference.mean()
+    other = other - other.mean()
+    if not reference.any() or not other.any():
+        return None
+
+    size = 1 << int(math.ceil(math.log2(len(reference) + len(other))))
+    spectrum = np.fft.rfft(other, size) * np.conj(np.fft.rfft(reference, size))
+    correlation = np.fft.irfft(spectrum, size)
+
+    max_shift = int(max_lag * sample_rate)
+    # Lags 0..max_shift are at the start, negative lags wrap to the end
+    candidates = np.concatenate((correlation[-max_shift:], correlation[:max_shift + 1]))
+    peak = int(np.argmax(candidates))
+    shift = float(peak - max_shift)
+    if 0 < peak < len(candidates) - 1:
+        y0, y1, y2 = candidates[peak - 1], candidates[peak], candidates[peak + 1]
+        denom = y0 - 2 * y1 + y2
+        if denom != 0:
+            shift += float(0.5 * (y0 - y2) / denom)
+    return shift / sample_rate
+
+
+def load_session(session_dir):
+    """Collect complete device uploads and their reported start times"""
+    session = {}
+    try:
+        with open(os.path.join(session_dir, 'session.json')) as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    clips = []
+    for name in sorted(os.listdir(session_dir)):
+        if not name.endswith('.webm'):
+            continue
+        device_id = name[:-len('.webm')]
+        path = os.path.join(session_dir, name)
+        try:
+            with open(path + '.idx') as f:
+                if not json.load(f).get('complete'):
+                    continue
+        except (OSError, ValueError):
+            continue
+        meta = {}
+        try:
+            with open(os.path.join(session_dir, device_id + '.meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            pass
+        clips.append({
+            'device_id': device_id,
+            'path': path,
+            'started_at': meta.get('started_at', session.get('start_time')),
+            'events': meta.get('events', []),
+        })
+    return session, clips
+
+
+def recording_intervals(clip):
+    """``[(start, end)]`` on the server clock during which a clip was recording.
+
+    Built from its start time and reported pause/resume events. The clip's
+    duration decides where the last interval ends, since the file holds
+    exactly the recorded time.
+    """
+    intervals = []
+    start = clip['started_at']
+    for event in sorted(clip.get('events', ()), key=lambda event: event['at']):
+        if event['at'] < clip['started_at']:
+            continue
+        if event['state'] == 'paused' and start is not None:
+            intervals.append((start, event['at']))
+            start = None
+        elif event['state'] == 'recording' and start is None:
+            start = event['at']
+    if start is not None:
+        intervals.append((start, math.inf))
+
+    remaining = clip['duration']
+    for i, (begin, end) in enumerate(intervals):
+        if i == len(intervals) - 1 or end - begin >= remaining:
+            # A clip that ended while paused still holds all of its media
+            intervals[i] = (begin, begin + remaining)
+            return intervals[:i + 1]
+        remaining -= end - begin
+    return intervals
+
+
+def media_time(intervals, at):
+    """Position in a clip of server time ``at`` (the pause point while paused)"""
+    return sum(max(0.0, min(end, at) - begin) for begin, end in intervals)
+
+
+def common_segments(interval_lists, start):
+    """Stretches from ``start`` on during which every clip was recording"""
+    segments = [(start, math.inf)]
+    for intervals in interval_lists:
+        segments = [(max(a, b), min(a_end, b_end))
+                    for a, a_end in segments for b, b_end in intervals
+                    if max(a, b) < min(a_end, b_end)]
+    return [(begin, end) for begin, end in segments if end - begin >= MIN_SEGMENT]
+
+
+def mosaic_layout(count):
+    """xstack layout string for a near-square grid of equally sized tiles"""
+    columns = int(math.ceil(math.sqrt(count)))
+    layout = []
+    for i in range(count):
+        row, column = divmod(i, columns)
+        x = '+'.join(['w0'] * column) or '0'
+        y = '+'.join(['h0'] * row) or '0'
+        layout.append(f'{x}_{y}')
+    return '|'.join(layout)
+
+
+def cut_clip(path, cuts, output):
+    """Re-encode ``[(start, length)]`` of a clip, joined in order, into ``output``"""
+    parts = [output] if len(cuts) == 1 else [f'{output}.part{i}.webm' for i in range(len(cuts))]
+    listing = output + '.parts.txt'
+    try:
+        for (start, length), part in zip(cuts, parts):
+            # Re-encode so the cut is frame-accurate rather than keyframe-aligned
+            subprocess.run(
+                [require_tool('ffmpeg'), '-v', 'error', '-y', '-ss', f'{start:.6f}',
+                 '-i', path, '-t', f'{length:.6f}', '-c:v', 'libvpx', '-b:v', '2M',
+                 '-deadline', 'realtime', '-c:a', 'libopus', part],
+                check=True)
+        if len(parts) > 1:
+            # Parts share their encoding, so the concat demuxer joins them without decoding
+            with open(listing, 'w') as f:
+                for part in parts:
+                    escaped = os.path.abspath(part).replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+            subprocess.run(
+                [require_tool('ffmpeg'), '-v', 'error', '-y', '-f', 'concat', '-safe', '0',
+                 '-i', listing, '-c', 'copy', output],
+                check=True)
+    finally:
+        if len(parts) > 1:
+            for leftover in parts + [listing]:
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+
+def render_mosaic(paths, output, tile_height=360):
+    inputs = []
+    for path in paths:
+        inputs += ['-i', path]
+    scaled = ''.join(f'[{i}:v]scale=-2:{tile_height},setsar=1[v{i}];' for i in range(len(paths)))
+    stacked = ''.join(f'[v{i}]' for i in range(len(paths)))
+    if len(paths) == 1:
+        graph = f'{scaled}[v0]null[out]'
+    else:
+        graph = f'{scaled}{stacked}xstack=inputs={len(paths)}:layout={mosaic_layout(len(paths))}:fill=black[out]'
+    subprocess.run(
+        [require_tool('ffmpeg'), '-v', 'error', '-y'] + inputs +
+        ['-filter_complex', graph, '-map', '[out]', '-c:v', 'libvpx', '-b:v', '4M',
+         '-deadline', 'realtime', '-an', output],
+        check=True)
+
+
+def process_session(session_dir, mosaic=False, refine=True):
+    """Align, trim and optionally stitch one session. Returns a summary dict.
+
+    Runs inside a worker process; everything it returns must be picklable.
+    """
+    started = time.time()
+    require_tool('ffmpeg')
+    session, clips = load_session(session_dir)
+    clips = [c for c in clips if c['started_at'] is not None]
+    if not clips:
+        raise PipelineError('no complete uploads with start times')
+
+    for clip in clips:
+        clip['duration'] = clip_duration(clip['path'])
+    # Indexed above; nothing rewrites the clips while ffmpeg reads them
+    with contextlib.ExitStack() as locks:
+        for clip in clips:
+            locks.enter_context(webm_index.recording_lock(clip['path'], shared=True))
+        return _align(session_dir, session, clips, mosaic, refine, started)
+
+
+def _align(session_dir, session, clips, mosaic, refine, started):
+    """The rest of process_session, with the clips' durations known"""
+    # Coarse: skip the head of clips that started before the latest starter
+    common_start = max(c['started_at'] for c in clips)
+    for clip in clips:
+        clip['trim'] = common_start - clip['started_at']
+        clip['refinement'] = 0.0
+
+    refined = False
+    shift = 0.0
+    if refine and len(clips) > 1 and load_numpy() is not None:
+        reference = clips[0]
+        window = min(REFINE_WINDOW, min(c['duration'] - c['trim'] for c in clips))
+        if window > 2 * REFINE_MAX_LAG:
+            ref_audio = read_audio_window(reference['path'], reference['trim'], window)
+            for clip in clips[1:]:
+                lag = estimate_lag(ref_audio, read_audio_window(clip['path'], clip['trim'], window))
+                if lag is not None:
+                    # The same sound appears `lag` seconds later in this clip
+                    clip['refinement'] = lag
+                    clip['trim'] += lag
+            # A negative trim means the reference must be cut instead
+            base = min(c['trim'] for c in clips)
+            if base < 0:
+                shift = -base
+                for clip in clips:
+                    clip['trim'] -= base
+            refined = True
+
+    # Server time at which the trimmed clips begin. Each clip's recording
+    # intervals move by its refinement, so segments map to its own timeline.
+    origin = common_start + shift
+    for clip in clips:
+        intervals = recording_intervals(clip)
+        offset = clip['trim'] - media_time(intervals, origin)
+        clip['intervals'] = [(begin - offset, end - offset) for begin, end in intervals]
+    segments = common_segments([c['intervals'] for c in clips], origin)
+    span = sum(end - begin for begin, end in segments)
+    if span <= 0:
+        raise PipelineError('clips do not overlap')
+
+    output_dir = os.path.join(session_dir, ALIGNED_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+    for clip in clips:
+        clip['cuts'] = [(media_time(clip['intervals'], begin), end - begin)
+                        for begin, end in segments]
+        clip['output'] = os.path.join(output_dir, clip['device_id'] + '.webm')
+        cut_clip(clip['path'], clip['cuts'], clip['output'])
+
+    mosaic_path = None
+    if mosaic:
+        mosaic_path = os.path.join(output_dir, 'mosaic.webm')
+        render_mosaic([c['output'] for c in clips], mosaic_path)
+
+    # Seconds of the aligned clips before the take's start (pre-roll every angle kept)
+    preroll = max(0.0, session['start_time'] - origin) if session.get('start_time') else 0.0
+    summary = {
+        'session_id': session.get('session_id', os.path.basename(session_dir.rstrip(os.sep))),
+        'take': session.get('take', 0),
+        'duration': span,
+        'preroll': preroll,
+        # Stretches every angle recorded, in seconds from the aligned start
+        'segments': [[begin - origin, end - origin] for begin, end in segments],
+        'refined': refined,
+        'mosaic': mosaic_path,
+        'elapsed': time.time() - started,
+        'clips': [{
+            'device_id': c['device_id'],
+            'source': c['path'],
+            'source_duration': c['duration'],
+            'trim': c['trim'],
+            'refinement': c['refinement'],
+            'cuts': c['cuts'],
+            'output': c['output'],
+        } for c in clips],
+    }
+    with open(os.path.join(output_dir, 'alignment.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+class PipelineQueue:
+    """Process-pool job queue; one alignment job per session, one index job per upload.
+
+    ``executor`` is any object with ``submit(fn, *args)`` returning a future,
+    such as the server's shared CPU pool; by default the queue makes its own.
+    A verify or align job submitted while one of its uploads has an index job
+    pending stays queued here, and is handed to the pool by ``poll`` once
+    that job has finished.
+    """
+
+    def __init__(self, max_workers=None, executor=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = executor
+        self._owns_executor = executor is None
+        self.jobs = {}
+        # Upload path -> its pending index job
+        self._indexing = {}
+
+    def _pool(self):
+        # Created lazily so importing the app doesn't fork workers
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, session_id, session_dir, mosaic=False):
+        session_dir = os.path.normpath(session_dir)
+        after = [job for path, job in self._indexing.items()
+                 if os.path.dirname(path) == session_dir]
+        return self._submit(session_id, JOB_ALIGN, process_session, session_dir, mosaic,
+                            after=after)
+
+    def submit_index(self, job_id, path, session_id, take, device_id):
+        job = self._submit(job_id, JOB_INDEX, index_recording, path, session_id, take, device_id)
+        self._indexing[os.path.normpath(path)] = job
+        return job
+
+    def submit_verify(self, job_id, path):
+        after = self._indexing.get(os.path.normpath(path))
+        return self._submit(job_id, JOB_VERIFY, chunkstore.verify_stream, path,
+                            after=[after] if after else [])
+
+    def _submit(self, job_id, kind, fn, *args, after=()):
+        job = self.jobs.get(job_id)
+        if job and job['status'] in (JOB_QUEUED, JOB_RUNNING):
+            return job
+        after = [other for other in after if other['status'] in (JOB_QUEUED, JOB_RUNNING)]
+        job = {'session_id': job_id, 'kind': kind, 'status': JOB_QUEUED, 'future': None,
+               'submitted_at': time.time(), 'result': None, 'error': None}
+        if after:
+            job['waiting'] = (after, fn, args)
+        else:
+            job['future'] = self._pool().submit(fn, *args)
+        self.jobs[job_id] = job
+        self._prune()
+        return job
+
+    def _start_waiting(self, job):
+        """Hand a waiting job to the pool once the jobs it waits for are finished"""
+        after, fn, args = job['waiting']
+        if any(other['status'] in (JOB_QUEUED, JOB_RUNNING) for other in after):
+            return False
+        del job['waiting']
+        try:
+            job['future'] = self._pool().submit(fn, *args)
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = JOB_FAILED
+            return True
+        return False
+
+    def _prune(self):
+        finished = [sid for sid, job in self.jobs.items() if job['status'] in (JOB_DONE, JOB_FAILED)]
+        for session_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[session_id]
+
+    def poll(self):
+        """Update job states; returns jobs whose status changed"""
+        changed = []
+        for job in self.jobs.values():
+            if job['status'] in (JOB_DONE, JOB_FAILED):
+                continue
+            if job['future'] is None:
+                if self._start_waiting(job):
+                    changed.append(job)
+                if job['future'] is None:
+                    continue
+            future = job['future']
+            if future.done():
+                try:
+                    job['result'] = future.result()
+                    job['status'] = JOB_DONE
+                except Exception as e:
+                    job['error'] = str(e)
+                    job['status'] = JOB_FAILED
+                changed.append(job)
+            elif job['status'] == JOB_QUEUED and future.running():
+                job['status'] = JOB_RUNNING
+                changed.append(job)
+        for path in [path for path, job in self._indexing.items()
+                     if job['status'] in (JOB_DONE, JOB_FAILED)]:
+            del self._indexing[path]
+        return changed
+
+    @staticmethod
+    def describe(job):
+        return {key: job[key] for key in ('session_id', 'kind', 'status', 'submitted_at', 'result',
+                                          'error')}
+
+    def shutdown(self):
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Align and stitch session recordings')
+    parser.add_argument('sessions', nargs='+', help='session directories under recordings/')
+    parser.add_argument('--mosaic', action='store_true', help='also render a grid mosaic')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(process_session, path, args.mosaic): path for path in args.sessions}
+        for future, path in futures.items():
+            try:
+                print(json.dumps(future.result(), indent=2))
+            except Exception as e:
+                print(f'{path}: failed: {e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Latest-frame camera previews for the admin dashboard.
+
+Each phone sends a small downscaled JPEG/WebP of its camera every so often.
+Only the newest frame per device is kept: a new frame replaces the one
+before it, so a slow admin link never builds up a queue of old pictures.
+The store is bounded by device count (the device that has gone longest
+without sending a frame is evicted first), and frames are capped in size.
+
+A background task calls ``drain`` at the preview frame rate. It returns the
+frames that changed since the last push, devices that waited longest first,
+up to that tick's share of the bandwidth cap. Frames that don't fit stay
+pending and are simply replaced by newer ones, so under a tight cap each
+preview refreshes less often rather than falling behind. Frames older than
+``max_age`` are dropped instead of pushed.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Largest accepted preview frame (bytes)
+MAX_PREVIEW_BYTES = 64 * 1024
+PREVIEW_MIME_TYPES = ('image/jpeg', 'image/webp')
+# Admin push rate (each device's preview updates at most this often per second)
+PREVIEW_FPS = 2.0
+# Preview bandwidth to admins across all devices (bits/second)
+PREVIEW_BUDGET_BPS = 4000000
+# Seconds after which an unsent frame is stale and dropped
+PREVIEW_MAX_AGE = 3.0
+# Client capture settings sent at registration
+PREVIEW_WIDTH = 160
+PREVIEW_CAPTURE_INTERVAL = 1.0 / PREVIEW_FPS
+MAX_PREVIEW_DEVICES = 256
+
+
+class PreviewError(ValueError):
+    """Raised for frames that are too large or of an unsupported type"""
+
+
+class PreviewStore:
+    def __init__(self, max_devices=MAX_PREVIEW_DEVICES, max_frame_bytes=MAX_PREVIEW_BYTES,
+                 max_age=PREVIEW_MAX_AGE):
+        self.max_devices = max_devices
+        self.max_frame_bytes = max_frame_bytes
+        self.max_age = max_age
+        # device_id -> latest frame, least recently updated first
+        self._frames = OrderedDict()
+        # device_id -> when its preview was last pushed (for fairness)
+        self._pushed_at = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        # Frames replaced or expired before they were pushed
+        self.dropped = 0
+
+    def __len__(self):
+        """Frames waiting for the next push"""
+        return len(self._pending)
+
+    def put(self, device_id, data, mime_type, captured_at=None, now=None):
+        """Keep ``data`` as the device's latest frame, replacing any unsent one"""
+        if mime_type not in PREVIEW_MIME_TYPES:
+            raise PreviewError(f'unsupported preview type: {mime_type!r}')
+        if not isinstance(data, (bytes, bytearray)) or not data:
+            raise PreviewError('preview frame must be non-empty binary data')
+        if len(data) > self.max_frame_bytes:
+            raise PreviewError(f'preview frame larger than {self.max_frame_bytes} bytes')
+        now = time.time() if now is None else now
+        frame = {
+            'device_id': device_id,
+            'data': bytes(data),
+            'mime_type': mime_type,
+            'captured_at': captured_at,
+            'received_at': now
+        }
+        with self._lock:
+            if device_id in self._pending:
+                self.dropped += 1
+            self._frames[device_id] = frame
+            self._frames.move_to_end(device_id)
+            self._pending.add(device_id)
+            while len(self._frames) > self.max_devices:
+                evicted, _ = self._frames.popitem(last=False)
+                self._pending.discard(evicted)
+                self._pushed_at.pop(evicted, None)
+        return frame
+
+    def remove(self, device_id):
+        with self._lock:
+            self._frames.pop(device_id, None)
+            self._pushed_at.pop(device_id, None)
+            self._pending.discard(device_id)
+
+    def drain(self, max_bytes, now=None):
+        """Pending frames to push now, at most ``max_bytes`` in total"""
+        now = time.time() if now is None else now
+        frames, used = [], 0
+        with self._lock:
+            # Devices whose preview went out longest ago go first
+            for device_id in sorted(self._pending, key=lambda d: self._pushed_at.get(d, 0.0)):
+                frame = self._frames[device_id]
+                if now - frame['received_at'] > self.max_age:
+                    self._pending.discard(device_id)
+                    self.dropped += 1
+                    continue
+                if used + len(frame['data']) > max_bytes:
+                    continue
+                used += len(frame['data'])
+                frames.append(frame)
+                self._pending.discard(device_id)
+                self._pushed_at[device_id] = now
+        return frames
+
+    def latest(self, max_bytes, now=None):
+        """Current frames for a newly joined admin (newest first, within budget)"""
+        now = time.time() if now is None else now
+        frames, used = [], 0
+        with self._lock:
+            for frame in reversed(self._frames.values()):
+                if now - frame['received_at'] > self.max_age:
+                    continue
+                if used + len(frame['data']) > max_bytes:
+                    break
+                used += len(frame['data'])
+                frames.append(frame)
+        return frames
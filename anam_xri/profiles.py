@@ -0,0 +1,222 @@
+"""Server-assigned recording profiles under a shared ingest bandwidth budget.
+
+Phones report what they can do at registration: the MediaRecorder MIME
+types they support, the camera's maximum resolution, and battery and
+thermal (CPU pressure) state. Each device gets a ceiling on a fixed quality
+ladder from those. ``allocate`` then starts every connected device at its
+ceiling. While the summed bitrate is over budget, it steps down whichever
+device currently has the highest bitrate, so the budget is shared evenly
+instead of first-come-first-served.
+
+A device whose upload queue keeps growing has a link that can't carry its
+profile. ``BacklogTracker`` turns its backlog reports into a floor one rung
+below what it is currently assigned, stepping at most once per cooldown,
+and raises the floor again one rung at a time once the queue has stayed
+drained for a while.
+"""
+import time
+
+# Quality ladder, best first. Bitrates are the MediaRecorder video targets.
+PROFILE_LADDER = (
+    {'name': '1080p', 'width': 1920, 'height': 1080, 'frame_rate': 30, 'video_bitrate': 5000000},
+    {'name': '720p', 'width': 1280, 'height': 720, 'frame_rate': 30, 'video_bitrate': 2500000},
+    {'name': '540p', 'width': 960, 'height': 540, 'frame_rate': 30, 'video_bitrate': 1200000},
+    {'name': '360p', 'width': 640, 'height': 360, 'frame_rate': 24, 'video_bitrate': 600000},
+    {'name': '240p', 'width': 426, 'height': 240, 'frame_rate': 15, 'video_bitrate': 250000},
+)
+AUDIO_BITRATE = 96000
+# Total ingest budget for all phones (bits/second)
+DEFAULT_BUDGET_BPS = 40000000
+
+# Container/codec preference. VP9 is smaller for the same quality but
+# costs more to encode, so hot or low-battery phones are steered to VP8.
+MIME_PREFERENCE = (
+    'video/webm;codecs=vp9,opus',
+    'video/webm;codecs=vp8,opus',
+    'video/webm',
+    'video/mp4;codecs=avc1,mp4a',
+    'video/mp4',
+)
+LOW_POWER_MIME_PREFERENCE = (
+    'video/webm;codecs=vp8,opus',
+    'video/webm',
+    'video/webm;codecs=vp9,opus',
+    'video/mp4;codecs=avc1,mp4a',
+    'video/mp4',
+)
+
+# Battery level (0-1) below which an unplugged phone is capped
+LOW_BATTERY_LEVEL = 0.2
+LOW_BATTERY_RUNG = 2
+# Compute Pressure states and the best rung each allows
+THERMAL_RUNGS = {'nominal': 0, 'fair': 0, 'serious': 2, 'critical': 3}
+
+# Queued chunks (1 s each) that count as a growing backlog
+BACKLOG_HIGH = 3
+# Queue length considered drained
+BACKLOG_LOW = 1
+# Minimum seconds between step-downs for one device, and drained time before a step up
+BACKLOG_STEP_DOWN_COOLDOWN = 5.0
+BACKLOG_STEP_UP_AFTER = 20.0
+
+
+def normalize_capabilities(raw):
+    """Validate a client's capability report into a JSON-safe dict"""
+    raw = raw if isinstance(raw, dict) else {}
+    capabilities = {
+        'mime_types': [t for t in raw.get('mime_types') or [] if t in MIME_PREFERENCE],
+        'max_width': None,
+        'max_height': None,
+        'battery_level': None,
+        'charging': bool(raw.get('charging')),
+        'thermal': raw.get('thermal') if raw.get('thermal') in THERMAL_RUNGS else None
+    }
+    for key in ('max_width', 'max_height'):
+        try:
+            capabilities[key] = max(1, int(raw[key]))
+        except (KeyError, TypeError, ValueError):
+            pass
+    try:
+        capabilities['battery_level'] = min(1.0, max(0.0, float(raw['battery_level'])))
+    except (KeyError, TypeError, ValueError):
+        pass
+    return capabilities
+
+
+def low_power(capabilities):
+    battery = capabilities.get('battery_level')
+    low_battery = (battery is not None and battery < LOW_BATTERY_LEVEL
+                   and not capabilities.get('charging'))
+    return low_battery or THERMAL_RUNGS.get(capabilities.get('thermal'), 0) > 0
+
+
+def ceiling_rung(capabilities, ladder=PROFILE_LADDER):
+    """Best ladder index this device should record at"""
+    rung = 0
+    max_width, max_height = capabilities.get('max_width'), capabilities.get('max_height')
+    if max_width and max_height:
+        # Phones report portrait or landscape; compare long and short sides
+        long_side, short_side = max(max_width, max_height), min(max_width, max_height)
+        while rung < len(ladder) - 1 and (ladder[rung]['width'] > long_side or
+                                          ladder[rung]['height'] > short_side):
+            rung += 1
+    battery = capabilities.get('battery_level')
+    if battery is not None and battery < LOW_BATTERY_LEVEL and not capabilities.get('charging'):
+        rung = max(rung, LOW_BATTERY_RUNG)
+    rung = max(rung, THERMAL_RUNGS.get(capabilities.get('thermal'), 0))
+    return min(rung, len(ladder) - 1)
+
+
+def choose_mime_type(capabilities):
+    """Preferred supported MIME type, or None to let the browser choose"""
+    supported = set(capabilities.get('mime_types') or ())
+    preference = LOW_POWER_MIME_PREFERENCE if low_power(capabilities) else MIME_PREFERENCE
+    for mime_type in preference:
+        if mime_type in supported:
+            return mime_type
+    return None
+
+
+def build_profile(rung, capabilities, ladder=PROFILE_LADDER):
+    profile = dict(ladder[rung], rung=rung, audio_bitrate=AUDIO_BITRATE)
+    profile['mime_type'] = choose_mime_type(capabilities)
+    return profile
+
+
+def profile_bitrate(profile):
+    return profile['video_bitrate'] + profile['audio_bitrate']
+
+
+def allocate(devices, budget_bps=DEFAULT_BUDGET_BPS, ladder=PROFILE_LADDER):
+    """Assign a profile to every device so the total fits the budget.
+
+    ``devices`` are registry snapshots; capabilities and any backlog floor
+    (``min_rung``) are read from ``info``. Returns {device_id: profile}.
+    If the budget can't be met even at the lowest rung, everyone gets the
+    lowest.
+    """
+    rungs, capabilities = {}, {}
+    for device in devices:
+        info = device.get('info') or {}
+        device_id = device['device_id']
+        capabilities[device_id] = info.get('capabilities') or {}
+        rung = max(ceiling_rung(capabilities[device_id], ladder), int(info.get('min_rung') or 0))
+        rungs[device_id] = min(rung, len(ladder) - 1)
+
+    def bitrate(device_id):
+        return ladder[rungs[device_id]]['video_bitrate'] + AUDIO_BITRATE
+
+    total = sum(bitrate(device_id) for device_id in rungs)
+    while budget_bps and total > budget_bps:
+        candidates = [device_id for device_id, rung in rungs.items() if rung < len(ladder) - 1]
+        if not candidates:
+            break
+        # Step down the most expensive device first (ties: stable by id)
+        device_id = max(sorted(candidates), key=bitrate)
+        total -= bitrate(device_id)
+        rungs[device_id] += 1
+        total += bitrate(device_id)
+
+    return {device_id: build_profile(rung, capabilities[device_id], ladder)
+            for device_id, rung in rungs.items()}
+
+
+class BacklogTracker:
+    """Turns per-device upload backlog reports into a quality floor"""
+
+    def __init__(self, high=BACKLOG_HIGH, low=BACKLOG_LOW,
+                 step_down_cooldown=BACKLOG_STEP_DOWN_COOLDOWN, step_up_after=BACKLOG_STEP_UP_AFTER):
+        self.high = high
+        self.low = low
+        self.step_down_cooldown = step_down_cooldown
+        self.step_up_after = step_up_after
+        self._state = {}
+
+    def report(self, device_id, queued_chunks, min_rung, current_rung, now=None):
+        """Return the device's new ``min_rung`` given its queued chunk count"""
+        now = time.time() if now is None else now
+        state = self._state.setdefault(device_id, {'changed_at': None, 'drained_since': None})
+
+        if queued_chunks >= self.high:
+            state['drained_since'] = None
+            if state['changed_at'] is None or now - state['changed_at'] >= self.step_down_cooldown:
+                state['changed_at'] = now
+                return max(min_rung, current_rung + 1)
+            return min_rung
+
+        if queued_chunks <= self.low and min_rung > 0:
+            if state['drained_since'] is None:
+                state['drained_since'] = now
+            elif now - state['drained_since'] >= self.step_up_after:
+                # Recover one rung, then wait another full period
+                state['drained_since'] = now
+                state['changed_at'] = now
+                return min_rung - 1
+        elif queued_chunks > self.low:
+            state['drained_since'] = None
+        return min_rung
+
+    def forget(self, device_id):
+        self._state.pop(device_id, None)
+
+
+class ProfileAssignments:
+    """Last profile sent to each device, so only changes are pushed"""
+
+    def __init__(self):
+        self._profiles = {}
+
+    def get(self, device_id):
+        return self._profiles.get(device_id)
+
+    def changed(self, profiles):
+        """Record new assignments; returns {device_id: profile} that differ"""
+        changed = {}
+        for device_id, profile in profiles.items():
+            if self._profiles.get(device_id) != profile:
+                self._profiles[device_id] = profile
+                changed[device_id] = profile
+        return changed
+
+    def forget(self, device_id):
+        self._profiles.pop(device_id, None)
@@ -0,0 +1,318 @@
+"""Device registry and bounded session store.
+
+Devices are indexed both by Socket.IO sid and by the client's persistent
+device_id, so a phone that reconnects (new sid) keeps its identity and clock
+estimate. Liveness is refreshed by heartbeats; a periodic ``sweep`` marks
+silent devices stale and forgets ones that have been gone for a while, and
+sessions are kept in an LRU bounded by size and age.
+
+Both stores write through to a state backend (see ``backends``) so that,
+when several workers run behind a load balancer, each of them can see every
+device and session. Live device records with their sids and clock estimates
+stay local to the worker that owns the connection; the backend holds JSON
+snapshots used for cluster-wide counts, fan-out and lookups.
+
+Every device belongs to one group (a "stage"). The backend keeps a member
+index per group, so fan-out to a group reads only that group's devices
+rather than every device in the cluster.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from .backends import LocalStateBackend
+from .clock_sync import ClockEstimate
+
+# Client heartbeat period (seconds), shared with the mobile client
+HEARTBEAT_INTERVAL = 5.0
+# A connected device that misses heartbeats this long is marked stale
+STALE_AFTER = 3 * HEARTBEAT_INTERVAL
+# Stale or disconnected devices are forgotten after this long
+RETAIN_AFTER_DISCONNECT = 300.0
+
+STATUS_CONNECTED = 'connected'
+STATUS_STALE = 'stale'
+STATUS_DISCONNECTED = 'disconnected'
+
+# How a device is connected; decides which sender delivers its commands
+TRANSPORT_SOCKETIO = 'socketio'
+TRANSPORT_BLUETOOTH = 'bluetooth'
+
+# Group a device is in until it or an admin picks another
+DEFAULT_GROUP = 'default'
+_GROUP_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+
+def valid_group(name):
+    return isinstance(name, str) and bool(_GROUP_PATTERN.match(name))
+
+
+def device_group(device):
+    """Group of a live device record or a snapshot"""
+    return (device.get('info') or {}).get('group') or DEFAULT_GROUP
+
+
+class DeviceRegistry:
+    def __init__(self, stale_after=STALE_AFTER, retain_after=RETAIN_AFTER_DISCONNECT,
+                 backend=None, worker_id=None):
+        self.stale_after = stale_after
+        self.retain_after = retain_after
+        self.backend = backend or LocalStateBackend()
+        self.worker_id = worker_id or f'{os.getpid()}'
+        self._devices = {}
+        self._by_sid = {}
+        self._connected = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of live (connected) devices on this worker"""
+        return self._connected
+
+    def snapshot(self, device):
+        """JSON-safe view of a device record, as stored in the backend"""
+        return {
+            'device_id': device['device_id'],
+            'sid': device['sid'],
+            'transport': device['transport'],
+            'status': device['status'],
+            'last_ping': device['last_ping'],
+            'worker': self.worker_id,
+            'clock': device['clock'].as_dict(),
+            'info': device['info']
+        }
+
+    def save(self, device):
+        """Publish a device's current state to the shared backend"""
+        self.backend.hset('devices', device['device_id'], json.dumps(self.snapshot(device)))
+
+    def cluster_devices(self, now=None, group=None):
+        """Device snapshots from every worker, with silent ones marked stale.
+
+        With ``group``, only that group's members are read.
+        """
+        now = time.time() if now is None else now
+        if group is None:
+            raws = self.backend.hgetall('devices').values()
+        else:
+            raws = (self.backend.hget('devices', device_id)
+                    for device_id in self.backend.hgetall('group:' + group))
+        devices = []
+        for raw in raws:
+            if raw is None:
+                continue
+            device = json.loads(raw)
+            if group is not None and device_group(device) != group:
+                # Moved by another worker after we read the index
+                continue
+            idle = now - device['last_ping']
+            if idle > self.retain_after:
+                continue
+            if device['status'] == STATUS_CONNECTED and idle > self.stale_after:
+                # Owning worker died or stopped sweeping
+                device['status'] = STATUS_STALE
+            devices.append(device)
+        return devices
+
+    def cluster_connected(self, now=None, group=None):
+        return [d for d in self.cluster_devices(now, group) if d['status'] == STATUS_CONNECTED]
+
+    def set_group(self, device, group):
+        """Move a device to another group. Returns the group it was in."""
+        previous = device_group(device)
+        device['info']['group'] = group
+        self._index_group(device['device_id'], previous, group)
+        self.save(device)
+        return previous
+
+    def _index_group(self, device_id, previous, group):
+        if previous != group:
+            self.backend.hdel('group:' + previous, device_id)
+        self.backend.hset('group:' + group, device_id, '1')
+
+    def _set_status(self, device, status):
+        if device['status'] == STATUS_CONNECTED:
+            self._connected -= 1
+        if status == STATUS_CONNECTED:
+            self._connected += 1
+        device['status'] = status
+
+    def register(self, sid, device_id, info=None, now=None, transport=TRANSPORT_SOCKETIO):
+        """Bind a sid to a device. Returns (device, reconnected)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            device = self._devices.get(device_id)
+            reconnected = device is not None
+            if device is None:
+                device = {
+                    'device_id': device_id,
+                    'sid': None,
+                    'status': STATUS_DISCONNECTED,
+                    'connected_at': now,
+                    'clock': ClockEstimate(),
+                    'info': {}
+                }
+                self._devices[device_id] = device
+            elif device['sid'] is not None:
+                self._by_sid.pop(device['sid'], None)
+
+            previous_group = device_group(device)
+            device['sid'] = sid
+            device['transport'] = transport
+            device['last_ping'] = now
+            device['info'].update(info or {})
+            self._set_status(device, STATUS_CONNECTED)
+            self._by_sid[sid] = device_id
+        self._index_group(device_id, previous_group, device_group(device))
+        self.save(device)
+        return device, reconnected
+
+    def get(self, device_id):
+        return self._devices.get(device_id)
+
+    def get_by_sid(self, sid):
+        device_id = self._by_sid.get(sid)
+        return self._devices.get(device_id) if device_id is not None else None
+
+    def heartbeat(self, sid, now=None):
+        """Refresh liveness. Returns (device, revived) or (None, False)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            device = self.get_by_sid(sid)
+            if device is None:
+                return None, False
+            device['last_ping'] = now
+            revived = device['status'] != STATUS_CONNECTED
+            if revived:
+                self._set_status(device, STATUS_CONNECTED)
+        self.save(device)
+        return device, revived
+
+    def disconnect(self, sid, now=None):
+        """Detach a sid; the device record is kept so it can reconnect"""
+        now = time.time() if now is None else now
+        with self._lock:
+            device_id = self._by_sid.pop(sid, None)
+            device = self._devices.get(device_id) if device_id is not None else None
+            if device is None:
+                return None
+            device['sid'] = None
+            device['last_ping'] = now
+            self._set_status(device, STATUS_DISCONNECTED)
+        self.save(device)
+        return device
+
+    def sweep(self, now=None):
+        """Mark silent devices stale and drop long-gone ones.
+
+        Returns (stale_devices, removed_device_ids).
+        """
+        now = time.time() if now is None else now
+        stale, removed = [], []
+        with self._lock:
+            for device_id, device in list(self._devices.items()):
+                idle = now - device['last_ping']
+                if idle > self.retain_after:
+                    self._set_status(device, STATUS_DISCONNECTED)
+                    if device['sid'] is not None:
+                        self._by_sid.pop(device['sid'], None)
+                    del self._devices[device_id]
+                    removed.append((device_id, device_group(device)))
+                elif device['status'] == STATUS_CONNECTED and idle > self.stale_after:
+                    self._set_status(device, STATUS_STALE)
+                    stale.append(device)
+        for device in stale:
+            self.save(device)
+        for device_id, group in removed:
+            self.backend.hdel('devices', device_id)
+            self.backend.hdel('group:' + group, device_id)
+        return stale, [device_id for device_id, _ in removed]
+
+    def connected(self):
+        """Snapshot of live device records"""
+        return [d for d in list(self._devices.values()) if d['status'] == STATUS_CONNECTED]
+
+    def all(self):
+        return list(self._devices.values())
+
+
+class SessionStore:
+    """Sessions kept in insertion order, bounded by count and age.
+
+    With a shared backend another worker may have created or changed a
+    session, so ``get`` reads the backend copy and callers hand the object
+    they changed back to ``save``.
+    """
+
+    def __init__(self, max_sessions=500, ttl=24 * 3600.0, backend=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.backend = backend or LocalStateBackend()
+        # Only an in-memory backend is certain to hold nothing newer than our copies
+        self.shared = not isinstance(self.backend, LocalStateBackend)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def add(self, session_id, session, now=None):
+        now = time.time() if now is None else now
+        session.setdefault('created_at', now)
+        with self._lock:
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self.save(session_id, session, now=now)
+        return session
+
+    def save(self, session_id, session=None, now=None):
+        """Publish a session's current state to the shared backend.
+
+        ``session`` is the object that was changed, which may be a copy
+        fetched from another worker; without it the local entry is saved.
+        """
+        if session is None:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+        elif session_id in self._sessions:
+            self._sessions[session_id] = session
+        now = time.time() if now is None else now
+        # Expire with the session, not a full TTL after its latest change
+        ttl = max(1.0, self.ttl - (now - session.get('created_at', now)))
+        self.backend.set('session:' + session_id, json.dumps(session), ttl=ttl)
+
+    def get(self, session_id):
+        """Look up a session, preferring the backend's copy when it is shared"""
+        session = self._sessions.get(session_id)
+        if session is None or self.shared:
+            raw = self.backend.get('session:' + session_id)
+            if raw is not None:
+                session = json.loads(raw)
+                if session_id in self._sessions:
+                    self._sessions[session_id] = session
+        return session
+
+    def sweep(self, now=None):
+        """Drop sessions older than the TTL. Returns the removed ids."""
+        now = time.time() if now is None else now
+        removed = []
+        with self._lock:
+            # Oldest first, so stop at the first session still in its TTL
+            while self._sessions:
+                session_id, session = next(iter(self._sessions.items()))
+                if now - session['created_at'] <= self.ttl:
+                    break
+                self._sessions.popitem(last=False)
+                removed.append(session_id)
+        return removed
+
+    def values(self):
+        return list(self._sessions.values())
@@ -0,0 +1,70 @@
+"""Lead-time planning and readiness tracking for scheduled starts.
+
+Instead of a fixed 3 second lead and one broadcast, the server sends each
+device its own start command (already converted to the device's clock) and
+picks the lead time from the slowest device's RTT plus the time it takes to
+emit to every device. Devices acknowledge the command; an acknowledgement
+that arrives too close to the start marks the device as late, and devices
+that never acknowledge are reported as missing before the countdown ends.
+"""
+import threading
+
+# Lead time bounds (seconds)
+MIN_LEAD_TIME = 1.0
+MAX_LEAD_TIME = 10.0
+# Extra slack added on top of the measured fan-out and network delays
+SAFETY_MARGIN = 0.5
+# RTT assumed for devices that have not completed clock sync yet
+DEFAULT_RTT = 0.25
+# Time a device needs between receiving the command and starting MediaRecorder
+PREPARE_TIME = 0.15
+# Readiness is reported this long before the start
+READINESS_MARGIN = 0.3
+
+STATE_READY = 'ready'
+STATE_LATE = 'late'
+STATE_MISSING = 'missing'
+
+
+class FanoutTimer:
+    """Exponentially weighted per-device emit cost, measured on each fan-out"""
+
+    def __init__(self, initial=0.001, weight=0.3):
+        self.per_device = initial
+        self.weight = weight
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, device_count):
+        if device_count <= 0:
+            return
+        with self._lock:
+            sample = elapsed / device_count
+            self.per_device = (1 - self.weight) * self.per_device + self.weight * sample
+
+    def estimate(self, device_count):
+        return self.per_device * device_count
+
+
+def plan_lead_time(rtts, fanout_time, margin=SAFETY_MARGIN):
+    """Lead time covering fan-out, the slowest device and its acknowledgement.
+
+    The command needs half an RTT to arrive and the ack another half to come
+    back, so the slowest device costs one full RTT before we know it is ready.
+    """
+    worst_rtt = max([r if r is not None else DEFAULT_RTT for r in rtts] or [DEFAULT_RTT])
+    lead = fanout_time + worst_rtt + PREPARE_TIME + READINESS_MARGIN + margin
+    return min(MAX_LEAD_TIME, max(MIN_LEAD_TIME, lead))
+
+
+def classify_ack(start_time, received_at, prepare_time=PREPARE_TIME):
+    """Whether a device that received the command at ``received_at`` (server
+    clock) can still start on time"""
+    return STATE_READY if received_at + prepare_time <= start_time else STATE_LATE
+
+
+def readiness_report(device_ids, acks):
+    """Split devices into ready/late/missing from {device_id: state}"""
+    report = {STATE_READY: [], STATE_LATE: [], STATE_MISSING: []}
+    for device_id in device_ids:
+        report[acks.get(device_id, STATE_MISSING)].append(device_id)
+    return report
@@ -0,0 +1,1593 @@
+"""Flask routes and Socket.IO handlers of the recording server.
+
+Phones join the ``devices`` room and the room of their group; a session is
+started for one group (or all devices), and every take records the devices
+it was sent to, so stop, pause and resume follow that list even if a phone
+changes group mid-take. Admin dashboards join ``admin``. A phone on another
+worker is moved by its own worker once it confirms with ``join_group``.
+
+Stop, pause and resume are scheduled like the start: the server picks an
+instant a lead time ahead and sends it to each device on its own clock. The
+times devices report (start, pause, resume, stop) are converted to the
+server clock and kept per take and device in the session, the
+``<device_id>.meta.json`` files and the catalog. With pre-roll, a device
+reports when its adopted recorder started, and its pre-roll is the take's
+start minus that instant.
+
+Quality telemetry window summaries are copied to the state backend per
+session, so a take's quality summary covers devices on every worker.
+
+HTTP routes: the pages, ``/time``, ``/metrics``, ``/debug/profiler``, chunk
+uploads under ``/upload/``, recordings under ``/recordings/`` and the JSON
+history under ``/api/``. Settings come from the environment (see
+``load_config``) or ``create_app(config)``.
+"""
+import math
+import os
+
+# With a shared backend, the message-queue listener blocks on a socket, so the
+# standard library must be green before anything else imports it.
+if os.environ.get('SYNC_BACKEND_URL', 'memory://').startswith('redis://'):
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import (Blueprint, Flask, render_template, request, jsonify, g, send_file,
+                   url_for)
+from flask_socketio import SocketIO, emit, join_room, leave_room
+import time
+import uuid
+import json
+from .backends import create_backends
+from .clock_sync import ClockEstimate
+from .scheduler import (FanoutTimer, plan_lead_time, classify_ack, readiness_report,
+                        READINESS_MARGIN, STATE_LATE, STATE_MISSING)
+from .registry import (DeviceRegistry, SessionStore, HEARTBEAT_INTERVAL, TRANSPORT_BLUETOOTH,
+                       device_group, valid_group)
+from .static_pages import PrerenderedPage
+from .admin_updates import DeltaAggregator, ADMIN_UPDATE_INTERVAL
+from .postprocess import PipelineQueue, JOB_INDEX, JOB_VERIFY
+from .ingest import (ChunkIngest, IngestError, MAX_CHUNK_BYTES, STATUS_OK,
+                     STATUS_OUT_OF_ORDER)
+from .metrics import MetricsRegistry, SamplingProfiler, instrument_event, original_module
+from .catalog import Catalog, CatalogError
+from .profiles import (BacklogTracker, ProfileAssignments, allocate as allocate_profiles,
+                       normalize_capabilities, profile_bitrate, DEFAULT_BUDGET_BPS, PROFILE_LADDER)
+from .previews import (PreviewStore, PreviewError, PREVIEW_BUDGET_BPS, PREVIEW_FPS, PREVIEW_WIDTH,
+                       PREVIEW_CAPTURE_INTERVAL)
+from .telemetry import (TelemetryAggregator, TelemetryError, parse_report, session_summary,
+                        TELEMETRY_INTERVAL)
+from .dispatch import (Dispatcher, DispatchBusy, StallDetector, CALLBACK_INTERVAL, IO_WORKERS,
+                       MAX_PENDING, STALL_THRESHOLD)
+from .bluetooth_server import BluetoothBridge, FramedServer
+from . import chunkstore
+from . import wire
+from . import webm_index
+from .playback import PLAYBACK_BLOCK_SIZE, RecordingFiles, take_angles
+from werkzeug.wsgi import FileWrapper
+
+# Set by create_app(); handlers and background tasks use these module globals
+app = None
+state_backend = None
+registry = None
+sync_sessions = None
+dispatcher = None
+stall_detector = None
+pipeline = None
+chunk_ingest = None
+catalog = None
+
+# Bound to the app by create_app(); handlers below register on it at import
+socketio = SocketIO()
+# HTTP routes
+bp = Blueprint('sync', __name__)
+
+admin_updates = DeltaAggregator()
+fanout_timer = FanoutTimer()
+# Set by start_bluetooth() when the RFCOMM bridge runs in this process
+bluetooth_bridge = None
+# Registry work from the Bluetooth thread, run on the event loop by relay_bluetooth_events
+bluetooth_events = original_module('queue').Queue()
+backlog_tracker = BacklogTracker()
+profile_assignments = ProfileAssignments()
+previews = PreviewStore()
+# Rolling windows of recording quality reports, per device and take
+quality_telemetry = TelemetryAggregator()
+# Size, ETag and WebM index of recordings served for review
+recording_files = RecordingFiles()
+# Seconds between profile re-allocations after devices join or leave
+PROFILE_REBALANCE_INTERVAL = 1.0
+
+# Start modes: lead time from the devices' RTTs, or the legacy fixed 3 seconds
+START_MODES = ('adaptive', 'fixed')
+# Take status each admin control action leads to
+CONTROL_ACTIONS = {'stop': 'stopped', 'pause': 'paused', 'resume': 'recording'}
+# Takes that can still be paused, resumed or stopped
+LIVE_TAKE_STATES = ('scheduled', 'recording', 'paused')
+# Per-device states reported by clients during a take
+DEVICE_RECORDING = 'recording'
+DEVICE_PAUSED = 'paused'
+DEVICE_STOPPED = 'stopped'
+DEVICE_STATES = (DEVICE_RECORDING, DEVICE_PAUSED, DEVICE_STOPPED)
+# Longest pre-roll phones may be asked to buffer (seconds)
+MAX_PREROLL_SECONDS = 30.0
+
+# Pages rendered once by create_app()
+pages = {}
+
+# Metrics exposed at /metrics; gauges with callbacks are read at scrape time
+metrics = MetricsRegistry()
+event_count = metrics.counter('sync_socketio_events_total', 'Socket.IO events handled', ['event'])
+event_latency = metrics.histogram('sync_socketio_event_seconds', 'Socket.IO handler latency', ['event'])
+http_count = metrics.counter('sync_http_requests_total', 'HTTP requests served',
+                             ['route', 'method', 'status'])
+http_latency = metrics.histogram('sync_http_request_seconds', 'HTTP request latency', ['route'])
+fanout_latency = metrics.histogram('sync_fanout_seconds', 'Time to emit a start command to every device')
+ingest_bytes = metrics.counter('sync_ingest_bytes_total', 'Recording bytes written to disk')
+ingest_chunks = metrics.counter('sync_ingest_chunks_total', 'Uploaded chunks by outcome',
+                                ['transport', 'status'])
+preview_frames = metrics.counter('sync_preview_frames_total', 'Preview frames by outcome',
+                                 ['outcome'])
+preview_bytes = metrics.counter('sync_preview_bytes_total', 'Preview bytes pushed to admins')
+admin_delta_size = metrics.histogram('sync_admin_delta_devices', 'Devices per admin delta',
+                                     buckets=(1, 5, 10, 25, 50, 100, 250, 500))
+metrics.gauge('sync_connected_devices', 'Devices connected to this worker',
+              callback=lambda: len(registry))
+metrics.gauge('sync_active_sessions', 'Recording sessions currently tracked',
+              callback=lambda: len(sync_sessions))
+metrics.gauge('sync_admin_updates_pending', 'Device changes waiting for the next admin flush',
+              callback=lambda: len(admin_updates))
+metrics.gauge('sync_pipeline_jobs', 'Post-processing jobs by status', ['status'],
+              callback=lambda: pipeline_job_counts())
+metrics.gauge('sync_previews_pending', 'Preview frames waiting for the next push',
+              callback=lambda: len(previews))
+metrics.gauge('sync_catalog_writes_pending', 'Catalog writes queued for the writer thread',
+              callback=lambda: catalog.pending())
+metrics.gauge('sync_chunks_deduplicated_bytes', 'Uploaded chunk bytes already in the chunk store',
+              callback=lambda: chunk_ingest.store.deduplicated_bytes)
+metrics.gauge('sync_dispatch_queue_depth', 'Offloaded tasks queued or running', ['pool'],
+              callback=lambda: {(pool,): depth for pool, depth in dispatcher.depths().items()})
+dispatch_rejected = metrics.counter('sync_dispatch_rejected_total',
+                                    'Tasks refused because a pool was full', ['pool'])
+dispatch_wait = metrics.histogram('sync_dispatch_wait_seconds',
+                                  'Time offloaded tasks waited for a worker', ['pool'])
+dispatch_run = metrics.histogram('sync_dispatch_run_seconds', 'Offloaded task run time', ['pool'])
+loop_lag = metrics.histogram('sync_event_loop_lag_seconds', 'How late each event-loop heartbeat ran')
+loop_stalls = metrics.counter('sync_event_loop_stalls_total',
+                              'Event-loop heartbeats late by more than the stall threshold')
+quality_anomalies = metrics.counter('sync_quality_anomalies_total',
+                                    'Recording quality anomalies raised', ['kind'])
+wire_frames = metrics.counter('sync_wire_frames_total', 'Binary wire frames by direction and event',
+                              ['direction', 'event'])
+profiler = SamplingProfiler()
+
+def instrumented(event):
+    """Count and time a Socket.IO handler (apply below @socketio.on)"""
+    return instrument_event(event, event_count, event_latency)
+
+def offload(fn, *args, key=None, callback=None, force=False):
+    """Run blocking ``fn(*args)`` on the I/O pool; ``callback(result, error)`` runs on the loop"""
+    try:
+        return dispatcher.submit(fn, *args, key=key, callback=callback, force=force)
+    except DispatchBusy:
+        dispatch_rejected.inc(pool='io')
+        raise
+
+def run_blocking(fn, *args, key=None):
+    """Run blocking ``fn(*args)`` on the I/O pool and wait for it without stalling the loop"""
+    try:
+        return dispatcher.call(fn, *args, key=key)
+    except DispatchBusy:
+        dispatch_rejected.inc(pool='io')
+        raise
+
+def pipeline_job_counts():
+    counts = {}
+    for job in list(pipeline.jobs.values()):
+        counts[(job['status'],)] = counts.get((job['status'],), 0) + 1
+    return counts
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Label by URL rule, not path, so ids don't explode the series count
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_latency.observe(time.perf_counter() - started, route=route)
+        http_count.inc(route=route, method=request.method, status=response.status_code)
+    return response
+
+@bp.route('/')
+def mobile_client():
+    return pages['mobile'].response()
+
+@bp.route('/admin')
+def admin_dashboard():
+    return pages['admin'].response()
+
+class BlockFileWrapper(FileWrapper):
+    """File wrapper for servers without their own (eventlet).
+
+    Reads larger blocks than Werkzeug's, on the I/O pool so a slow disk never
+    stalls the loop. The bytes still pass through Python: eventlet's server
+    has no sendfile path.
+    """
+
+    def __init__(self, file, buffer_size=8192):
+        super().__init__(file, max(buffer_size, PLAYBACK_BLOCK_SIZE))
+
+    def __next__(self):
+        try:
+            data = run_blocking(self.file.read, self.buffer_size)
+        except DispatchBusy:
+            # Pool full: read here rather than break a response already started
+            data = self.file.read(self.buffer_size)
+        if data:
+            return data
+        raise StopIteration()
+
+@bp.route('/recordings/<session_id>/<device_id>.webm')
+def serve_recording(session_id, device_id):
+    """Stream an upload for review, with Range requests and conditional GET.
+
+    Under the default eventlet server the file is copied in
+    ``PLAYBACK_BLOCK_SIZE`` blocks read on the I/O pool, not sent with
+    sendfile. Servers with a ``wsgi.file_wrapper`` (gunicorn) send whole
+    files with sendfile. With ``RECORDINGS_ACCEL_PREFIX`` set, nginx serves
+    the request, ranges included, with sendfile instead.
+    """
+    try:
+        path = chunk_ingest.stream_path(session_id, device_id, request.args.get('take'))
+        entry = run_blocking(recording_files.get, path)
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
+    except DispatchBusy:
+        return busy_response()
+    if entry is None:
+        return jsonify({'error': 'unknown recording'}), 404
+    prefix = app.config['RECORDINGS_ACCEL_PREFIX']
+    if prefix:
+        relative = os.path.relpath(path, app.config['RECORDINGS_DIR']).replace(os.sep, '/')
+        response = app.response_class(mimetype='video/webm')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative
+        return response
+    request.environ.setdefault('wsgi.file_wrapper', BlockFileWrapper)
+    # Revalidated every time: indexing rewrites the file once after upload
+    return send_file(path, mimetype='video/webm', conditional=True, etag=entry['etag'],
+                     last_modified=entry['mtime'], max_age=0)
+
+@bp.route('/time')
+def server_time():
+    """Tiny latency probe so clients don't download a whole page"""
+    response = jsonify({'server_time': time.time()})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's metrics"""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@bp.route('/debug/profiler', methods=['GET', 'POST'])
+def profiler_control():
+    """Switch the sampling profiler on/off; GET ?format=collapsed returns stacks"""
+    if request.method == 'POST':
+        action = request.args.get('action', 'start')
+        if action == 'start':
+            profiler.reset()
+            profiler.start(float(request.args.get('interval', 0.005)))
+        elif action == 'stop':
+            profiler.stop()
+        else:
+            return jsonify({'error': f'unknown action: {action}'}), 400
+    elif request.args.get('format') == 'collapsed':
+        return profiler.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    return jsonify(profiler.status())
+
+def catalog_page(query, *args):
+    """Run a paginated catalog query with ?limit= and ?cursor= from the request"""
+    try:
+        return jsonify(run_blocking(query, *args, request.args.get('limit'),
+                                    request.args.get('cursor')))
+    except CatalogError as e:
+        return jsonify({'error': str(e)}), 400
+    except DispatchBusy:
+        return busy_response()
+
+def busy_response():
+    return jsonify({'error': 'server busy'}), 503, {'Retry-After': '1'}
+
+@bp.route('/api/sessions')
+def list_sessions():
+    return catalog_page(catalog.list_sessions)
+
+@bp.route('/api/sessions/<session_id>')
+def get_session(session_id):
+    try:
+        session = run_blocking(catalog.get_session, session_id)
+    except DispatchBusy:
+        return busy_response()
+    if session is None:
+        return jsonify({'error': 'unknown session'}), 404
+    return jsonify(session)
+
+@bp.route('/api/devices')
+def list_devices():
+    return catalog_page(catalog.list_devices)
+
+@bp.route('/api/devices/<device_id>/takes')
+def list_device_takes(device_id):
+    return catalog_page(catalog.list_takes, device_id)
+
+@bp.route('/api/sessions/<session_id>/recordings/<device_id>/index')
+def recording_index(session_id, device_id):
+    """Cluster/keyframe index of an upload; with ?t=<seconds>, the byte ranges to seek there"""
+    try:
+        path = chunk_ingest.stream_path(session_id, device_id, request.args.get('take'))
+        entry = run_blocking(recording_files.get, path)
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
+    except DispatchBusy:
+        return busy_response()
+    index = entry['index'] if entry else None
+    if index is None:
+        return jsonify({'error': 'recording not indexed'}), 404
+    if 't' not in request.args:
+        return jsonify(index)
+    try:
+        seconds = float(request.args['t'])
+    except ValueError:
+        return jsonify({'error': 'invalid t'}), 400
+    return jsonify(webm_index.seek(index, seconds))
+
+@bp.route('/api/sessions/<session_id>/takes/<int:take>/angles')
+def list_take_angles(session_id, take):
+    """Every angle of a take on one timeline, for the review player"""
+    try:
+        timeline = run_blocking(take_angles, recording_files,
+                                chunk_ingest.take_dir(session_id, take))
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({'error': 'unknown take'}), 404
+    except DispatchBusy:
+        return busy_response()
+    for angle in timeline['angles']:
+        angle['url'] = url_for('sync.serve_recording', session_id=session_id,
+                               device_id=angle['device_id'], take=take or None)
+    return jsonify(dict(timeline, session_id=session_id, take=take))
+
+@bp.route('/api/sessions/<session_id>/takes/<int:take>/quality')
+def take_quality(session_id, take):
+    """Live recording quality of a take: per-device windows and their aggregate"""
+    return jsonify(session_quality(session_id, take))
+
+@bp.route('/upload/<session_id>/<device_id>', methods=['GET'])
+def upload_status(session_id, device_id):
+    """Report the next expected chunk so a client can resume"""
+    take = request.args.get('take')
+    try:
+        return jsonify(run_blocking(chunk_ingest.next_seq, session_id, device_id, take,
+                                    key=chunk_ingest.stream_path(session_id, device_id, take)))
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
+    except DispatchBusy:
+        return busy_response()
+
+@bp.route('/upload/<session_id>/<device_id>/<int:seq>', methods=['POST'])
+def upload_chunk_http(session_id, device_id, seq):
+    """Append one chunk from a raw request body.
+
+    The body is read on the loop (socket reads are cooperative) and written
+    to disk on the I/O pool.
+    """
+    if request.content_length is None or request.content_length > MAX_CHUNK_BYTES:
+        return jsonify({'error': 'chunk too large or missing length'}), 413
+    take = request.args.get('take')
+    try:
+        path = chunk_ingest.stream_path(session_id, device_id, take)
+        data = request.get_data(cache=False)
+        if len(data) == request.content_length:
+            status, next_seq = run_blocking(chunk_ingest.append, session_id, device_id, seq,
+                                            data, take, key=path)
+        else:
+            # Incomplete body: nothing is written, the client resends from next_seq
+            status = STATUS_OUT_OF_ORDER
+            next_seq = run_blocking(chunk_ingest.next_seq, session_id, device_id, take,
+                                    key=path)['next_seq']
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
+    except DispatchBusy:
+        return busy_response()
+    ingest_chunks.inc(transport='http', status=status)
+    if status == STATUS_OK:
+        ingest_bytes.inc(request.content_length)
+    code = 409 if status == STATUS_OUT_OF_ORDER else 200
+    return jsonify({'status': status, 'seq': seq, 'next_seq': next_seq}), code
+
+background_started = False
+profiles_dirty = False
+
+def device_summary(snapshot):
+    """Admin card state from a registry snapshot"""
+    profile = profile_assignments.get(snapshot['device_id'])
+    backlog, pending_uploads = (snapshot.get('info') or {}).get('upload_backlog') or (0, 0)
+    return {
+        'device_id': snapshot['device_id'],
+        'status': snapshot['status'],
+        'transport': snapshot.get('transport'),
+        'sync_error': snapshot['clock']['error_bound'],
+        'profile': profile['name'] if profile else None,
+        'bitrate': profile_bitrate(profile) if profile else None,
+        'backlog': backlog,
+        'pending_uploads': pending_uploads,
+        'group': device_group(snapshot),
+        'quality': quality_telemetry.latest(snapshot['device_id'])
+    }
+
+def send_to_device(device, event, payload):
+    """Deliver an event to one device over the transport it is connected by"""
+    if device.get('transport') == TRANSPORT_BLUETOOTH:
+        # Bluetooth connections are only reachable from the worker bridging them
+        return bluetooth_bridge is not None and bluetooth_bridge.send(device['sid'], event, payload)
+    emit_to_sid(device['sid'], event, payload, device)
+    return True
+
+def emit_to_sid(sid, event, payload, device=None):
+    """Emit to one Socket.IO connection in the wire format it negotiated"""
+    device = device if device is not None else registry.get_by_sid(sid)
+    if device is not None and device['info'].get('wire') == wire.FORMAT_BINARY:
+        frame = wire.encode(event, payload)
+        if frame is not None:
+            wire_frames.inc(direction='out', event=event)
+            socketio.emit(wire.EVENT, frame, to=sid)
+            return
+    socketio.emit(event, payload, to=sid)
+
+# Room of every phone, so device broadcasts skip admin dashboards
+DEVICES_ROOM = 'devices'
+
+def group_room(group):
+    return 'group:' + group
+
+def move_device_group(device, group):
+    """Put a device in ``group`` and its connection in the group's room"""
+    previous = registry.set_group(device, group)
+    if device['sid'] is not None and device.get('transport') != TRANSPORT_BLUETOOTH:
+        if previous != group:
+            leave_room(group_room(previous), sid=device['sid'], namespace='/')
+        join_room(group_room(group), sid=device['sid'], namespace='/')
+    if previous != group:
+        if device['sid'] is not None:
+            send_to_device(device, 'group_assigned', {'group': group})
+        admin_updates.upsert(device['device_id'], group=group)
+    return previous
+
+def sweep_registry():
+    """Background task: expire silent devices, old sessions and idle uploads"""
+    while True:
+        socketio.sleep(HEARTBEAT_INTERVAL)
+        stale, removed = registry.sweep()
+        for session_id in sync_sessions.sweep():
+            state_backend.delete(quality_key(session_id))
+        # Uploads abandoned mid-stream; finished ones are forgotten on finalize
+        chunk_ingest.sweep()
+        for device in stale:
+            admin_updates.upsert(device['device_id'], status=device['status'])
+        for device_id in removed:
+            admin_updates.remove(device_id)
+            backlog_tracker.forget(device_id)
+            profile_assignments.forget(device_id)
+            previews.remove(device_id)
+            quality_telemetry.forget(device_id)
+        if stale or removed:
+            request_rebalance()
+
+def flush_admin_updates():
+    """Background task: push coalesced device changes to admins"""
+    while True:
+        socketio.sleep(app.config['ADMIN_UPDATE_INTERVAL'])
+        delta = admin_updates.drain()
+        if delta:
+            admin_delta_size.observe(len(delta['upserted']) + len(delta['removed']))
+            delta['total_devices'] = len(registry.cluster_connected())
+            socketio.emit('devices_delta', delta, room='admin')
+
+def preview_budget(seconds):
+    """Preview bytes that may be pushed to admins in ``seconds``"""
+    return app.config['PREVIEW_BUDGET_MBPS'] * 1e6 / 8 * seconds
+
+def flush_previews():
+    """Background task: push the newest preview frames under the rate and bandwidth caps"""
+    interval = 1.0 / app.config['PREVIEW_FPS']
+    dropped = 0
+    while True:
+        socketio.sleep(interval)
+        frames = previews.drain(preview_budget(interval))
+        if previews.dropped > dropped:
+            preview_frames.inc(previews.dropped - dropped, outcome='dropped')
+            dropped = previews.dropped
+        if frames:
+            preview_frames.inc(len(frames), outcome='pushed')
+            preview_bytes.inc(sum(len(frame['data']) for frame in frames))
+            socketio.emit('device_previews', {'frames': frames}, room='admin')
+
+def preroll_seconds():
+    """Cluster-wide pre-roll setting (seconds, 0 when off)"""
+    raw = state_backend.get('preroll_seconds')
+    return float(raw) if raw is not None else app.config['PREROLL_SECONDS']
+
+def request_rebalance():
+    global profiles_dirty
+    profiles_dirty = True
+
+def rebalance_profiles():
+    """Share the ingest budget across connected devices; push changed profiles"""
+    devices = registry.cluster_connected()
+    profiles = allocate_profiles(devices, app.config['INGEST_BUDGET_MBPS'] * 1e6)
+    by_id = {device['device_id']: device for device in devices}
+    for device_id, profile in profile_assignments.changed(profiles).items():
+        send_to_device(by_id[device_id], 'recording_profile', profile)
+        admin_updates.upsert(device_id, profile=profile['name'], bitrate=profile_bitrate(profile))
+    return profiles
+
+def rebalance_profiles_task():
+    """Background task: re-allocate profiles after devices join, leave or change"""
+    global profiles_dirty
+    while True:
+        socketio.sleep(PROFILE_REBALANCE_INTERVAL)
+        if profiles_dirty:
+            profiles_dirty = False
+            rebalance_profiles()
+
+def dispatch_callbacks():
+    """Background task: finish offloaded work on the loop (acks, emits, catalog)"""
+    while True:
+        for task in dispatcher.run_callbacks():
+            dispatch_wait.observe(task.wait_time, pool=task.pool)
+            dispatch_run.observe(task.run_time, pool=task.pool)
+        socketio.sleep(CALLBACK_INTERVAL)
+
+def watch_event_loop():
+    """Background task: heartbeat for the stall detector"""
+    stall_detector.start()
+    while True:
+        socketio.sleep(stall_detector.interval)
+        lag = stall_detector.beat()
+        loop_lag.observe(lag)
+        if lag > stall_detector.threshold:
+            loop_stalls.inc()
+
+def write_metadata(session_id, fields, device_id=None, take=0):
+    """Merge fields into a take's metadata file on the I/O pool.
+
+    Ids are checked here, so bad ones raise IngestError to the caller.
+    Writes to one file are applied in call order and are never refused.
+    """
+    path = chunk_ingest.metadata_path(session_id, device_id, take)
+    offload(chunk_ingest.update_metadata, session_id, fields, device_id, take, key=path,
+            force=True)
+
+def add_metadata_event(session_id, device_id, take, event, fields):
+    """Append to a device's metadata ``events`` list (runs on the I/O pool)"""
+    metadata = chunk_ingest.read_metadata(session_id, device_id, take)
+    fields = dict(fields, events=metadata.get('events', []) + [event])
+    return chunk_ingest.update_metadata(session_id, fields, device_id, take)
+
+def finalize_upload(session_id, device_id, total_chunks, take):
+    """Finalize a stream and drop its cached state once complete (runs on the I/O pool)"""
+    state = chunk_ingest.finalize(session_id, device_id, total_chunks, take)
+    if state['complete']:
+        chunk_ingest.forget(session_id, device_id, take)
+    return state
+
+def poll_pipeline():
+    """Background task: report post-processing job progress to admins"""
+    while True:
+        socketio.sleep(1.0)
+        for job in pipeline.poll():
+            socketio.emit('pipeline_status', pipeline.describe(job), room='admin')
+            if not job['result']:
+                continue
+            if job['kind'] == JOB_INDEX:
+                # The rewritten file is a little larger and now has a known duration
+                result = job['result']
+                catalog.record_file(result['path'], session_id=result['session_id'],
+                                    take=result['take'], device_id=result['device_id'],
+                                    kind='recording', size=result['size'],
+                                    duration=result['duration'], updated_at=time.time())
+            elif job['kind'] == JOB_VERIFY:
+                result = job['result']
+                catalog.record_file(result['path'], session_id=result['session_id'],
+                                    take=result['take'], device_id=result['device_id'],
+                                    kind='recording', verified=result['status'],
+                                    updated_at=time.time())
+            else:
+                catalog_pipeline_outputs(job['result'])
+
+def catalog_pipeline_outputs(result):
+    """Record probed source durations and the aligned clips in the catalog"""
+    now = time.time()
+    for clip in result['clips']:
+        catalog.record_file(clip['source'], session_id=result['session_id'], take=result['take'],
+                            device_id=clip['device_id'], kind='recording',
+                            duration=clip['source_duration'], updated_at=now)
+        catalog.record_file(clip['output'], session_id=result['session_id'], take=result['take'],
+                            device_id=clip['device_id'], kind='aligned',
+                            duration=result['duration'], updated_at=now)
+    if result['mosaic']:
+        catalog.record_file(result['mosaic'], session_id=result['session_id'], take=result['take'],
+                            kind='mosaic', duration=result['duration'], updated_at=now)
+
+@socketio.on('connect')
+def handle_connect():
+    global background_started
+    if not background_started:
+        background_started = True
+        socketio.start_background_task(sweep_registry)
+        socketio.start_background_task(flush_admin_updates)
+        socketio.start_background_task(poll_pipeline)
+        socketio.start_background_task(rebalance_profiles_task)
+        socketio.start_background_task(flush_previews)
+        socketio.start_background_task(dispatch_callbacks)
+        socketio.start_background_task(watch_event_loop)
+
+@socketio.on('disconnect')
+@instrumented('disconnect')
+def handle_disconnect():
+    device = registry.disconnect(request.sid)
+    if device:
+        admin_updates.upsert(device['device_id'], status=device['status'])
+        request_rebalance()
+
+@socketio.on('register_device')
+@instrumented('register_device')
+def handle_device_registration(data):
+    device_id = data['device_id']
+    wire_format = wire.negotiate(data.get('wire_formats'))
+    info = {
+        'user_agent': data.get('user_agent'),
+        'capabilities': normalize_capabilities(data.get('capabilities')),
+        'wire': wire_format
+    }
+    if valid_group(data.get('group')):
+        # Otherwise a known device keeps its group and a new one gets the default
+        info['group'] = data['group']
+    device, reconnected = registry.register(request.sid, device_id, info)
+    join_room(DEVICES_ROOM)
+    join_room(group_room(device_group(device)))
+    emit('registration_confirmed', {
+        'device_id': device_id,
+        'reconnected': reconnected,
+        'group': device_group(device),
+        'wire': wire_format,
+        'heartbeat_interval': HEARTBEAT_INTERVAL,
+        'preview': {'width': PREVIEW_WIDTH, 'interval': PREVIEW_CAPTURE_INTERVAL},
+        'telemetry': {'interval': TELEMETRY_INTERVAL},
+        'preroll': preroll_seconds()
+    })
+    
+    # Notify admin (batched) and fit the new device into the ingest budget
+    admin_updates.upsert(**device_summary(registry.snapshot(device)))
+    request_rebalance()
+    catalog_device(device)
+
+def catalog_device(device):
+    now = time.time()
+    catalog.record_device(device['device_id'], first_seen=now, last_seen=now,
+                          transport=device['transport'],
+                          user_agent=device['info'].get('user_agent'),
+                          capabilities=device['info'].get('capabilities'))
+
+@socketio.on('device_capabilities')
+@instrumented('device_capabilities')
+def handle_device_capabilities(data):
+    """Updated camera/battery/thermal state; may change the device's profile"""
+    device = registry.get_by_sid(request.sid)
+    if device is None:
+        return
+    device['info']['capabilities'] = normalize_capabilities(data)
+    registry.save(device)
+    request_rebalance()
+    catalog_device(device)
+
+@socketio.on('preview_frame')
+@instrumented('preview_frame')
+def handle_preview_frame(data):
+    """Keep a device's latest camera thumbnail; the ack paces the client"""
+    device = registry.get_by_sid(request.sid)
+    if device is None:
+        return {'error': 'device not registered'}
+    try:
+        previews.put(device['device_id'], data.get('data'), data.get('mime_type'),
+                     data.get('captured_at'))
+    except PreviewError as e:
+        preview_frames.inc(outcome='rejected')
+        return {'error': str(e)}
+    preview_frames.inc(outcome='received')
+    return {'status': 'ok'}
+
+@socketio.on('upload_backlog')
+@instrumented('upload_backlog')
+def handle_upload_backlog(data):
+    """Show a device's unsent chunks to admins; step its profile down while they grow"""
+    device = registry.get_by_sid(request.sid)
+    if device is None:
+        return
+    try:
+        queued = max(0, int(data.get('queued_chunks')))
+        uploads = max(0, int(data.get('uploads') or 0))
+    except (TypeError, ValueError):
+        return
+    if [queued, uploads] != device['info'].get('upload_backlog'):
+        # Kept in the snapshot so admins who join later see it too
+        device['info']['upload_backlog'] = [queued, uploads]
+        registry.save(device)
+        admin_updates.upsert(device['device_id'], backlog=queued, pending_uploads=uploads)
+    assigned = profile_assignments.get(device['device_id'])
+    min_rung = device['info'].get('min_rung', 0)
+    new_min_rung = min(len(PROFILE_LADDER) - 1, backlog_tracker.report(
+        device['device_id'], queued, min_rung, assigned['rung'] if assigned else 0))
+    if new_min_rung != min_rung:
+        device['info']['min_rung'] = new_min_rung
+        registry.save(device)
+        rebalance_profiles()
+
+@socketio.on('heartbeat')
+@instrumented('heartbeat')
+def handle_heartbeat(data=None):
+    """Refresh a device's liveness"""
+    device, revived = registry.heartbeat(request.sid)
+    if device is None:
+        # Unknown sid (e.g. server restarted): ask the client to re-register
+        emit('reregister')
+        return
+    if revived:
+        admin_updates.upsert(device['device_id'], status=device['status'])
+
+@socketio.on('sync_record_command')
+@instrumented('sync_record_command')
+def handle_sync_record(data):
+    """Send synchronized recording command with precise timing.
+
+    With ``session_id`` of an existing session this starts its next take,
+    stopping the current one at the same instant (back-to-back takes).
+    ``duration`` (seconds) schedules a synchronized stop; without it the
+    take runs until a stop command. ``group`` limits a new session to one
+    group's devices, so sessions on different groups can run at once.
+    """
+    data = data or {}
+    mode = data.get('mode', 'adaptive')
+    if mode not in START_MODES:
+        emit('sync_command_sent', {'session_id': None, 'mode': mode, 'error': 'unknown mode'})
+        return
+    exclude_late = bool(data.get('exclude_late'))
+    try:
+        duration = float(data.get('duration') or 0)
+    except (TypeError, ValueError):
+        duration = 0
+    duration = duration if math.isfinite(duration) and duration > 0 else None
+    
+    session_id = data.get('session_id')
+    session = sync_sessions.get(session_id) if session_id else None
+    if session is None:
+        session_id = str(uuid.uuid4())[:8]
+        group = data.get('group') or None
+        if group is not None and not valid_group(group):
+            emit('sync_command_sent', {'session_id': None, 'group': group,
+                                       'error': 'invalid group name'})
+            return
+    else:
+        # Every take of a session records the same group
+        group = session.get('group')
+    
+    # The group's devices (or every device), whichever worker holds their connection
+    devices = registry.cluster_connected(group=group)
+    estimates = {d['device_id']: ClockEstimate.from_dict(d['clock']) for d in devices}
+    
+    if mode == 'fixed':
+        # Legacy: fixed 3 second lead, one broadcast
+        lead_time = 3.0
+    else:
+        lead_time = plan_lead_time([e.rtt for e in estimates.values()],
+                                   fanout_timer.estimate(len(devices)))
+    future_time = time.time() + lead_time
+    stop_time = future_time + duration if duration else None
+    profiles = rebalance_profiles()
+    
+    # Per-device start time on each device's own clock
+    device_clocks = {}
+    for device_id, estimate in estimates.items():
+        if estimate.synced:
+            device_clocks[device_id] = {
+                'local_start': estimate.to_device_time(future_time),
+                'error_bound': estimate.error_bound
+            }
+    
+    if session is None:
+        session = sync_sessions.add(session_id, {
+            'created_at': time.time(),
+            'mode': mode,
+            'group': group,
+            'takes': []
+        })
+    elif session['takes'][-1]['status'] in LIVE_TAKE_STATES:
+        # Back-to-back: the current take ends exactly when the next starts
+        schedule_control(session_id, session, session['takes'][-1], 'stop', at=future_time)
+    
+    take = {
+        'take': len(session['takes']),
+        'start_time': future_time,
+        'stop_time': stop_time,
+        'status': 'scheduled',
+        'devices': {device_id: {'state': 'scheduled'} for device_id in estimates},
+        'device_clocks': device_clocks,
+        'events': []
+    }
+    session['takes'].append(take)
+    session['status'] = take['status']
+    sync_sessions.save(session_id, session)
+    # Kept next to the uploads for post-processing
+    write_metadata(session_id, {
+        'session_id': session_id,
+        'take': take['take'],
+        'mode': mode,
+        'group': group,
+        'start_time': future_time,
+        'stop_time': stop_time,
+        'devices': list(estimates),
+        'device_clocks': device_clocks
+    }, take=take['take'])
+    
+    sync_command = {
+        'session_id': session_id,
+        'take': take['take'],
+        'start_timestamp': future_time,
+        'stop_timestamp': stop_time,
+        'server_time': time.time(),
+        'command': 'start_recording'
+    }
+    
+    if mode == 'fixed':
+        socketio.emit('sync_recording_command', sync_command,
+                      room=group_room(group) if group else DEVICES_ROOM)
+        for device in devices:
+            if device.get('transport') == TRANSPORT_BLUETOOTH:
+                send_to_device(device, 'sync_recording_command', sync_command)
+    else:
+        # One command per device, already converted to its clock
+        fanout_started = time.time()
+        for device in devices:
+            estimate = estimates[device['device_id']]
+            clock = device_clocks.get(device['device_id'])
+            send_to_device(device, 'sync_recording_command', dict(
+                sync_command,
+                server_time=time.time(),
+                local_start_timestamp=clock['local_start'] if clock else None,
+                local_stop_timestamp=(estimate.to_device_time(stop_time)
+                                      if clock and stop_time else None),
+                profile=profiles.get(device['device_id']),
+                ack_requested=True
+            ))
+        fanout_timer.record(time.time() - fanout_started, len(devices))
+        fanout_latency.observe(time.time() - fanout_started)
+        
+        deadline = max(time.time(), future_time - READINESS_MARGIN)
+        socketio.start_background_task(report_readiness, session_id, take['take'], deadline,
+                                       exclude_late)
+    
+    # Notify every admin, so each dashboard tracks every group's session
+    error_bounds = [c['error_bound'] for c in device_clocks.values()]
+    max_sync_error = max(error_bounds) if error_bounds else None
+    socketio.emit('sync_command_sent', {
+        'session_id': session_id,
+        'take': take['take'],
+        'mode': mode,
+        'group': group,
+        'start_time': future_time,
+        'stop_time': stop_time,
+        'lead_time': lead_time,
+        'device_count': len(devices),
+        'synced_devices': len(device_clocks),
+        'max_sync_error': max_sync_error,
+        'preroll': preroll_seconds()
+    }, room='admin')
+    catalog.record_session(session_id, created_at=session['created_at'],
+                           start_time=session['takes'][0]['start_time'],
+                           mode=mode, status=session['status'], device_count=len(devices),
+                           synced_devices=len(device_clocks), max_sync_error=max_sync_error,
+                           device_group=group)
+
+def schedule_control(session_id, session, take, action, at=None, after=None):
+    """Send a clock-corrected stop/pause/resume for one take to its devices.
+
+    The instant is ``at`` (server clock) if given, otherwise the planned lead
+    time from now, pushed out to ``after`` seconds from now if that is later.
+    Returns the scheduled instant.
+    """
+    # By take membership, not group: a device moved mid-take must still stop
+    devices = [d for d in registry.cluster_connected() if d['device_id'] in take['devices']]
+    estimates = {d['device_id']: ClockEstimate.from_dict(d['clock']) for d in devices}
+    if at is None:
+        at = time.time() + plan_lead_time([e.rtt for e in estimates.values()],
+                                          fanout_timer.estimate(len(devices)))
+        if after is not None:
+            at = max(at, time.time() + after)
+    
+    command = {
+        'session_id': session_id,
+        'take': take['take'],
+        'action': action,
+        'timestamp': at
+    }
+    for device in devices:
+        estimate = estimates[device['device_id']]
+        send_to_device(device, 'sync_control', dict(
+            command,
+            server_time=time.time(),
+            local_timestamp=estimate.to_device_time(at) if estimate.synced else None
+        ))
+    
+    take['events'].append({'action': action, 'at': at})
+    if action == 'stop':
+        take['stop_time'] = at
+    take['status'] = CONTROL_ACTIONS[action]
+    session['status'] = take['status']
+    sync_sessions.save(session_id, session)
+    write_metadata(session_id, {
+        'stop_time': take['stop_time'],
+        'events': list(take['events'])
+    }, take=take['take'])
+    catalog.record_session(session_id, status=session['status'])
+    return at
+
+@socketio.on('set_preroll')
+@instrumented('set_preroll')
+def handle_set_preroll(data):
+    """Change how many seconds of pre-roll every phone keeps buffered"""
+    try:
+        seconds = min(MAX_PREROLL_SECONDS, max(0.0, float((data or {}).get('seconds') or 0)))
+    except (TypeError, ValueError):
+        return
+    state_backend.set('preroll_seconds', seconds)
+    config = {'seconds': seconds}
+    socketio.emit('preroll_config', config, room=DEVICES_ROOM)
+    socketio.emit('preroll_config', config, room='admin')
+    for device in registry.cluster_connected():
+        if device.get('transport') == TRANSPORT_BLUETOOTH:
+            send_to_device(device, 'preroll_config', config)
+
+@socketio.on('sync_control_command')
+@instrumented('sync_control_command')
+def handle_sync_control(data):
+    """Synchronized stop, pause or resume of a session's current take.
+
+    A stop with ``after`` (seconds) reschedules the end of the take, so it
+    can also shorten or extend a take that was started with a duration.
+    """
+    data = data or {}
+    action = data.get('action')
+    session_id = data.get('session_id')
+    session = sync_sessions.get(session_id) if session_id else None
+    if session is None or action not in CONTROL_ACTIONS:
+        emit('sync_control_sent', {'session_id': session_id, 'action': action,
+                                   'error': 'unknown session or action'})
+        return
+    take = session['takes'][-1]
+    if take['status'] not in LIVE_TAKE_STATES:
+        emit('sync_control_sent', {'session_id': session_id, 'action': action,
+                                   'error': f'take {take["take"]} is {take["status"]}'})
+        return
+    after = data.get('after')
+    if after is not None:
+        try:
+            after = float(after)
+        except (TypeError, ValueError):
+            after = math.nan
+        # inf or NaN would be sent on as an instant no JSON parser accepts
+        if not math.isfinite(after) or after < 0:
+            emit('sync_control_sent', {'session_id': session_id, 'action': action,
+                                       'error': 'invalid delay'})
+            return
+    at = schedule_control(session_id, session, take, action, after=after)
+    socketio.emit('sync_control_sent', {
+        'session_id': session_id,
+        'take': take['take'],
+        'action': action,
+        'at': at,
+        'lead_time': at - time.time(),
+        'status': take['status']
+    }, room='admin')
+
+def report_readiness(session_id, take_index, deadline, exclude_late):
+    """Background task: report ready/late/missing devices before the start"""
+    socketio.sleep(max(0.0, deadline - time.time()))
+    session = sync_sessions.get(session_id)
+    if session is None:
+        return
+    take = session['takes'][take_index]
+    
+    acks_key = f'acks:{session_id}:{take_index}'
+    acks = {device_id: json.loads(raw)['state']
+            for device_id, raw in state_backend.hgetall(acks_key).items()}
+    report = readiness_report(take['devices'], acks)
+    state_backend.delete(acks_key)
+    
+    excluded = []
+    if exclude_late:
+        excluded = report[STATE_LATE] + report[STATE_MISSING]
+        for device_id in excluded:
+            take['devices'][device_id]['state'] = 'excluded'
+            device = registry.get(device_id)
+            if device is None or device['sid'] is None:
+                # Owned by another worker: look it up in the shared snapshot
+                raw = state_backend.hget('devices', device_id)
+                device = json.loads(raw) if raw else None
+            if device and device['sid']:
+                send_to_device(device, 'sync_recording_cancel',
+                               {'session_id': session_id, 'take': take_index})
+    
+    take['readiness'] = report
+    take['excluded'] = excluded
+    sync_sessions.save(session_id, session)
+    catalog.record_session(session_id, readiness=dict(report, excluded=excluded, take=take_index))
+    socketio.emit('sync_readiness', dict(report, session_id=session_id, take=take_index,
+                                         excluded=excluded), room='admin')
+
+def session_take(data):
+    """(session_id, session, take) for an event's session/take ids, or Nones"""
+    session_id = data.get('session_id')
+    session = sync_sessions.get(session_id) if session_id else None
+    try:
+        take_index = int(data.get('take') or 0)
+        take = session['takes'][take_index] if session and take_index >= 0 else None
+    except (IndexError, TypeError, ValueError):
+        take = None
+    return session_id, session, take
+
+def device_to_server_time(device, timestamp):
+    """A device-clock timestamp on the server clock (unchanged until synced)"""
+    estimate = device['clock']
+    timestamp = float(timestamp)
+    if estimate.synced:
+        timestamp += estimate.offset_at(time.time())
+    return timestamp
+
+def set_device_take_state(device, session_id, session, take, state, at):
+    """Track one device's state within a take and surface it to admins"""
+    entry = take['devices'].setdefault(device['device_id'], {})
+    entry['state'] = state
+    entry[state + '_at'] = at
+    sync_sessions.save(session_id, session)
+    admin_updates.upsert(device['device_id'], activity=state, take=take['take'])
+    catalog.record_take(session_id, device['device_id'], take=take['take'], state=state,
+                        **({'stopped_at': at} if state == DEVICE_STOPPED else {}))
+
+@socketio.on('sync_command_ack')
+@instrumented('sync_command_ack')
+def handle_sync_command_ack(data):
+    device = registry.get_by_sid(request.sid)
+    if device is not None:
+        record_command_ack(device, data)
+
+def record_command_ack(device, data):
+    """Record whether a device received its start command in time"""
+    session_id, session, take = session_take(data)
+    if take is None:
+        return
+    
+    now = time.time()
+    estimate = device['clock']
+    received_at = math.nan
+    if estimate.synced and data.get('received_at') is not None:
+        try:
+            received_at = float(data['received_at']) + estimate.offset_at(now)
+        except (TypeError, ValueError):
+            pass
+    if not math.isfinite(received_at):
+        # No clock estimate or usable time: assume the command took half an RTT to arrive
+        received_at = now - (estimate.rtt or 0.0) / 2.0
+    
+    state = classify_ack(take['start_time'], received_at)
+    state_backend.hset(f'acks:{session_id}:{take["take"]}', device['device_id'],
+                       json.dumps({'state': state, 'received_at': received_at}))
+    admin_updates.upsert(device['device_id'], readiness=state)
+
+@socketio.on('recording_started')
+@instrumented('recording_started')
+def handle_recording_started(data):
+    device = registry.get_by_sid(request.sid)
+    if device is not None:
+        record_recording_started(device, data)
+
+def record_recording_started(device, data):
+    """Record when a device actually started, on the server clock.
+
+    A device with pre-roll reports when its buffering recorder started, which
+    is before the take's start; the difference is stored as its pre-roll.
+    """
+    session_id, session, take = session_take(data)
+    if take is None or data.get('started_at') is None:
+        return
+    estimate = device['clock']
+    started_at = device_to_server_time(device, data['started_at'])
+    preroll = max(0.0, take['start_time'] - started_at) if data.get('preroll') else 0.0
+    try:
+        write_metadata(session_id, {
+            'started_at': started_at,
+            'preroll': preroll,
+            'clock_synced': estimate.synced,
+            'error_bound': estimate.error_bound
+        }, device_id=device['device_id'], take=take['take'])
+    except IngestError:
+        return
+    take['devices'].setdefault(device['device_id'], {})['preroll'] = preroll
+    if take['status'] == 'scheduled':
+        take['status'] = session['status'] = 'recording'
+    set_device_take_state(device, session_id, session, take, DEVICE_RECORDING, started_at)
+    catalog.record_take(session_id, device['device_id'], take=take['take'],
+                        started_at=started_at, preroll=preroll,
+                        clock_synced=int(estimate.synced), error_bound=estimate.error_bound,
+                        profile=profile_assignments.get(device['device_id']))
+
+@socketio.on('recording_state')
+@instrumented('recording_state')
+def handle_recording_state(data):
+    device = registry.get_by_sid(request.sid)
+    if device is not None:
+        record_recording_state(device, data)
+
+def record_recording_state(device, data):
+    """Record a device pausing, resuming or stopping, on the server clock"""
+    session_id, session, take = session_take(data)
+    state = data.get('state')
+    if take is None or state not in DEVICE_STATES or data.get('at') is None:
+        return
+    at = device_to_server_time(device, data['at'])
+    # Pause/resume points let post-processing cut every angle to the same segments
+    fields = {'stopped_at': at} if state == DEVICE_STOPPED else {}
+    if state == DEVICE_STOPPED:
+        quality = quality_telemetry.finish(session_id, take['take'], device['device_id'])
+        if quality is not None:
+            fields['quality'] = quality
+            catalog.record_take(session_id, device['device_id'], take=take['take'],
+                                quality=quality)
+    try:
+        path = chunk_ingest.metadata_path(session_id, device['device_id'], take['take'])
+    except IngestError:
+        return
+    offload(add_metadata_event, session_id, device['device_id'], take['take'],
+            {'state': state, 'at': at}, fields, key=path, force=True)
+    set_device_take_state(device, session_id, session, take, state, at)
+
+@socketio.on('recording_telemetry')
+@instrumented('recording_telemetry')
+def handle_recording_telemetry(data):
+    device = registry.get_by_sid(request.sid)
+    if device is not None:
+        record_telemetry(device, data)
+
+def quality_key(session_id):
+    return 'quality:' + session_id
+
+def session_quality(session_id, take_index):
+    """Quality of one take across its devices, whichever worker they report to"""
+    prefix = f'{take_index}:'
+    summaries = {field[len(prefix):]: json.loads(raw)
+                 for field, raw in state_backend.hgetall(quality_key(session_id)).items()
+                 if field.startswith(prefix)}
+    return dict(session_summary(summaries), session_id=session_id, take=take_index)
+
+def record_telemetry(device, data):
+    """Fold a phone's recording stats into its window; alert admins to new anomalies"""
+    session_id, session, take = session_take(data)
+    if take is None:
+        return
+    try:
+        report = parse_report(data)
+    except TelemetryError:
+        return
+    device_id = device['device_id']
+    profile = profile_assignments.get(device_id)
+    summary, raised, cleared = quality_telemetry.report(
+        session_id, take['take'], device_id, report,
+        expected_fps=profile['frame_rate'] if profile else None)
+    # Shared, so the session's quality covers devices on every worker
+    state_backend.hset(quality_key(session_id), f'{take["take"]}:{device_id}', json.dumps(summary))
+    admin_updates.upsert(device_id, quality=summary)
+    if not raised and not cleared:
+        return
+    for kind in raised:
+        quality_anomalies.inc(kind=kind)
+    catalog.record_take(session_id, device_id, take=take['take'], quality=summary)
+    socketio.emit('quality_alert', {
+        'session_id': session_id,
+        'take': take['take'],
+        'device_id': device_id,
+        'raised': raised,
+        'cleared': cleared,
+        'session': session_quality(session_id, take['take'])
+    }, room='admin')
+
+@socketio.on('process_session')
+@instrumented('process_session')
+def handle_process_session(data):
+    """Queue alignment/stitching of one take's uploaded recordings"""
+    session_id = data.get('session_id')
+    take = data.get('take') or 0
+    try:
+        session_dir = chunk_ingest.take_dir(session_id, take)
+    except IngestError as e:
+        emit('pipeline_status', {'session_id': session_id, 'status': 'failed', 'error': str(e)})
+        return
+    if not os.path.isdir(session_dir):
+        emit('pipeline_status', {'session_id': session_id, 'status': 'failed',
+                                 'error': 'no recordings for this take'})
+        return
+    # Jobs are keyed per take; the first take keeps the plain session id
+    job_id = session_id if not int(take) else f'{session_id}-take{int(take)}'
+    try:
+        job = pipeline.submit(job_id, session_dir, mosaic=bool(data.get('mosaic')))
+    except DispatchBusy:
+        dispatch_rejected.inc(pool='cpu')
+        emit('pipeline_status', {'session_id': job_id, 'status': 'failed',
+                                 'error': 'post-processing queue is full'})
+        return
+    emit('pipeline_status', pipeline.describe(job))
+
+@socketio.on('verify_session')
+@instrumented('verify_session')
+def handle_verify_session(data):
+    """Check every upload of a session against its checksums, one job per upload"""
+    sid = request.sid
+    session_id = data.get('session_id')
+
+    def failed(error):
+        socketio.emit('pipeline_status', {'session_id': f'verify-{session_id}', 'kind': JOB_VERIFY,
+                                          'status': 'failed', 'error': error}, to=sid)
+
+    def found(streams, error):
+        if error is not None:
+            failed('no recordings for this session')
+            return
+        for path in streams:
+            _, take, device_id = chunkstore.stream_labels(path)
+            try:
+                job = pipeline.submit_verify(f'verify-{session_id}-{take}-{device_id}', path)
+            except DispatchBusy:
+                dispatch_rejected.inc(pool='cpu')
+                failed('post-processing queue is full')
+                return
+            socketio.emit('pipeline_status', pipeline.describe(job), to=sid)
+
+    try:
+        offload(chunkstore.find_streams, chunk_ingest.take_dir(session_id), callback=found)
+    except (IngestError, DispatchBusy) as e:
+        failed(str(e))
+
+@socketio.on('clock_sync_ping')
+@instrumented('clock_sync_ping')
+def handle_clock_sync_ping(data):
+    """Answer a timestamped ping so the client can measure RTT and offset"""
+    received_at = time.time()
+    emit_to_sid(request.sid, 'clock_sync_pong', {
+        't0': data.get('t0'),
+        't1': received_at,
+        't2': time.time()
+    })
+
+@socketio.on('clock_sync_report')
+@instrumented('clock_sync_report')
+def handle_clock_sync_report(data):
+    """Store the device's clock offset from its lowest-RTT samples"""
+    device = registry.get_by_sid(request.sid)
+    if device is None:
+        emit('clock_sync_result', {'error': 'device not registered'})
+        return
+    
+    estimate = device['clock']
+    if not estimate.update(data.get('samples')):
+        emit('clock_sync_result', {'error': 'no usable samples'})
+        return
+    
+    registry.save(device)
+    emit('clock_sync_result', estimate.as_dict())
+    admin_updates.upsert(device['device_id'], sync_error=estimate.error_bound)
+
+@socketio.on('upload_chunk')
+@instrumented('upload_chunk')
+def handle_upload_chunk(data):
+    """Queue a binary MediaRecorder chunk for writing; it is acknowledged once on disk.
+
+    Chunks of one stream are written in arrival order on the I/O pool. When
+    the pool is full the chunk is refused with an error ack and the client
+    retries it with backoff.
+    """
+    sid = request.sid
+    session_id = data.get('session_id')
+    device_id = data.get('device_id')
+    take = data.get('take') or 0
+    seq = data.get('seq')
+    chunk = data.get('data') or b''
+
+    def acknowledge(result, error):
+        if error is not None:
+            socketio.emit('chunk_ack', {'session_id': session_id, 'take': take, 'seq': seq,
+                                        'error': str(error)}, to=sid)
+            return
+        status, next_seq = result
+        ingest_chunks.inc(transport='socketio', status=status)
+        if status == STATUS_OK:
+            ingest_bytes.inc(len(chunk))
+        emit_to_sid(sid, 'chunk_ack', {
+            'session_id': session_id,
+            'take': take,
+            'seq': seq,
+            'status': status,
+            'next_seq': next_seq
+        })
+
+    try:
+        offload(chunk_ingest.append, session_id, device_id, seq, chunk, take,
+                key=chunk_ingest.stream_path(session_id, device_id, take), callback=acknowledge)
+    except (IngestError, DispatchBusy) as e:
+        emit('chunk_ack', {'session_id': session_id, 'take': take, 'seq': seq, 'error': str(e)})
+
+@socketio.on('upload_resume')
+@instrumented('upload_resume')
+def handle_upload_resume(data):
+    """Tell a reconnecting client which chunk to send next"""
+    sid = request.sid
+    session_id = data.get('session_id')
+    device_id = data.get('device_id')
+    take = data.get('take') or 0
+
+    def reply(state, error):
+        if error is not None:
+            socketio.emit('chunk_ack', {'session_id': session_id, 'take': take,
+                                        'error': str(error)}, to=sid)
+            return
+        emit_to_sid(sid, 'chunk_ack', {
+            'session_id': session_id,
+            'take': take,
+            'status': 'resume',
+            'next_seq': state['next_seq']
+        })
+
+    try:
+        offload(chunk_ingest.next_seq, session_id, device_id, take,
+                key=chunk_ingest.stream_path(session_id, device_id, take), callback=reply)
+    except (IngestError, DispatchBusy) as e:
+        emit('chunk_ack', {'session_id': session_id, 'take': take, 'error': str(e)})
+
+@socketio.on('upload_complete')
+@instrumented('upload_complete')
+def handle_upload_complete(data):
+    """Finalize a device's upload once all chunks have arrived"""
+    sid = request.sid
+    session_id = data.get('session_id')
+    device_id = data.get('device_id')
+    take = data.get('take') or 0
+
+    def finalized(state, error):
+        if error is not None:
+            socketio.emit('upload_finalized', {'session_id': session_id, 'take': take,
+                                               'error': str(error)}, to=sid)
+            return
+        socketio.emit('upload_finalized', dict(state, session_id=session_id, take=take), to=sid)
+        if state['complete']:
+            admin_updates.upsert(device_id, activity='uploaded', uploaded_bytes=state['size'])
+            catalog.record_file(path, session_id=session_id, take=int(take), device_id=device_id,
+                                kind='recording', size=state['size'], chunks=state['next_seq'],
+                                complete=1, checksum=state['checksum'],
+                                verified=chunkstore.VERIFIED, updated_at=time.time())
+            if app.config['INDEX_RECORDINGS']:
+                try:
+                    pipeline.submit_index(f'index-{session_id}-{take}-{device_id}', path,
+                                          session_id, int(take), device_id)
+                except DispatchBusy:
+                    # Alignment indexes it anyway before using it
+                    pass
+
+    try:
+        path = chunk_ingest.stream_path(session_id, device_id, take)
+        offload(finalize_upload, session_id, device_id, data.get('total_chunks', 0), take,
+                key=path, callback=finalized)
+    except (IngestError, DispatchBusy) as e:
+        emit('upload_finalized', {'session_id': session_id, 'take': take, 'error': str(e)})
+
+@socketio.on(wire.EVENT)
+def handle_wire_frame(frame):
+    """A binary frame, handled exactly like the JSON event it encodes"""
+    try:
+        event, data = wire.decode(frame)
+    except wire.WireError:
+        wire_frames.inc(direction='in', event='invalid')
+        return
+    handler = WIRE_HANDLERS.get(event)
+    if handler is None:
+        wire_frames.inc(direction='in', event='invalid')
+        return
+    wire_frames.inc(direction='in', event=event)
+    handler(data)
+
+@socketio.on('join_admin')
+@instrumented('join_admin')
+def handle_admin_join():
+    join_room('admin')
+    # Full snapshot once; afterwards the admin only receives deltas
+    emit('devices_snapshot', {
+        'devices': [device_summary(d) for d in registry.cluster_devices()],
+        'total_devices': len(registry.cluster_connected())
+    })
+    emit('preroll_config', {'seconds': preroll_seconds()})
+    # Current thumbnails straight away, within one second's preview budget
+    emit('device_previews', {'frames': previews.latest(preview_budget(1.0))})
+
+@socketio.on('set_device_group')
+@instrumented('set_device_group')
+def handle_set_device_group(data):
+    """Admin: move a device to another group; takes started afterwards follow it"""
+    data = data or {}
+    device_id, group = data.get('device_id'), data.get('group')
+    if not valid_group(group):
+        emit('device_group_set', {'device_id': device_id, 'error': 'invalid group name'})
+        return
+    device = registry.get(device_id) if device_id else None
+    if device is not None and device['sid'] is not None:
+        move_device_group(device, group)
+    else:
+        # Owned by another worker: the phone asks its own worker to move it (join_group)
+        raw = state_backend.hget('devices', device_id) if device_id else None
+        snapshot = json.loads(raw) if raw else None
+        if not (snapshot and snapshot['sid'] and
+                send_to_device(snapshot, 'group_assigned', {'group': group})):
+            emit('device_group_set', {'device_id': device_id, 'error': 'device not connected'})
+            return
+    emit('device_group_set', {'device_id': device_id, 'group': group})
+
+@socketio.on('join_group')
+@instrumented('join_group')
+def handle_join_group(data):
+    """A phone moves itself to a group, or confirms one an admin assigned"""
+    device = registry.get_by_sid(request.sid)
+    group = (data or {}).get('group')
+    if device is None:
+        return {'error': 'device not registered'}
+    if not valid_group(group):
+        return {'error': 'invalid group name'}
+    move_device_group(device, group)
+    return {'group': group}
+
+# Client events that may arrive as binary frames
+WIRE_HANDLERS = {
+    'heartbeat': handle_heartbeat,
+    'clock_sync_ping': handle_clock_sync_ping,
+    'sync_command_ack': handle_sync_command_ack,
+    'upload_backlog': handle_upload_backlog,
+    'recording_telemetry': handle_recording_telemetry
+}
+
+def handle_bluetooth_event(device, event, data):
+    """Application-level handling of messages from Bluetooth devices"""
+    event_count.inc(event='bluetooth:' + event)
+    if event == 'sync_command_ack':
+        record_command_ack(device, data)
+    elif event == 'recording_started':
+        record_recording_started(device, data)
+    elif event == 'recording_state':
+        record_recording_state(device, data)
+    elif event == 'recording_telemetry':
+        record_telemetry(device, data)
+    elif event in ('register_device', 'clock_sync_report'):
+        admin_updates.upsert(**device_summary(registry.snapshot(device)))
+        request_rebalance()
+    elif event in ('heartbeat', 'disconnect'):
+        admin_updates.upsert(device['device_id'], status=device['status'])
+        request_rebalance()
+
+def relay_bluetooth_events():
+    """Background task: run Bluetooth messages on the loop, not the RFCOMM thread"""
+    empty = original_module('queue').Empty
+    while True:
+        while True:
+            try:
+                func, args = bluetooth_events.get_nowait()
+            except empty:
+                break
+            try:
+                func(*args)
+            except Exception:
+                app.logger.exception('Bluetooth message %r failed', args)
+        socketio.sleep(CALLBACK_INTERVAL)
+
+def bridge_bluetooth(framed_server):
+    """Share the device registry with a framed server's devices; starts its thread"""
+    global bluetooth_bridge
+    bluetooth_bridge = BluetoothBridge(
+        registry, framed_server,
+        on_event=lambda device, event, data: handle_bluetooth_event(device, event, data),
+        schedule=lambda func, *args: bluetooth_events.put((func, args)))
+    socketio.start_background_task(relay_bluetooth_events)
+    framed_server.start()
+    return bluetooth_bridge
+
+def start_bluetooth():
+    """Serve Bluetooth devices from this process, sharing the device registry"""
+    from .bluetooth_server import open_rfcomm_socket
+    server_sock = open_rfcomm_socket()
+    bridge_bluetooth(FramedServer(server_sock))
+    return server_sock.getsockname()[1]
+
+def load_config(app):
+    """Settings from the environment, with their defaults"""
+    app.config['SECRET_KEY'] = 'sync-recording-key'
+    app.config['RECORDINGS_DIR'] = os.environ.get('RECORDINGS_DIR', 'recordings')
+    app.config['CATALOG_PATH'] = os.environ.get('CATALOG_PATH')
+    app.config['ADMIN_UPDATE_INTERVAL'] = float(
+        os.environ.get('ADMIN_UPDATE_INTERVAL', ADMIN_UPDATE_INTERVAL))
+    # Set in the environment: a redis:// backend needs eventlet patched at import
+    app.config['SYNC_BACKEND_URL'] = os.environ.get('SYNC_BACKEND_URL', 'memory://')
+    app.config['BLUETOOTH_ENABLED'] = os.environ.get('BLUETOOTH_ENABLED', '') == '1'
+    # Total recording upload bandwidth shared by all phones (Mbit/s)
+    app.config['INGEST_BUDGET_MBPS'] = float(
+        os.environ.get('INGEST_BUDGET_MBPS', DEFAULT_BUDGET_BPS / 1e6))
+    # Seconds of pre-roll phones buffer before a take starts (0 = off; admins can change it)
+    app.config['PREROLL_SECONDS'] = float(os.environ.get('PREROLL_SECONDS', 0))
+    # Live preview thumbnails: pushes per second and bandwidth to admins (Mbit/s)
+    app.config['PREVIEW_FPS'] = float(os.environ.get('PREVIEW_FPS', PREVIEW_FPS))
+    app.config['PREVIEW_BUDGET_MBPS'] = float(
+        os.environ.get('PREVIEW_BUDGET_MBPS', PREVIEW_BUDGET_BPS / 1e6))
+    # Blocking work offload: I/O threads, CPU processes (0 = one per core), queue cap per pool
+    app.config['IO_WORKERS'] = int(os.environ.get('IO_WORKERS', IO_WORKERS))
+    app.config['CPU_WORKERS'] = int(os.environ.get('CPU_WORKERS', 0))
+    app.config['DISPATCH_MAX_PENDING'] = int(os.environ.get('DISPATCH_MAX_PENDING', MAX_PENDING))
+    # Make finished uploads seekable (Duration, Cues) and index them as soon as they complete
+    app.config['INDEX_RECORDINGS'] = os.environ.get('INDEX_RECORDINGS', '1') != '0'
+    # nginx location serving RECORDINGS_DIR (internal, with sendfile); empty = the app streams files
+    app.config['RECORDINGS_ACCEL_PREFIX'] = os.environ.get('RECORDINGS_ACCEL_PREFIX', '')
+    # Event loop blocked longer than this (seconds) is logged as a stall
+    app.config['LOOP_STALL_THRESHOLD'] = float(
+        os.environ.get('LOOP_STALL_THRESHOLD', STALL_THRESHOLD))
+
+def create_app(config=None):
+    """Build the Flask app and the server's state; once per process.
+
+    ``config`` overrides settings read from the environment. Nothing is
+    opened or rendered until this runs, so importing the package stays cheap.
+    """
+    global app, state_backend, registry, sync_sessions, dispatcher, stall_detector, pipeline
+    global chunk_ingest, catalog
+    app = Flask(__name__)
+    load_config(app)
+    app.config.update(config or {})
+    if not app.config['CATALOG_PATH']:
+        app.config['CATALOG_PATH'] = os.path.join(app.config['RECORDINGS_DIR'], 'catalog.sqlite3')
+
+    # Shared state and cross-worker emit fan-out (in-memory for a single process)
+    state_backend, client_manager = create_backends(app.config['SYNC_BACKEND_URL'])
+    socketio_options = {'client_manager': client_manager} if client_manager else {}
+    socketio.init_app(app, cors_allowed_origins="*",
+                      max_http_buffer_size=MAX_CHUNK_BYTES + 64 * 1024,
+                      **socketio_options)
+    app.register_blueprint(bp)
+
+    # Store connected devices and sync data
+    registry = DeviceRegistry(backend=state_backend)
+    sync_sessions = SessionStore(backend=state_backend)
+    # Handlers hand file/database work to the I/O pool and CPU work to the process pool
+    dispatcher = Dispatcher(app.config['IO_WORKERS'], app.config['CPU_WORKERS'] or None,
+                            app.config['DISPATCH_MAX_PENDING'], sleep=socketio.sleep)
+    stall_detector = StallDetector(app.config['LOOP_STALL_THRESHOLD'])
+    pipeline = PipelineQueue(executor=dispatcher.cpu)
+    chunk_ingest = ChunkIngest(app.config['RECORDINGS_DIR'])
+    catalog = Catalog(app.config['CATALOG_PATH'])
+
+    with app.app_context():
+        pages['mobile'] = PrerenderedPage(render_template('mobile.html',
+                                                          wire_frames=wire.describe()))
+        pages['admin'] = PrerenderedPage(render_template('admin.html'))
+    return app
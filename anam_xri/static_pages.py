@@ -0,0 +1,52 @@
+"""Pre-rendered pages served with ETags and precompressed variants.
+
+The mobile client and admin dashboard templates never change while the
+server is running, so they are rendered once at startup and kept as bytes
+alongside gzip (and brotli, if installed) variants. Requests are answered
+from memory with conditional-GET support instead of re-running Jinja.
+"""
+import gzip
+import hashlib
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class PrerenderedPage:
+    def __init__(self, html, mimetype='text/html; charset=utf-8'):
+        body = html.encode('utf-8') if isinstance(html, str) else html
+        self.mimetype = mimetype
+        digest = hashlib.sha1(body).hexdigest()[:20]
+
+        # encoding -> (body, etag); each variant gets its own strong ETag
+        self.variants = {'identity': (body, digest)}
+        self.variants['gzip'] = (gzip.compress(body, compresslevel=9), digest + '-gzip')
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(body, quality=11), digest + '-br')
+
+    def _preferred_encoding(self):
+        offered = [e for e in ('br', 'gzip') if e in self.variants]
+        return request.accept_encodings.best_match(offered, default='identity') or 'identity'
+
+    def response(self):
+        """Build a response for the current request, honouring If-None-Match"""
+        encoding = self._preferred_encoding()
+        body, etag = self.variants[encoding]
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=self.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        # Revalidate every time: the ETag changes whenever the server restarts
+        # with an updated template.
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
@@ -0,0 +1,225 @@
+"""Recording quality telemetry from phones, aggregated in rolling windows.
+
+While a take is recording, each phone reports every few seconds what
+happened since its last report: the bytes and chunks its MediaRecorder
+produced (``ondataavailable``), camera frames delivered and dropped, how far
+its wall clock moved against its monotonic clock, and its battery level.
+
+The server keeps the last ``TELEMETRY_WINDOW`` reports of each device's
+take, so every summary covers the same fixed span no matter how long the
+take runs. Each report is checked against that window:
+
+* ``stalled``: the recorder produced nothing for a whole interval.
+* ``bitrate_drop``: the latest interval fell far below the window average.
+* ``dropped_frames``: too many camera frames dropped over the window.
+* ``low_fps``: delivered frame rate well under the profile's frame rate.
+* ``clock_drift``: the wall clock was stepped or slewed mid-take, so the
+  start time the phone was given no longer lines up with its recording.
+* ``low_battery``: the battery is nearly empty and not charging.
+
+Summaries of one session's devices are combined with ``session_summary``.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Seconds between reports from a recording phone (sent at registration)
+TELEMETRY_INTERVAL = 2.0
+# Reports kept per device and take (30 s at the default interval)
+TELEMETRY_WINDOW = 15
+MAX_TELEMETRY_STREAMS = 1024
+# Reports in a window before rate-based checks apply
+MIN_REPORTS = 3
+# An interval at least this long (seconds) with no chunk is a stall; the
+# recorder emits a chunk every second
+STALL_AFTER = 1.5
+# Latest interval's bitrate below this share of the window average
+BITRATE_DROP_RATIO = 0.25
+# Share of camera frames dropped over the window
+DROPPED_FRAMES_RATIO = 0.05
+# Delivered frame rate below this share of the profile's
+LOW_FPS_RATIO = 0.75
+# Wall-clock movement against the monotonic clock over the window (seconds);
+# more than about half a frame at 30 fps
+CLOCK_DRIFT_LIMIT = 0.02
+LOW_BATTERY = 0.15
+
+ANOMALY_STALLED = 'stalled'
+ANOMALY_BITRATE_DROP = 'bitrate_drop'
+ANOMALY_DROPPED_FRAMES = 'dropped_frames'
+ANOMALY_LOW_FPS = 'low_fps'
+ANOMALY_CLOCK_DRIFT = 'clock_drift'
+ANOMALY_LOW_BATTERY = 'low_battery'
+ANOMALIES = (ANOMALY_STALLED, ANOMALY_BITRATE_DROP, ANOMALY_DROPPED_FRAMES, ANOMALY_LOW_FPS,
+             ANOMALY_CLOCK_DRIFT, ANOMALY_LOW_BATTERY)
+
+
+class TelemetryError(ValueError):
+    """Raised for reports with missing or out-of-range values"""
+
+
+def _number(data, name, optional=False, minimum=None):
+    value = data.get(name)
+    if value is None and optional:
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise TelemetryError(f'{name} must be a number')
+    if value != value or (minimum is not None and value < minimum):
+        raise TelemetryError(f'{name} out of range')
+    return value
+
+
+def parse_report(data):
+    """A validated report from a client's ``recording_telemetry`` payload"""
+    report = {
+        'interval': _number(data, 'interval', minimum=0),
+        'bytes': int(_number(data, 'bytes', minimum=0)),
+        'chunks': int(_number(data, 'chunks', minimum=0)),
+        'frames': _number(data, 'frames', optional=True, minimum=0),
+        'dropped': _number(data, 'dropped', optional=True, minimum=0),
+        'clock_drift': _number(data, 'clock_drift', optional=True) or 0.0,
+        'battery': _number(data, 'battery', optional=True, minimum=0),
+        'charging': bool(data.get('charging'))
+    }
+    if report['interval'] <= 0:
+        raise TelemetryError('interval out of range')
+    if report['battery'] is not None and report['battery'] > 1:
+        raise TelemetryError('battery out of range')
+    return report
+
+
+class RollingWindow:
+    """The last ``size`` reports of one device's take"""
+
+    def __init__(self, size=TELEMETRY_WINDOW):
+        self.reports = deque(maxlen=size)
+        self.anomalies = set()
+        self.updated_at = None
+
+    def add(self, report, now=None):
+        self.reports.append(report)
+        self.updated_at = time.time() if now is None else now
+
+    def detect(self, expected_fps=None):
+        """Anomalies in the window as it stands"""
+        reports = self.reports
+        latest = reports[-1]
+        found = set()
+        if latest['interval'] >= STALL_AFTER and latest['chunks'] == 0:
+            found.add(ANOMALY_STALLED)
+        if len(reports) > MIN_REPORTS and latest['interval'] >= STALL_AFTER:
+            earlier = list(reports)[:-1]
+            average = sum(r['bytes'] for r in earlier) / sum(r['interval'] for r in earlier)
+            if latest['bytes'] / latest['interval'] < BITRATE_DROP_RATIO * average:
+                found.add(ANOMALY_BITRATE_DROP)
+        counted = [r for r in reports if r['frames'] is not None and r['dropped'] is not None]
+        if len(counted) >= MIN_REPORTS:
+            frames = sum(r['frames'] for r in counted)
+            dropped = sum(r['dropped'] for r in counted)
+            if dropped and dropped / (frames + dropped) > DROPPED_FRAMES_RATIO:
+                found.add(ANOMALY_DROPPED_FRAMES)
+            fps = frames / sum(r['interval'] for r in counted)
+            if expected_fps and fps < LOW_FPS_RATIO * expected_fps:
+                found.add(ANOMALY_LOW_FPS)
+        if abs(sum(r['clock_drift'] for r in reports)) > CLOCK_DRIFT_LIMIT:
+            found.add(ANOMALY_CLOCK_DRIFT)
+        if (latest['battery'] is not None and latest['battery'] < LOW_BATTERY and
+                not latest['charging']):
+            found.add(ANOMALY_LOW_BATTERY)
+        return found
+
+    def summary(self):
+        """Window totals as rates; None where the phone reported nothing"""
+        reports = self.reports
+        seconds = sum(r['interval'] for r in reports)
+        counted = [r for r in reports if r['frames'] is not None and r['dropped'] is not None]
+        frames = sum(r['frames'] for r in counted)
+        dropped = sum(r['dropped'] for r in counted)
+        counted_seconds = sum(r['interval'] for r in counted)
+        latest = reports[-1]
+        return {
+            'reports': len(reports),
+            'seconds': seconds,
+            'bitrate': sum(r['bytes'] for r in reports) * 8 / seconds,
+            'chunk_bytes': (sum(r['bytes'] for r in reports) /
+                            max(1, sum(r['chunks'] for r in reports))),
+            'fps': frames / counted_seconds if counted else None,
+            'dropped_ratio': dropped / (frames + dropped) if frames + dropped else None,
+            'clock_drift': sum(r['clock_drift'] for r in reports),
+            'battery': latest['battery'],
+            'charging': latest['charging'],
+            'anomalies': sorted(self.anomalies),
+            'updated_at': self.updated_at
+        }
+
+
+class TelemetryAggregator:
+    """Rolling windows per (session, take, device), bounded by count"""
+
+    def __init__(self, window=TELEMETRY_WINDOW, max_streams=MAX_TELEMETRY_STREAMS):
+        self.window = window
+        self.max_streams = max_streams
+        # (session_id, take, device_id) -> RollingWindow, least recently updated first
+        self._windows = OrderedDict()
+        # device_id -> its latest summary, for admins joining later
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._windows)
+
+    def report(self, session_id, take, device_id, report, expected_fps=None, now=None):
+        """Add a report. Returns (summary, raised anomalies, cleared anomalies)."""
+        key = (session_id, take, device_id)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = RollingWindow(self.window)
+            self._windows.move_to_end(key)
+            while len(self._windows) > self.max_streams:
+                self._windows.popitem(last=False)
+            window.add(report, now)
+            found = window.detect(expected_fps)
+            raised, cleared = found - window.anomalies, window.anomalies - found
+            window.anomalies = found
+            summary = self._latest[device_id] = window.summary()
+        return summary, sorted(raised), sorted(cleared)
+
+    def finish(self, session_id, take, device_id):
+        """Final summary of a device's take (None if it never reported)"""
+        with self._lock:
+            window = self._windows.pop((session_id, take, device_id), None)
+        return window.summary() if window is not None else None
+
+    def latest(self, device_id):
+        return self._latest.get(device_id)
+
+    def forget(self, device_id):
+        with self._lock:
+            self._latest.pop(device_id, None)
+            for key in [key for key in self._windows if key[2] == device_id]:
+                del self._windows[key]
+
+
+def session_summary(summaries):
+    """One take's quality across its devices, from their window summaries"""
+    if not summaries:
+        return {'devices': 0, 'bitrate': 0, 'min_fps': None, 'max_dropped_ratio': None,
+                'max_clock_drift': None, 'min_battery': None, 'flagged': {}}
+
+    def values(name):
+        return [s[name] for s in summaries.values() if s.get(name) is not None]
+
+    fps, dropped, battery = values('fps'), values('dropped_ratio'), values('battery')
+    return {
+        'devices': len(summaries),
+        'bitrate': sum(values('bitrate')),
+        'min_fps': min(fps) if fps else None,
+        'max_dropped_ratio': max(dropped) if dropped else None,
+        'max_clock_drift': max(abs(v) for v in values('clock_drift')),
+        'min_battery': min(battery) if battery else None,
+        'flagged': {device_id: s['anomalies'] for device_id, s in sorted(summaries.items())
+                    if s['anomalies']}
+    }
@@ -0,0 +1,505 @@
+"""Cluster/keyframe index and seekable rewrite of MediaRecorder WebM files.
+
+MediaRecorder writes WebM for live streaming: the Segment, and often every
+Cluster, has an unknown size, Info has no Duration and there are no Cues.
+A player or editor has to read the whole file to find its length or a
+seek point. ``make_seekable`` fixes that without re-encoding:
+
+1. The file is memory-mapped and walked element by element. Only element
+   and block headers are read, so memory use doesn't grow with the file.
+   An unknown-size cluster ends where the next element that can't be its
+   child begins; a truncated tail (an upload cut off mid-write) is dropped.
+2. Each cluster's time and byte range is indexed, as is every keyframe of
+   the video track (a ``SimpleBlock`` with the key flag, or a
+   ``BlockGroup`` without ``ReferenceBlock``).
+3. The file is rewritten next to the original and swapped in atomically:
+   the EBML header, then a Segment of known size holding a SeekHead, Info
+   with Duration, the original Tracks (and any Tags, Chapters or
+   Attachments), Cues, and the clusters, copied unchanged apart from their
+   size field. Cues go before the clusters, so one read at the start of the
+   file finds them.
+
+The index is cached in ``<file>.index.json`` and stays valid while the
+file's size and modification time don't change. It records the rewritten
+file's checksum (``digest``), which ``chunkstore.verify_stream`` checks the
+file against once the checksum of the uploaded bytes no longer applies. ``seek`` maps a timestamp
+to the byte ranges a player needs: the init range (everything before the
+first cluster) and the cluster holding the last keyframe at or before it.
+
+The rewrite swaps the file under anything reading it, so every job on a
+recording takes ``recording_lock``: exclusive while rewriting, shared while
+reading (verification, alignment). It is an advisory ``flock`` on
+``<file>.lock``, so it holds across worker processes; platforms without
+``fcntl`` go unlocked.
+
+Files that aren't WebM (such as MP4 from Safari) raise ``WebMError``.
+
+Run standalone with ``python -m anam_xri.webm_index <file.webm> [--seek SECONDS]``.
+"""
+import argparse
+import bisect
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+INDEX_SUFFIX = '.index.json'
+INDEX_VERSION = 2
+LOCK_SUFFIX = '.lock'
+# BLAKE2b digest size of the checksum, as in chunkstore
+DIGEST_SIZE = 16
+# Block size used when copying clusters into the rewritten file
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# Element IDs, including their length marker bits
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+CLUSTER = 0x1F43B675
+TIMECODE = 0xE7
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+REFERENCE_BLOCK = 0xFB
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TIME = 0xB3
+CUE_TRACK_POSITIONS = 0xB7
+CUE_TRACK = 0xF7
+CUE_CLUSTER_POSITION = 0xF1
+CUE_RELATIVE_POSITION = 0xF0
+VOID = 0xEC
+CRC32 = 0xBF
+
+TRACK_VIDEO = 1
+# Nanoseconds per timestamp tick when Info doesn't say
+DEFAULT_TIMECODE_SCALE = 1000000
+
+# Elements that may appear in a Cluster; any other ends an unknown-size one
+CLUSTER_CHILDREN = {TIMECODE, SIMPLE_BLOCK, BLOCK_GROUP, VOID, CRC32,
+                    0xA7, 0xAB, 0xAF, 0x5854}  # Position, PrevSize, EncryptedBlock, SilentTracks
+# Top-level elements the rewrite rebuilds or drops; the rest are copied
+REBUILT = {SEEK_HEAD, INFO, CUES, CLUSTER, VOID, CRC32}
+
+
+class WebMError(ValueError):
+    """Raised for files that aren't WebM or are too damaged to index"""
+
+
+def _element_id(buf, pos, end):
+    if pos >= end:
+        raise WebMError('truncated element header')
+    length = 9 - buf[pos].bit_length()
+    if length > 4 or pos + length > end:
+        raise WebMError(f'invalid element id at byte {pos}')
+    return int.from_bytes(buf[pos:pos + length], 'big'), length
+
+
+def _vint(buf, pos, end):
+    """(value, length) of the size field at ``pos``; value is None if unknown"""
+    if pos >= end:
+        raise WebMError('truncated element header')
+    length = 9 - buf[pos].bit_length()
+    if length > 8 or pos + length > end:
+        raise WebMError(f'invalid element size at byte {pos}')
+    value = int.from_bytes(buf[pos:pos + length], 'big') & ((1 << (7 * length)) - 1)
+    return (None if value == (1 << (7 * length)) - 1 else value), length
+
+
+def _header(buf, pos, end):
+    """(id, data start, data end) of the element at ``pos``; data end is None if unknown"""
+    element_id, id_length = _element_id(buf, pos, end)
+    size, size_length = _vint(buf, pos + id_length, end)
+    start = pos + id_length + size_length
+    return element_id, start, None if size is None else start + size
+
+
+def _children(buf, start, end):
+    """(id, element start, data start, data end) of each child in ``[start, end)``"""
+    pos = start
+    while pos < end:
+        element_id, data_start, data_end = _header(buf, pos, end)
+        if data_end is None or data_end > end:
+            raise WebMError(f'element at byte {pos} overruns its parent')
+        yield element_id, pos, data_start, data_end
+        pos = data_end
+
+
+def _uint(buf, start, end):
+    return int.from_bytes(buf[start:end], 'big')
+
+
+def _parse_tracks(buf, start, end):
+    tracks = []
+    for element_id, _, data_start, data_end in _children(buf, start, end):
+        if element_id != TRACK_ENTRY:
+            continue
+        track = {'number': None, 'type': None, 'codec': None}
+        for child_id, _, child_start, child_end in _children(buf, data_start, data_end):
+            if child_id == TRACK_NUMBER:
+                track['number'] = _uint(buf, child_start, child_end)
+            elif child_id == TRACK_TYPE:
+                track['type'] = _uint(buf, child_start, child_end)
+            elif child_id == CODEC_ID:
+                track['codec'] = bytes(buf[child_start:child_end]).decode('ascii', 'replace')
+        if track['number'] is not None:
+            tracks.append(track)
+    return tracks
+
+
+def _block(buf, start, end):
+    """(track, relative timestamp, keyframe flag) from a SimpleBlock/Block header"""
+    track, length = _vint(buf, start, end)
+    if track is None or start + length + 3 > end:
+        raise WebMError(f'invalid block at byte {start}')
+    relative, flags = struct.unpack_from('>hB', buf, start + length)
+    return track, relative, bool(flags & 0x80)
+
+
+def _parse_cluster(buf, pos, data_start, data_end, limit, last_blocks):
+    """A cluster's timestamp, end and keyframes; updates ``last_blocks`` per track"""
+    end = limit if data_end is None else min(data_end, limit)
+    cluster = {'offset': pos, 'data_start': data_start, 'end': data_start, 'timecode': None,
+               'keyframes': []}
+    child = data_start
+    while child < end:
+        try:
+            element_id, start, stop = _header(buf, child, end)
+        except WebMError:
+            break
+        if data_end is None and element_id not in CLUSTER_CHILDREN:
+            # The next top-level element: the end of an unknown-size cluster
+            break
+        if stop is None or stop > end:
+            # Cut off mid-block
+            break
+        if element_id == TIMECODE:
+            cluster['timecode'] = _uint(buf, start, stop)
+        elif element_id in (SIMPLE_BLOCK, BLOCK_GROUP) and cluster['timecode'] is not None:
+            if element_id == SIMPLE_BLOCK:
+                track, relative, key = _block(buf, start, stop)
+            else:
+                track = None
+                key = True
+                for group_id, _, group_start, group_end in _children(buf, start, stop):
+                    if group_id == BLOCK:
+                        track, relative, _ = _block(buf, group_start, group_end)
+                    elif group_id == REFERENCE_BLOCK:
+                        key = False
+            if track is not None:
+                ticks = max(0, cluster['timecode'] + relative)
+                if key:
+                    cluster['keyframes'].append((ticks, track, child - data_start))
+                previous = last_blocks.get(track)
+                last_blocks[track] = (previous[1] if previous else None, ticks)
+        child = stop
+    cluster['end'] = child
+    return cluster
+
+
+def parse(buf):
+    """Layout of a WebM file: header ranges, tracks, clusters and their keyframes"""
+    size = len(buf)
+    element_id, _, ebml_end = _header(buf, 0, size)
+    if element_id != EBML or ebml_end is None or ebml_end > size:
+        raise WebMError('not an EBML file')
+    element_id, segment_start, segment_end = _header(buf, ebml_end, size)
+    if element_id != SEGMENT:
+        raise WebMError('no Segment after the EBML header')
+    segment_end = size if segment_end is None else min(segment_end, size)
+
+    layout = {'ebml_end': ebml_end, 'info': None, 'timecode_scale': DEFAULT_TIMECODE_SCALE,
+              'tracks': [], 'kept': [], 'clusters': []}
+    # track -> (previous block ticks, last block ticks), for the duration
+    last_blocks = {}
+    pos = segment_start
+    while pos < segment_end:
+        try:
+            element_id, data_start, data_end = _header(buf, pos, segment_end)
+        except WebMError:
+            break
+        if element_id == CLUSTER:
+            cluster = _parse_cluster(buf, pos, data_start, data_end, segment_end, last_blocks)
+            if cluster['end'] == data_start:
+                break
+            if cluster['timecode'] is not None:
+                layout['clusters'].append(cluster)
+            pos = cluster['end']
+            continue
+        if data_end is None or data_end > segment_end:
+            # Only clusters are streamed with unknown sizes; anything else is damage
+            break
+        if element_id == INFO:
+            layout['info'] = (data_start, data_end)
+            for child_id, _, child_start, child_end in _children(buf, data_start, data_end):
+                if child_id == TIMECODE_SCALE:
+                    layout['timecode_scale'] = _uint(buf, child_start, child_end)
+        elif element_id not in REBUILT:
+            if element_id == TRACKS:
+                layout['tracks'] = _parse_tracks(buf, data_start, data_end)
+            layout['kept'].append((element_id, pos, data_end))
+        pos = data_end
+
+    if layout['info'] is None or not layout['tracks']:
+        raise WebMError('no Info or Tracks element')
+    if not layout['clusters']:
+        raise WebMError('no complete clusters')
+    # Past the last block by one frame interval of its track
+    layout['duration_ticks'] = max(
+        (last + (last - previous if previous is not None else 0)
+         for previous, last in last_blocks.values()), default=0)
+    return layout
+
+
+def _id_bytes(element_id):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+
+
+def _size(size):
+    # Always an 8-byte vint, so element lengths don't depend on their values
+    return ((1 << 56) | size).to_bytes(8, 'big')
+
+
+def _element(element_id, payload):
+    return _id_bytes(element_id) + _size(len(payload)) + payload
+
+
+def _uint_element(element_id, value):
+    return _element(element_id, value.to_bytes(8, 'big'))
+
+
+def _seek_head(positions):
+    return _element(SEEK_HEAD, b''.join(
+        _element(SEEK, _element(SEEK_ID, _id_bytes(element_id)) +
+                 _uint_element(SEEK_POSITION, position))
+        for element_id, position in positions))
+
+
+def _cue_point(ticks, track, cluster_position, relative_position):
+    return _element(CUE_POINT, _uint_element(CUE_TIME, ticks) + _element(
+        CUE_TRACK_POSITIONS,
+        _uint_element(CUE_TRACK, track) +
+        _uint_element(CUE_CLUSTER_POSITION, cluster_position) +
+        _uint_element(CUE_RELATIVE_POSITION, relative_position)))
+
+
+def _cue_track(tracks):
+    video = [t['number'] for t in tracks if t['type'] == TRACK_VIDEO]
+    return video[0] if video else tracks[0]['number']
+
+
+def _rewrite(buf, layout, output):
+    """Write the seekable file to ``output``; returns its index"""
+    scale = layout['timecode_scale']
+    info = _element(INFO, b''.join(
+        bytes(buf[start:end]) for element_id, start, _, end in _children(buf, *layout['info'])
+        if element_id not in (DURATION, VOID, CRC32)
+    ) + _element(DURATION, struct.pack('>d', float(layout['duration_ticks']))))
+    kept = [bytes(buf[start:end]) for _, start, end in layout['kept']]
+
+    cue_track = _cue_track(layout['tracks'])
+    video = any(t['number'] == cue_track and t['type'] == TRACK_VIDEO for t in layout['tracks'])
+    cue_points = []
+    for number, cluster in enumerate(layout['clusters']):
+        keyframes = [k for k in cluster['keyframes'] if k[1] == cue_track]
+        # Every audio block is a keyframe: one cue per cluster is plenty
+        for ticks, track, relative in (keyframes if video else keyframes[:1]):
+            cue_points.append((ticks, track, number, relative))
+
+    # Element positions are relative to the start of the Segment's data
+    seek_head_size = len(_seek_head([(INFO, 0), (TRACKS, 0), (CUES, 0)]))
+    kept_start = seek_head_size + len(info)
+    tracks_position = kept_start
+    for (element_id, _, _), data in zip(layout['kept'], kept):
+        if element_id == TRACKS:
+            break
+        tracks_position += len(data)
+    cues_position = kept_start + sum(len(data) for data in kept)
+    cues_size = len(_element(CUES, len(cue_points) * _cue_point(0, 0, 0, 0)))
+    cluster_header_size = len(_id_bytes(CLUSTER)) + 8
+    cluster_positions = []
+    position = cues_position + cues_size
+    for cluster in layout['clusters']:
+        cluster_positions.append(position)
+        position += cluster_header_size + cluster['end'] - cluster['data_start']
+    segment_size = position
+
+    cues = _element(CUES, b''.join(
+        _cue_point(ticks, track, cluster_positions[number], relative)
+        for ticks, track, number, relative in cue_points))
+    segment_data_start = layout['ebml_end'] + len(_id_bytes(SEGMENT)) + 8
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(output, 'wb') as out:
+        def write(data):
+            digest.update(data)
+            out.write(data)
+
+        write(buf[:layout['ebml_end']])
+        write(_id_bytes(SEGMENT) + _size(segment_size))
+        write(_seek_head([(INFO, seek_head_size), (TRACKS, tracks_position),
+                          (CUES, cues_position)]))
+        write(info)
+        for data in kept:
+            write(data)
+        write(cues)
+        view = memoryview(buf)
+        try:
+            for cluster in layout['clusters']:
+                write(_id_bytes(CLUSTER) + _size(cluster['end'] - cluster['data_start']))
+                for start in range(cluster['data_start'], cluster['end'], COPY_BLOCK_SIZE):
+                    write(view[start:min(start + COPY_BLOCK_SIZE, cluster['end'])])
+        finally:
+            view.release()
+
+    seconds = scale / 1e9
+    clusters = [[cluster['timecode'] * seconds, segment_data_start + position,
+                 cluster_header_size + cluster['end'] - cluster['data_start']]
+                for cluster, position in zip(layout['clusters'], cluster_positions)]
+    return {
+        'version': INDEX_VERSION,
+        'duration': layout['duration_ticks'] * seconds,
+        'timecode_scale': scale,
+        'tracks': layout['tracks'],
+        'cue_track': cue_track,
+        'init_end': clusters[0][1],
+        # [seconds, byte offset, byte length]
+        'clusters': clusters,
+        # [seconds, cluster number]
+        'keyframes': [[ticks * seconds, number] for ticks, _, number, _ in cue_points],
+        'digest': digest.hexdigest()
+    }
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def load_index(path):
+    """Cached index of ``path``, or None if missing or the file has changed since"""
+    try:
+        with open(index_path(path)) as f:
+            index = json.load(f)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if (index.get('version') != INDEX_VERSION or index.get('size') != stat.st_size or
+            index.get('mtime_ns') != stat.st_mtime_ns):
+        return None
+    return index
+
+
+@contextlib.contextmanager
+def recording_lock(path, shared=False):
+    """Hold the advisory lock of ``path``, shared or exclusive, across processes"""
+    if fcntl is None:
+        yield
+        return
+    with open(path + LOCK_SUFFIX, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def make_seekable(path, force=False):
+    """Rewrite ``path`` with Duration and Cues and cache its index; returns the index.
+
+    A file whose cached index is still valid is left alone unless ``force``.
+    Don't call it while holding the file's ``recording_lock``.
+    """
+    if not force:
+        index = load_index(path)
+        if index is not None:
+            return index
+    with recording_lock(path):
+        # Another job may have rewritten it while this one waited
+        index = None if force else load_index(path)
+        return index if index is not None else _make_seekable(path)
+
+
+def _make_seekable(path):
+    started = time.time()
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(path, 'rb') as f:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise WebMError('empty file')
+            with buf:
+                index = _rewrite(buf, parse(buf), tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    stat = os.stat(path)
+    index.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, elapsed=time.time() - started)
+    tmp_path = index_path(path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path(path))
+    return index
+
+
+def seek(index, seconds):
+    """Byte ranges to play from ``seconds``: the init range and the keyframe's cluster"""
+    keyframes = index['keyframes'] or [[cluster[0], number]
+                                       for number, cluster in enumerate(index['clusters'])]
+    found = max(0, bisect.bisect_right([k[0] for k in keyframes], seconds) - 1)
+    time_, number = keyframes[found]
+    _, offset, length = index['clusters'][number]
+    return {
+        'time': time_,
+        'requested': seconds,
+        'duration': index['duration'],
+        'init_range': [0, index['init_end'] - 1],
+        'cluster_range': [offset, offset + length - 1],
+        'offset': offset,
+        'size': index['size']
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index WebM files and make them seekable')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--seek', type=float, help='print the byte ranges for this timestamp')
+    parser.add_argument('--force', action='store_true', help='rewrite even if already indexed')
+    args = parser.parse_args(argv)
+
+    for path in args.files:
+        try:
+            index = make_seekable(path, force=args.force)
+        except (OSError, WebMError) as e:
+            print(f'{path}: failed: {e}')
+            continue
+        if args.seek is not None:
+            print(json.dumps(seek(index, args.seek), indent=2))
+        else:
+            print(json.dumps({key: index[key] for key in
+                              ('duration', 'size', 'tracks', 'init_end', 'elapsed')}, indent=2))
+            print(f'{len(index["clusters"])} clusters, {len(index["keyframes"])} cue points')
+
+
+if __name__ == '__main__':
+    main()
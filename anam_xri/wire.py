@@ -0,0 +1,237 @@
+"""Compact binary frames for the high-frequency Socket.IO events.
+
+Heartbeats, clock-sync pings and pongs, start/control commands and their
+acks, chunk acks, upload backlog reports and recording telemetry are the
+messages every phone exchanges several times a second. As JSON each one
+repeats its long key names and prints every timestamp in decimal. A connection can instead use
+fixed-layout frames: a one-byte frame type followed by little-endian
+``struct`` fields, then length-prefixed UTF-8 strings.
+
+The format is negotiated per connection. The client lists the formats it
+understands in ``register_device`` (``wire_formats``), and the server picks
+one with ``negotiate`` and returns it as ``wire`` in
+``registration_confirmed``. A client that sends nothing gets JSON.
+
+Frames travel base64-encoded as the only argument of the ``w`` event. A
+Socket.IO binary attachment would cost a second WebSocket message per
+event, more than the few bytes base64 adds to a 20-50 byte frame.
+
+Anything a frame can't carry falls back to the JSON event of the same
+name. That covers events without a frame type, error acks, extra keys and
+out-of-range values, so both sides always keep their JSON handlers.
+
+The frame table is also sent to the browser (``describe``), so the
+JavaScript codec can't drift from this one.
+"""
+import binascii
+import math
+import struct
+
+# Socket.IO event carrying binary frames
+EVENT = 'w'
+
+FORMAT_BINARY = 'binary'
+FORMAT_JSON = 'json'
+# In order of preference
+FORMATS = (FORMAT_BINARY, FORMAT_JSON)
+
+MAX_STRING_BYTES = 255
+
+
+class WireError(ValueError):
+    """Raised for frames that can't be decoded"""
+
+
+def negotiate(offered):
+    """The preferred format the client also understands"""
+    if isinstance(offered, (list, tuple)):
+        for name in FORMATS:
+            if name in offered:
+                return name
+    return FORMAT_JSON
+
+
+class Frame:
+    """Layout of one event.
+
+    ``fields`` are ``(name, struct code)`` pairs. Names in ``optional`` may
+    be None, which is sent as NaN for floats, -1 for signed integers and an
+    empty string for strings. ``enums`` map a field's strings to small
+    integers. ``constants`` are keys that always have the same value and
+    aren't sent. ``tail`` is an optional nested frame (a present/absent
+    byte, then its fields).
+    """
+
+    def __init__(self, code, event, fields=(), strings=(), optional=(), enums=None,
+                 constants=None, tail=None):
+        self.code = code
+        self.event = event
+        self.fields = tuple(fields)
+        self.strings = tuple(strings)
+        self.optional = frozenset(optional)
+        self.enums = enums or {}
+        self.constants = constants or {}
+        self.tail = tail
+        self.struct = struct.Struct('<' + ''.join(kind for _, kind in self.fields))
+        self.keys = ({name for name, _ in self.fields} | set(self.strings) |
+                     set(self.constants) | ({tail[0]} if tail else set()))
+        self.names = tuple(name for name, _ in self.fields)
+        # Fields whose unpacked value needs converting (enums, None, bools)
+        self.converted = tuple(
+            (i, name, kind) for i, (name, kind) in enumerate(self.fields)
+            if name in self.enums or name in self.optional or kind == '?')
+
+    def pack(self, payload):
+        values = []
+        for name, kind in self.fields:
+            value = payload.get(name)
+            if name in self.enums:
+                value = self.enums[name].index(value)
+            elif value is None:
+                if name not in self.optional:
+                    raise ValueError(f'{name} is required')
+                value = math.nan if kind == 'd' else -1
+            values.append(value)
+        parts = [self.struct.pack(*values)]
+        for name in self.strings:
+            value = payload.get(name)
+            if value is None and name not in self.optional:
+                raise ValueError(f'{name} is required')
+            if not isinstance(value, (str, type(None))):
+                raise ValueError(f'{name} must be a string')
+            encoded = (value or '').encode('utf-8')
+            if len(encoded) > MAX_STRING_BYTES:
+                raise ValueError(f'{name} too long')
+            parts.append(bytes((len(encoded),)) + encoded)
+        if self.tail:
+            name, frame = self.tail
+            nested = payload.get(name)
+            if nested is None:
+                parts.append(b'\x00')
+            else:
+                if set(nested) - frame.keys:
+                    raise ValueError(f'{name} has keys the frame cannot carry')
+                parts.append(b'\x01' + frame.pack(nested))
+        return b''.join(parts)
+
+    def unpack(self, data, offset=0):
+        try:
+            values = self.struct.unpack_from(data, offset)
+        except struct.error as e:
+            raise WireError(f'truncated {self.event} frame') from e
+        offset += self.struct.size
+        payload = dict(self.constants)
+        payload.update(zip(self.names, values))
+        for i, name, kind in self.converted:
+            value = values[i]
+            if name in self.enums:
+                choices = self.enums[name]
+                if value >= len(choices):
+                    raise WireError(f'bad {name} in {self.event} frame')
+                value = choices[value]
+            elif name in self.optional and (math.isnan(value) if kind == 'd' else value == -1):
+                value = None
+            elif kind == '?':
+                value = bool(value)
+            payload[name] = value
+        for name in self.strings:
+            if offset >= len(data) or offset + 1 + data[offset] > len(data):
+                raise WireError(f'truncated {self.event} frame')
+            length = data[offset]
+            value = bytes(data[offset + 1:offset + 1 + length]).decode('utf-8', 'replace')
+            payload[name] = None if not value and name in self.optional else value
+            offset += 1 + length
+        if self.tail:
+            name, frame = self.tail
+            if offset >= len(data):
+                raise WireError(f'truncated {self.event} frame')
+            present, offset = data[offset], offset + 1
+            payload[name] = None
+            if present:
+                payload[name], offset = frame.unpack(data, offset)
+        return payload, offset
+
+    def describe(self):
+        return {
+            'code': self.code,
+            'event': self.event,
+            'fields': [list(field) for field in self.fields],
+            'strings': list(self.strings),
+            'optional': sorted(self.optional),
+            'enums': {name: list(choices) for name, choices in self.enums.items()},
+            'constants': self.constants,
+            'tail': [self.tail[0], self.tail[1].describe()] if self.tail else None
+        }
+
+
+PROFILE = Frame(0, 'profile', [('rung', 'B'), ('width', 'H'), ('height', 'H'),
+                               ('frame_rate', 'B'), ('video_bitrate', 'I'),
+                               ('audio_bitrate', 'I')],
+                strings=('name', 'mime_type'), optional=('mime_type',))
+
+FRAMES = (
+    # Client to server
+    Frame(0x01, 'heartbeat'),
+    Frame(0x02, 'clock_sync_ping', [('t0', 'd')]),
+    Frame(0x03, 'sync_command_ack', [('take', 'H'), ('received_at', 'd')],
+          strings=('session_id', 'device_id')),
+    Frame(0x04, 'upload_backlog', [('queued_chunks', 'I'), ('uploads', 'H')]),
+    Frame(0x05, 'recording_telemetry',
+          [('take', 'H'), ('interval', 'd'), ('bytes', 'I'), ('chunks', 'H'), ('frames', 'i'),
+           ('dropped', 'i'), ('clock_drift', 'd'), ('battery', 'd'), ('charging', '?')],
+          strings=('session_id',), optional=('frames', 'dropped', 'battery')),
+    # Server to client
+    Frame(0x41, 'clock_sync_pong', [('t0', 'd'), ('t1', 'd'), ('t2', 'd')]),
+    Frame(0x42, 'chunk_ack', [('take', 'H'), ('seq', 'i'), ('next_seq', 'I'), ('status', 'B')],
+          strings=('session_id',), optional=('seq',),
+          enums={'status': ('ok', 'duplicate', 'out_of_order', 'resume')}),
+    Frame(0x43, 'sync_recording_command',
+          [('take', 'H'), ('start_timestamp', 'd'), ('stop_timestamp', 'd'), ('server_time', 'd'),
+           ('local_start_timestamp', 'd'), ('local_stop_timestamp', 'd'),
+           ('ack_requested', '?')],
+          strings=('session_id',),
+          optional=('stop_timestamp', 'local_start_timestamp', 'local_stop_timestamp'),
+          constants={'command': 'start_recording'}, tail=('profile', PROFILE)),
+    Frame(0x44, 'sync_control',
+          [('action', 'B'), ('take', 'H'), ('timestamp', 'd'), ('server_time', 'd'),
+           ('local_timestamp', 'd')],
+          strings=('session_id',), optional=('local_timestamp',),
+          enums={'action': ('stop', 'pause', 'resume')}),
+)
+_BY_CODE = {frame.code: frame for frame in FRAMES}
+_BY_EVENT = {frame.event: frame for frame in FRAMES}
+
+
+def encode(event, payload=None):
+    """Base64 frame for ``event``, or None if it has to go as JSON"""
+    frame = _BY_EVENT.get(event)
+    payload = payload or {}
+    if frame is None or not isinstance(payload, dict) or set(payload) - frame.keys:
+        return None
+    if any(payload.get(name, value) != value for name, value in frame.constants.items()):
+        return None
+    try:
+        data = bytes((frame.code,)) + frame.pack(payload)
+    except (struct.error, ValueError, TypeError):
+        return None
+    return binascii.b2a_base64(data, newline=False).decode('ascii')
+
+
+def decode(text):
+    """(event, payload) from a base64 frame"""
+    try:
+        data = binascii.a2b_base64(text)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise WireError('frame is not base64') from e
+    if not data:
+        raise WireError('empty frame')
+    frame = _BY_CODE.get(data[0])
+    if frame is None:
+        raise WireError(f'unknown frame type {data[0]}')
+    payload, _ = frame.unpack(data, 1)
+    return frame.event, payload
+
+
+def describe():
+    """Frame table for the JavaScript codec"""
+    return [frame.describe() for frame in FRAMES]
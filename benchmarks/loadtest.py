@@ -0,0 +1,415 @@
+"""Load test: simulate many recording phones against one server.
+
+Each simulated phone connects over Socket.IO, registers, runs the clock-sync
+handshake with a synthetic clock offset, waits for the start command and can
+optionally upload synthetic WebM chunks. An extra admin client triggers the
+start. Results are printed (or written) as JSON so runs can be compared
+between releases.
+
+Usage:
+
+    python benchmarks/loadtest.py --clients 200 --url http://localhost:5000
+    python benchmarks/loadtest.py --clients 100 --spawn --upload-chunks 5 -o run.json
+
+``--spawn`` starts the web server (``python -m anam_xri web``) in a
+subprocess on a free port and samples its CPU and memory while the test
+runs. Requires the Socket.IO client extras:
+``pip install "python-socketio[client]"``.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import socketio
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# EBML magic followed by padding; the server does not parse chunk contents
+SYNTHETIC_WEBM_HEADER = b'\x1a\x45\xdf\xa3'
+
+
+def percentiles(values, points=(50, 90, 95, 99)):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {}
+    for p in points:
+        index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        result[f'p{p}'] = ordered[index]
+    result['max'] = ordered[-1]
+    result['mean'] = sum(ordered) / len(ordered)
+    return result
+
+
+class ProcessSampler:
+    """Samples CPU time and RSS of a process from /proc (Linux) or psutil"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        try:
+            import psutil
+            self._process = psutil.Process(pid)
+        except ImportError:
+            self._process = None
+
+    def _read(self):
+        if self._process is not None:
+            cpu = self._process.cpu_times()
+            return cpu.user + cpu.system, self._process.memory_info().rss
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+        rss = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+        return cpu_seconds, rss
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                cpu, rss = self._read()
+            except (OSError, IndexError, ValueError):
+                break
+            self.samples.append((time.time(), cpu, rss))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        if len(self.samples) < 2:
+            return {}
+        (t0, cpu0, _), (t1, cpu1, _) = self.samples[0], self.samples[-1]
+        cpu_percent = []
+        for (ta, ca, _), (tb, cb, _) in zip(self.samples, self.samples[1:]):
+            if tb > ta:
+                cpu_percent.append(100.0 * (cb - ca) / (tb - ta))
+        rss = [s[2] for s in self.samples]
+        return {
+            'cpu_seconds': cpu1 - cpu0,
+            'cpu_percent_mean': 100.0 * (cpu1 - cpu0) / (t1 - t0),
+            'cpu_percent_max': max(cpu_percent) if cpu_percent else None,
+            'rss_bytes_start': rss[0],
+            'rss_bytes_max': max(rss),
+            'rss_bytes_end': rss[-1],
+        }
+
+
+class SimulatedPhone:
+    def __init__(self, index, url, args):
+        self.device_id = f'load_{index:05d}'
+        self.url = url
+        self.args = args
+        # Synthetic skew between this phone's clock and the server's
+        self.clock_skew = random.uniform(-args.max_clock_skew, args.max_clock_skew)
+        self.sio = socketio.Client(reconnection=False)
+        self.registered = threading.Event()
+        self.clock_synced = threading.Event()
+        self.command_received = threading.Event()
+        self.uploaded = threading.Event()
+        self.register_latency = None
+        self.clock = None
+        self.command = None
+        self.command_received_at = None
+        self.chunk_latencies = []
+        self.error = None
+        self._samples = []
+        self._chunk_sent_at = None
+        self._next_chunk = 0
+        self._setup()
+
+    def local_time(self):
+        return time.time() - self.clock_skew
+
+    def _setup(self):
+        sio = self.sio
+
+        @sio.on('registration_confirmed')
+        def on_registered(data):
+            self.register_latency = time.time() - self._register_sent_at
+            self.registered.set()
+            self._ping()
+
+        @sio.on('clock_sync_pong')
+        def on_pong(data):
+            self._samples.append([data['t0'], data['t1'], data['t2'], self.local_time()])
+            if len(self._samples) < self.args.clock_samples:
+                self._ping()
+                return
+            sio.emit('clock_sync_report', {'samples': self._samples})
+
+        @sio.on('clock_sync_result')
+        def on_clock(data):
+            self.clock = data
+            self.clock_synced.set()
+
+        @sio.on('sync_recording_command')
+        def on_command(data):
+            self.command_received_at = time.time()
+            self.command = data
+            if data.get('ack_requested'):
+                sio.emit('sync_command_ack', {
+                    'session_id': data['session_id'],
+                    'device_id': self.device_id,
+                    'received_at': self.local_time()
+                })
+            self.command_received.set()
+            if self.args.upload_chunks:
+                self._send_chunk()
+
+        @sio.on('chunk_ack')
+        def on_chunk_ack(data):
+            self.chunk_latencies.append(time.time() - self._chunk_sent_at)
+            if data.get('next_seq', 0) >= self.args.upload_chunks:
+                sio.emit('upload_complete', {
+                    'session_id': self.command['session_id'],
+                    'device_id': self.device_id,
+                    'total_chunks': self.args.upload_chunks
+                })
+                self.uploaded.set()
+                return
+            self._next_chunk = data.get('next_seq', self._next_chunk + 1)
+            self._send_chunk()
+
+    def _ping(self):
+        self.sio.emit('clock_sync_ping', {'t0': self.local_time()})
+
+    def _send_chunk(self):
+        seq = self._next_chunk
+        payload = os.urandom(self.args.chunk_bytes)
+        if seq == 0:
+            payload = SYNTHETIC_WEBM_HEADER + payload[len(SYNTHETIC_WEBM_HEADER):]
+        self._chunk_sent_at = time.time()
+        self.sio.emit('upload_chunk', {
+            'session_id': self.command['session_id'],
+            'device_id': self.device_id,
+            'seq': seq,
+            'data': payload
+        })
+
+    def run(self):
+        try:
+            self.sio.connect(self.url, transports=['websocket'])
+            self._register_sent_at = time.time()
+            self.sio.emit('register_device', {
+                'device_id': self.device_id,
+                'user_agent': 'loadtest',
+                'timestamp': int(self.local_time() * 1000)
+            })
+        except Exception as e:
+            self.error = str(e)
+
+    def true_start_time(self):
+        """When this phone would actually start, on the server's clock"""
+        if self.command is None:
+            return None
+        start = self.command['start_timestamp']
+        if self.command.get('local_start_timestamp') is not None:
+            local_start = self.command['local_start_timestamp']
+        elif self.clock and self.clock.get('offset') is not None:
+            offset = self.clock['offset'] + self.clock.get('drift', 0.0) * (
+                start - self.clock['reference_time'])
+            local_start = start - offset
+        else:
+            local_start = start - (self.command['server_time'] - self.command_received_at)
+        return local_start + self.clock_skew
+
+    def close(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(port, recordings_dir):
+    env = dict(os.environ, PORT=str(port), RECORDINGS_DIR=recordings_dir)
+    command = [sys.executable, '-m', 'anam_xri', 'web', '--host', '127.0.0.1',
+               '--port', str(port)]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('server did not start')
+
+
+def wait_all(events, timeout):
+    deadline = time.time() + timeout
+    done = 0
+    for event in events:
+        if event.wait(max(0.0, deadline - time.time())):
+            done += 1
+    return done
+
+
+def run(args):
+    server = None
+    sampler = None
+    url = args.url
+    if args.spawn:
+        import tempfile
+        port = free_port()
+        recordings_dir = tempfile.mkdtemp(prefix='loadtest_recordings_')
+        server = spawn_server(port, recordings_dir)
+        url = f'http://127.0.0.1:{port}'
+        sampler = ProcessSampler(server.pid)
+    elif args.server_pid:
+        sampler = ProcessSampler(args.server_pid)
+    if sampler:
+        sampler.start()
+
+    phones = [SimulatedPhone(i, url, args) for i in range(args.clients)]
+    try:
+        # Registration: connect in waves so the client machine isn't the bottleneck
+        started = time.time()
+        for i in range(0, len(phones), args.connect_batch):
+            threads = [threading.Thread(target=p.run) for p in phones[i:i + args.connect_batch]]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        registered = wait_all([p.registered for p in phones], args.timeout)
+        registration_elapsed = time.time() - started
+        synced = wait_all([p.clock_synced for p in phones], args.timeout)
+
+        # Trigger the start from an admin client
+        admin = socketio.Client(reconnection=False)
+        readiness = {}
+        readiness_received = threading.Event()
+
+        @admin.on('sync_readiness')
+        def on_readiness(data):
+            readiness.update(data)
+            readiness_received.set()
+
+        admin.connect(url, transports=['websocket'])
+        admin.emit('join_admin')
+        trigger_at = time.time()
+        admin.emit('sync_record_command', {
+            'timestamp': int(trigger_at * 1000),
+            'mode': args.mode
+        })
+        received = wait_all([p.command_received for p in phones], args.timeout)
+        if args.mode != 'fixed':
+            readiness_received.wait(args.timeout)
+
+        uploaded = 0
+        upload_elapsed = None
+        if args.upload_chunks:
+            upload_started = time.time()
+            uploaded = wait_all([p.uploaded for p in phones], args.timeout)
+            upload_elapsed = time.time() - upload_started
+        admin.disconnect()
+    finally:
+        for phone in phones:
+            phone.close()
+        if sampler:
+            sampler.stop()
+        if server:
+            server.terminate()
+            server.wait()
+
+    fanout = [p.command_received_at - trigger_at for p in phones if p.command_received_at]
+    lead = [p.command['start_timestamp'] - p.command_received_at
+            for p in phones if p.command_received_at]
+    starts = [p.true_start_time() for p in phones if p.command is not None]
+    clock_errors = [p.clock['error_bound'] for p in phones
+                    if p.clock and p.clock.get('error_bound') is not None]
+    chunk_latencies = [lat for p in phones for lat in p.chunk_latencies]
+
+    return {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'config': {
+            'clients': args.clients,
+            'mode': args.mode,
+            'clock_samples': args.clock_samples,
+            'max_clock_skew': args.max_clock_skew,
+            'upload_chunks': args.upload_chunks,
+            'chunk_bytes': args.chunk_bytes,
+        },
+        'errors': [p.error for p in phones if p.error],
+        'registration': {
+            'registered': registered,
+            'elapsed_seconds': registration_elapsed,
+            'per_second': registered / registration_elapsed if registration_elapsed else None,
+            'latency_seconds': percentiles([p.register_latency for p in phones
+                                            if p.register_latency is not None]),
+        },
+        'clock_sync': {
+            'synced': synced,
+            'error_bound_seconds': percentiles(clock_errors),
+        },
+        'fanout': {
+            'received': received,
+            'latency_seconds': percentiles(fanout),
+            'remaining_lead_seconds': percentiles(lead),
+            'late_devices': sum(1 for value in lead if value < 0),
+            'readiness': {state: len(readiness.get(state, []))
+                          for state in ('ready', 'late', 'missing')} if readiness else None,
+        },
+        'start_skew_seconds': (max(starts) - min(starts)) if starts else None,
+        'upload': {
+            'completed': uploaded,
+            'elapsed_seconds': upload_elapsed,
+            'bytes': uploaded * args.upload_chunks * args.chunk_bytes,
+            'chunk_ack_latency_seconds': percentiles(chunk_latencies),
+        } if args.upload_chunks else None,
+        'server': sampler.summary() if sampler else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--spawn', action='store_true',
+                        help='start the web server on a free port and sample its CPU/memory')
+    parser.add_argument('--server-pid', type=int, help='sample CPU/memory of this process')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--mode', choices=('adaptive', 'fixed'), default='adaptive',
+                        help='start scheduling mode to request')
+    parser.add_argument('--connect-batch', type=int, default=25)
+    parser.add_argument('--clock-samples', type=int, default=8)
+    parser.add_argument('--max-clock-skew', type=float, default=2.0,
+                        help='synthetic client clock error in seconds (uniform +/-)')
+    parser.add_argument('--upload-chunks', type=int, default=0)
+    parser.add_argument('--chunk-bytes', type=int, default=64 * 1024)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('-o', '--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
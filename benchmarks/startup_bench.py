@@ -0,0 +1,141 @@
+"""Cold-start benchmark: time from launching the server to its first accepted connection.
+
+Each run starts ``python -m anam_xri web`` on a free port in a fresh
+process and records, from the moment the process is spawned:
+
+* ``listening``: the first successful TCP connect.
+* ``accepted``: the first Socket.IO connection the server accepts (an
+  Engine.IO polling handshake answered with a session id).
+
+It also times the import of the server module and ``create_app()``
+separately, in their own fresh processes and with the CLI's environment
+defaults, to show where the time goes.
+
+Results are printed (or written) as JSON:
+
+    python benchmarks/startup_bench.py
+    python benchmarks/startup_bench.py --runs 10 -o startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Between connection attempts (seconds)
+POLL_INTERVAL = 0.005
+START_TIMEOUT = 60.0
+
+PHASES_CODE = '''
+import json, os, sys, time
+from anam_xri.cli import prepare_environment
+prepare_environment()
+started = time.perf_counter()
+from anam_xri import server
+imported = time.perf_counter()
+server.create_app()
+created = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': created - imported}))
+sys.stdout.flush()
+os._exit(0)
+'''
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def summary(values):
+    return {'min': min(values), 'median': statistics.median(values), 'max': max(values)}
+
+
+def handshake(port):
+    """True once the server accepts an Engine.IO/Socket.IO connection"""
+    url = f'http://127.0.0.1:{port}/socket.io/?EIO=4&transport=polling'
+    try:
+        with urllib.request.urlopen(url, timeout=1.0) as response:
+            return response.status == 200 and b'"sid"' in response.read()
+    except (OSError, urllib.error.URLError):
+        return False
+
+
+def time_startup(recordings_dir):
+    port = free_port()
+    env = dict(os.environ, RECORDINGS_DIR=recordings_dir)
+    command = [sys.executable, '-m', 'anam_xri', 'web', '--host', '127.0.0.1', '--port', str(port)]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {}
+    try:
+        while 'listening' not in result:
+            if process.poll() is not None or time.perf_counter() - started > START_TIMEOUT:
+                raise RuntimeError('server did not start')
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                    result['listening'] = time.perf_counter() - started
+            except OSError:
+                time.sleep(POLL_INTERVAL)
+        while not handshake(port):
+            if time.perf_counter() - started > START_TIMEOUT:
+                raise RuntimeError('server never accepted a connection')
+            time.sleep(POLL_INTERVAL)
+        result['accepted'] = time.perf_counter() - started
+    finally:
+        process.kill()
+        process.wait()
+    return result
+
+
+def time_phases(recordings_dir):
+    env = dict(os.environ, RECORDINGS_DIR=recordings_dir)
+    output = subprocess.run([sys.executable, '-c', PHASES_CODE], cwd=REPO_ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(args):
+    runs = []
+    phases = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as recordings_dir:
+            runs.append(time_startup(recordings_dir))
+        with tempfile.TemporaryDirectory() as recordings_dir:
+            phases.append(time_phases(recordings_dir))
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': args.runs,
+        'listening_seconds': summary([r['listening'] for r in runs]),
+        'accepted_seconds': summary([r['accepted'] for r in runs]),
+        'import_seconds': summary([p['import'] for p in phases]),
+        'create_app_seconds': summary([p['create_app'] for p in phases]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('-o', '--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
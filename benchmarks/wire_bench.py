@@ -0,0 +1,145 @@
+"""Micro-benchmark: JSON vs binary wire frames for the hot Socket.IO events.
+
+For a representative payload of every event in ``wire.FRAMES`` this
+measures encode and decode time and the bytes sent per message, two ways:
+
+* ``payload``: just the event's data (``json.dumps``/``json.loads`` against
+  ``wire.encode``/``wire.decode``).
+* ``packet``: the full Socket.IO text packet the server writes, i.e. the
+  JSON event ``42["clock_sync_pong",{...}]`` against ``42["w","<frame>"]``,
+  including python-socketio's packet encoding and decoding.
+
+Results are printed (or written) as JSON so runs can be compared between
+releases:
+
+    python benchmarks/wire_bench.py
+    python benchmarks/wire_bench.py --iterations 200000 -o wire.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from anam_xri import wire  # noqa: E402
+from anam_xri.profiles import build_profile  # noqa: E402
+
+try:
+    from socketio import packet
+except ImportError:
+    packet = None
+
+NOW = 1760000000.123456
+
+
+def sample_payloads():
+    """One realistic payload per frame type"""
+    return {
+        'heartbeat': {},
+        'clock_sync_ping': {'t0': NOW},
+        'sync_command_ack': {'session_id': 'a1b2c3d4', 'take': 0, 'device_id': 'mobile_k3j9x2q7a',
+                             'received_at': NOW + 0.012},
+        'upload_backlog': {'queued_chunks': 12, 'uploads': 1},
+        'recording_telemetry': {'session_id': 'a1b2c3d4', 'take': 0, 'interval': 2.0013,
+                                'bytes': 1048211, 'chunks': 2, 'frames': 60, 'dropped': 0,
+                                'clock_drift': 0.0004, 'battery': 0.73, 'charging': False},
+        'clock_sync_pong': {'t0': NOW, 't1': NOW + 0.0213, 't2': NOW + 0.0214},
+        'chunk_ack': {'session_id': 'a1b2c3d4', 'take': 0, 'seq': 41, 'status': 'ok',
+                      'next_seq': 42},
+        'sync_recording_command': {
+            'session_id': 'a1b2c3d4', 'take': 0, 'start_timestamp': NOW + 1.2,
+            'stop_timestamp': None, 'server_time': NOW, 'command': 'start_recording',
+            'local_start_timestamp': NOW + 1.1873, 'local_stop_timestamp': None,
+            'profile': build_profile(1, {'mime_types': ['video/webm;codecs=vp9,opus']}),
+            'ack_requested': True
+        },
+        'sync_control': {'session_id': 'a1b2c3d4', 'take': 0, 'action': 'pause',
+                         'timestamp': NOW + 0.8, 'server_time': NOW,
+                         'local_timestamp': NOW + 0.7873},
+    }
+
+
+def per_call(fn, iterations):
+    """Mean seconds per call"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations
+
+
+def sio_encode(event, data):
+    return packet.Packet(packet.EVENT, data=[event, data], namespace='/').encode()
+
+
+def sio_decode(encoded):
+    return packet.Packet(encoded_packet=encoded).data
+
+
+def measure(event, payload, iterations):
+    frame = wire.encode(event, payload)
+    if frame is None:
+        raise RuntimeError(f'{event} sample does not fit its frame')
+    text = json.dumps(payload, separators=(',', ':'))
+    result = {
+        'payload': {
+            'json_bytes': len(text),
+            'binary_bytes': len(frame),
+            'json_encode_us': per_call(lambda: json.dumps(payload, separators=(',', ':')),
+                                       iterations) * 1e6,
+            'binary_encode_us': per_call(lambda: wire.encode(event, payload), iterations) * 1e6,
+            'json_decode_us': per_call(lambda: json.loads(text), iterations) * 1e6,
+            'binary_decode_us': per_call(lambda: wire.decode(frame), iterations) * 1e6,
+        }
+    }
+    if packet is not None:
+        json_packet = sio_encode(event, payload)
+        binary_packet = sio_encode(wire.EVENT, frame)
+        result['packet'] = {
+            'json_bytes': len(json_packet),
+            'binary_bytes': len(binary_packet),
+            'json_encode_us': per_call(lambda: sio_encode(event, payload), iterations) * 1e6,
+            'binary_encode_us': per_call(
+                lambda: sio_encode(wire.EVENT, wire.encode(event, payload)), iterations) * 1e6,
+            'json_decode_us': per_call(lambda: sio_decode(json_packet), iterations) * 1e6,
+            'binary_decode_us': per_call(
+                lambda: wire.decode(sio_decode(binary_packet)[1]), iterations) * 1e6,
+        }
+    return result
+
+
+def run(args):
+    payloads = sample_payloads()
+    events = args.events or list(payloads)
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'iterations': args.iterations,
+        'events': {event: measure(event, payloads[event], args.iterations) for event in events}
+    }
+    if packet is None:
+        results['note'] = 'python-socketio not installed; packet-level results skipped'
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=50000)
+    parser.add_argument('--events', nargs='*', choices=list(sample_payloads()),
+                        help='only these events (default: all)')
+    parser.add_argument('-o', '--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
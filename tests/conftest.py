@@ -0,0 +1,131 @@
+"""Shared fixtures: the package on sys.path, the app and a local RESP stand-in.
+
+``RespStandIn`` speaks enough of the Redis protocol (hashes, strings with
+``EX``, ``DEL``, ``SELECT``, ``PUBLISH``/``SUBSCRIBE``) for the shared
+backend to be tested without a Redis server.
+"""
+import os
+import socketserver
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RespHandler)
+        self.hashes = {}
+        # key -> (value, expires at or None)
+        self.values = {}
+        # key -> seconds from the last SET ... EX
+        self.ttls = {}
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'redis://127.0.0.1:%d/0' % self.server_address[1]
+
+    def subscriber_count(self, channel):
+        with self.lock:
+            return len(self.subscribers.get(channel, ()))
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    @staticmethod
+    def bulk(value):
+        return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def reply(self, data):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command, args = args[0].upper(), args[1:]
+            with server.lock:
+                if command == b'SELECT':
+                    reply = b'+OK\r\n'
+                elif command == b'HSET':
+                    server.hashes.setdefault(args[0], {})[args[1]] = args[2]
+                    reply = b':1\r\n'
+                elif command == b'HGET':
+                    reply = self.bulk(server.hashes.get(args[0], {}).get(args[1]))
+                elif command == b'HDEL':
+                    server.hashes.get(args[0], {}).pop(args[1], None)
+                    reply = b':1\r\n'
+                elif command == b'HGETALL':
+                    items = server.hashes.get(args[0], {}).items()
+                    reply = b'*%d\r\n' % (2 * len(items)) + b''.join(
+                        self.bulk(k) + self.bulk(v) for k, v in items)
+                elif command == b'SET':
+                    expires = None
+                    if len(args) == 4 and args[2].upper() == b'EX':
+                        server.ttls[args[0]] = int(args[3])
+                        expires = time.time() + int(args[3])
+                    server.values[args[0]] = (args[1], expires)
+                    reply = b'+OK\r\n'
+                elif command == b'GET':
+                    value, expires = server.values.get(args[0], (None, None))
+                    if expires is not None and expires < time.time():
+                        value = None
+                    reply = self.bulk(value)
+                elif command == b'DEL':
+                    server.values.pop(args[0], None)
+                    server.hashes.pop(args[0], None)
+                    reply = b':1\r\n'
+                elif command == b'PUBLISH':
+                    subscribers = server.subscribers.get(args[0], [])
+                    message = (b'*3\r\n' + self.bulk(b'message') + self.bulk(args[0]) +
+                               self.bulk(args[1]))
+                    for stream in subscribers:
+                        stream.write(message)
+                        stream.flush()
+                    reply = b':%d\r\n' % len(subscribers)
+                elif command == b'SUBSCRIBE':
+                    self.reply(b'*3\r\n' + self.bulk(b'subscribe') + self.bulk(args[0]) + b':1\r\n')
+                    server.subscribers.setdefault(args[0], []).append(self.wfile)
+                    continue
+                else:
+                    reply = b'-ERR unknown command\r\n'
+            self.reply(reply)
+
+
+@pytest.fixture
+def resp_server():
+    server = RespStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """The server module after ``create_app``, which runs once per process"""
+    from anam_xri import create_app, server
+    if server.app is None:
+        create_app({'RECORDINGS_DIR': str(tmp_path_factory.mktemp('recordings'))})
+    return server
@@ -0,0 +1,111 @@
+import pickle
+import threading
+import time
+
+from anam_xri.backends import (LocalStateBackend, RespPubSubManager, RespStateBackend,
+                               create_backends)
+from anam_xri.registry import SessionStore
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_resp_state_round_trip(resp_server):
+    backend = RespStateBackend(resp_server.url)
+    backend.hset('devices', 'p1', '{"a": 1}')
+    backend.hset('devices', 'p2', 'two')
+    assert backend.hget('devices', 'p1') == '{"a": 1}'
+    assert backend.hgetall('devices') == {'p1': '{"a": 1}', 'p2': 'two'}
+    backend.hdel('devices', 'p2')
+    assert backend.hgetall('devices') == {'p1': '{"a": 1}'}
+    backend.set('key', 'value', ttl=30)
+    assert backend.get('key') == 'value'
+    assert resp_server.ttls[b'sync:key'] == 30
+    backend.delete('key')
+    assert backend.get('key') is None
+    assert backend.hget('missing', 'p1') is None
+
+
+def test_create_backends_selects_by_url(resp_server):
+    state, manager = create_backends('memory://')
+    assert isinstance(state, LocalStateBackend) and manager is None
+    state, manager = create_backends(resp_server.url)
+    assert isinstance(state, RespStateBackend) and isinstance(manager, RespPubSubManager)
+
+
+def test_local_backend_ttl():
+    backend = LocalStateBackend()
+    backend.set('session:a', 'x', ttl=0.05)
+    assert backend.get('session:a') == 'x'
+    time.sleep(0.1)
+    assert backend.get('session:a') is None
+
+
+def test_pubsub_publish_reaches_listener(resp_server):
+    manager = RespPubSubManager(resp_server.url, channel='test')
+    received = []
+
+    def listen():
+        for message in manager._listen():
+            received.append(pickle.loads(message))
+            return
+
+    threading.Thread(target=listen, daemon=True).start()
+    wait_for(lambda: resp_server.subscriber_count(b'test') == 1)
+    manager._publish({'method': 'emit', 'event': 'hello'})
+    wait_for(lambda: received)
+    assert received == [{'method': 'emit', 'event': 'hello'}]
+
+
+def test_session_visible_and_writable_across_workers(resp_server):
+    worker_a = SessionStore(backend=RespStateBackend(resp_server.url))
+    worker_b = SessionStore(backend=RespStateBackend(resp_server.url))
+    worker_a.add('s1', {'status': 'scheduled', 'takes': [{'devices': {}}]})
+
+    # Worker B changes a session it only knows from the backend
+    session = worker_b.get('s1')
+    assert session['status'] == 'scheduled'
+    session['takes'][0]['devices']['p1'] = {'state': 'recording'}
+    session['status'] = 'recording'
+    worker_b.save('s1', session)
+    assert 's1' not in worker_b
+
+    # The creating worker sees the change instead of its own stale copy
+    session = worker_a.get('s1')
+    assert session['status'] == 'recording'
+    assert session['takes'][0]['devices'] == {'p1': {'state': 'recording'}}
+    session['status'] = 'stopped'
+    worker_a.save('s1', session)
+    assert worker_b.get('s1')['status'] == 'stopped'
+
+
+def test_session_ttl_counts_from_creation(resp_server):
+    store = SessionStore(ttl=100, backend=RespStateBackend(resp_server.url))
+    now = time.time()
+    store.add('s1', {'created_at': now - 40, 'takes': []}, now=now)
+    assert resp_server.ttls[b'sync:session:s1'] == 60
+    # A later save by any worker keeps the original expiry
+    store.save('s1', store.get('s1'), now=now + 30)
+    assert resp_server.ttls[b'sync:session:s1'] == 30
+
+
+def test_local_sessions_are_shared_objects():
+    store = SessionStore()
+    session = store.add('s1', {'takes': []})
+    assert store.get('s1') is session
+    session['status'] = 'recording'
+    store.save('s1')
+    assert store.get('s1')['status'] == 'recording'
+
+
+def test_session_sweep_drops_expired():
+    store = SessionStore(ttl=10)
+    now = time.time()
+    store.add('old', {'created_at': now - 20}, now=now)
+    store.add('new', {'created_at': now}, now=now)
+    assert store.sweep(now=now) == ['old']
+    assert 'old' not in store and 'new' in store
@@ -0,0 +1,196 @@
+import json
+import socket
+import struct
+import threading
+
+import pytest
+
+from anam_xri.bluetooth_server import (MAX_FRAME_BYTES, BluetoothBridge, FrameDecoder,
+                                       FrameError, FramedServer, encode_frame)
+from anam_xri.registry import DeviceRegistry, TRANSPORT_BLUETOOTH
+
+
+def read_messages(sock, count):
+    """Blocking read of ``count`` frames from the device end of a socketpair"""
+    decoder = FrameDecoder()
+    messages = []
+    sock.settimeout(5)
+    while len(messages) < count:
+        messages += decoder.feed(sock.recv(4096))
+    return messages
+
+
+def poll_until(server, condition, rounds=50):
+    for _ in range(rounds):
+        if condition():
+            return
+        server.poll(0.1)
+    assert condition(), 'timed out'
+
+
+@pytest.fixture
+def framed():
+    server = FramedServer()
+    yield server
+    server.close()
+
+
+def test_frame_round_trip_in_pieces():
+    frames = encode_frame({'event': 'heartbeat', 'data': {}}) + encode_frame(
+        {'event': 'clock_sync_ping', 'data': {'t0': 1.5}})
+    decoder = FrameDecoder()
+    messages = []
+    for i in range(len(frames)):
+        messages += decoder.feed(frames[i:i + 1])
+    assert messages == [{'event': 'heartbeat', 'data': {}},
+                        {'event': 'clock_sync_ping', 'data': {'t0': 1.5}}]
+
+
+def test_frame_limits():
+    with pytest.raises(FrameError):
+        encode_frame({'data': 'x' * MAX_FRAME_BYTES})
+    with pytest.raises(FrameError):
+        FrameDecoder().feed(struct.pack('!I', MAX_FRAME_BYTES + 1))
+    payload = json.dumps([1, 2]).encode()
+    with pytest.raises(FrameError):
+        FrameDecoder().feed(struct.pack('!I', len(payload)) + payload)
+    with pytest.raises(FrameError):
+        FrameDecoder().feed(struct.pack('!I', 2) + b'\xff\xfe')
+
+
+def test_messages_and_disconnect_over_socketpair(framed):
+    received, closed = [], []
+    framed.on_message = lambda conn_id, message: received.append((conn_id, message))
+    framed.on_disconnect = closed.append
+    server_end, device = socket.socketpair()
+    conn_id = framed.add_connection(server_end)
+    assert conn_id.startswith('bt:') and len(framed) == 1
+
+    device.sendall(encode_frame({'event': 'heartbeat', 'data': {}}))
+    poll_until(framed, lambda: received)
+    assert received == [(conn_id, {'event': 'heartbeat', 'data': {}})]
+
+    assert framed.send(conn_id, {'event': 'pong', 'data': {'n': 1}})
+    framed.poll(0)
+    assert read_messages(device, 1) == [{'event': 'pong', 'data': {'n': 1}}]
+
+    device.close()
+    poll_until(framed, lambda: closed)
+    assert closed == [conn_id] and len(framed) == 0
+    assert not framed.send(conn_id, {'event': 'pong'})
+
+
+def test_oversized_frame_drops_connection(framed):
+    closed = []
+    framed.on_disconnect = closed.append
+    server_end, device = socket.socketpair()
+    conn_id = framed.add_connection(server_end)
+    device.sendall(struct.pack('!I', MAX_FRAME_BYTES + 1))
+    poll_until(framed, lambda: closed)
+    assert closed == [conn_id]
+    device.close()
+
+
+def test_send_from_another_thread_wakes_the_loop(framed):
+    server_end, device = socket.socketpair()
+    conn_id = framed.add_connection(server_end)
+    framed.start()
+    try:
+        sender = threading.Thread(
+            target=lambda: framed.send(conn_id, {'event': 'start', 'data': {}}))
+        sender.start()
+        sender.join()
+        assert read_messages(device, 1) == [{'event': 'start', 'data': {}}]
+    finally:
+        framed.stop()
+        device.close()
+
+
+def test_bridge_registers_and_answers_devices(framed):
+    registry = DeviceRegistry()
+    events = []
+    BluetoothBridge(registry, framed,
+                    on_event=lambda device, event, data: events.append((device['device_id'], event)))
+    server_end, device = socket.socketpair()
+    conn_id = framed.add_connection(server_end)
+
+    # Anything but registration from an unknown device asks it to register
+    device.sendall(encode_frame({'event': 'recording_started', 'data': {}}))
+    framed.poll(1)
+    assert read_messages(device, 1) == [{'event': 'reregister', 'data': {}}]
+
+    device.sendall(encode_frame({'event': 'register_device', 'data': {}}))
+    framed.poll(1)
+    assert read_messages(device, 1)[0]['event'] == 'error'
+
+    device.sendall(encode_frame({'event': 'register_device', 'data': {'device_id': 'phone1'}}) +
+                   encode_frame({'event': 'clock_sync_ping', 'data': {'t0': 12.5}}))
+    poll_until(framed, lambda: len(events) == 1)
+    confirmed, pong = read_messages(device, 2)
+    assert confirmed['event'] == 'registration_confirmed'
+    assert confirmed['data']['device_id'] == 'phone1'
+    assert pong['event'] == 'clock_sync_pong' and pong['data']['t0'] == 12.5
+    assert registry.get_by_sid(conn_id)['transport'] == TRANSPORT_BLUETOOTH
+
+    device.close()
+    poll_until(framed, lambda: len(events) == 2)
+    assert events == [('phone1', 'register_device'), ('phone1', 'disconnect')]
+
+
+def test_bridge_schedules_registry_work(framed):
+    registry = DeviceRegistry()
+    scheduled = []
+    BluetoothBridge(registry, framed, schedule=lambda func, *args: scheduled.append((func, args)))
+    server_end, device = socket.socketpair()
+    conn_id = framed.add_connection(server_end)
+
+    device.sendall(encode_frame({'event': 'register_device', 'data': {'device_id': 'phone1'}}) +
+                   encode_frame({'event': 'clock_sync_ping', 'data': {'t0': 12.5}}))
+    poll_until(framed, lambda: scheduled)
+    # The ping is answered at once; registration waits for the scheduler
+    assert read_messages(device, 1)[0]['event'] == 'clock_sync_pong'
+    assert len(registry) == 0 and len(scheduled) == 1
+    func, args = scheduled.pop()
+    func(*args)
+    framed.poll(0)
+    assert read_messages(device, 1)[0]['event'] == 'registration_confirmed'
+    assert registry.get_by_sid(conn_id)['device_id'] == 'phone1'
+
+    device.close()
+    poll_until(framed, lambda: scheduled)
+    assert len(registry) == 1
+    func, args = scheduled.pop()
+    func(*args)
+    assert len(registry) == 0
+
+
+def test_server_handles_events_on_its_event_loop(server, monkeypatch):
+    handled = []
+    register = server.registry.register
+
+    def record_register(*args, **kwargs):
+        handled.append(('register', threading.get_ident()))
+        return register(*args, **kwargs)
+
+    monkeypatch.setattr(server.registry, 'register', record_register)
+    monkeypatch.setattr(server, 'handle_bluetooth_event', lambda device, event, data: handled.append(
+        (event, threading.get_ident())))
+    framed = FramedServer()
+    server_end, device = socket.socketpair()
+    framed.add_connection(server_end)
+    server.bridge_bluetooth(framed)
+    try:
+        device.sendall(encode_frame({'event': 'register_device', 'data': {'device_id': 'phone2'}}))
+        for _ in range(100):
+            if handled:
+                break
+            server.socketio.sleep(0.01)
+        loop = threading.get_ident()
+        assert handled == [('register', loop), ('register_device', loop)]
+        assert read_messages(device, 1)[0]['event'] == 'registration_confirmed'
+        assert server.registry.get('phone2')['transport'] == TRANSPORT_BLUETOOTH
+    finally:
+        framed.stop()
+        framed.close()
+        device.close()
+        monkeypatch.setattr(server, 'bluetooth_bridge', None)
@@ -0,0 +1,105 @@
+import sqlite3
+
+import pytest
+
+from anam_xri.catalog import MIGRATIONS, Catalog, CatalogError
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = Catalog(str(tmp_path / 'catalog.db'), batch_delay=0.01)
+    yield catalog
+    catalog.close()
+
+
+def pages(list_page, *args, limit=2):
+    """Every item of a paginated listing, fetched ``limit`` at a time"""
+    items, cursor = [], None
+    while True:
+        page = list_page(*args, limit=limit, cursor=cursor)
+        items += page['items']
+        cursor = page['next_cursor']
+        if cursor is None:
+            return items
+
+
+def test_takes_page_through_rows_never_started(catalog):
+    # Acked takes get a row before they have a start time
+    for n in range(3):
+        catalog.record_take(f'a{n}', 'p1', state='acked')
+    for n in range(3, 6):
+        catalog.record_take(f's{n}', 'p1', started_at=100.0 + n)
+    catalog.record_take('s9', 'p2', started_at=200.0)
+    assert catalog.flush(5)
+
+    takes = pages(catalog.list_takes, 'p1')
+    assert [t['session_id'] for t in takes] == ['s5', 's4', 's3', 'a2', 'a1', 'a0']
+    assert takes[-1]['started_at'] is None
+    assert [t['session_id'] for t in pages(catalog.list_takes, 'p1', limit=500)] == \
+        [t['session_id'] for t in takes]
+
+
+def test_sessions_and_devices_page_newest_first(catalog):
+    for n in range(5):
+        catalog.record_session(f's{n}', created_at=float(n), mode='broadcast')
+        catalog.record_device(f'p{n}', first_seen=float(n), last_seen=float(n) if n else None)
+    catalog.record_file('s4/p1.webm', session_id='s4', device_id='p1', kind='upload')
+    assert catalog.flush(5)
+
+    sessions = pages(catalog.list_sessions)
+    assert [s['session_id'] for s in sessions] == ['s4', 's3', 's2', 's1', 's0']
+    assert sessions[0]['file_count'] == 1
+    assert [d['device_id'] for d in pages(catalog.list_devices)] == ['p4', 'p3', 'p2', 'p1', 'p0']
+    for bad in ('x', '[1]', '"s"'):
+        with pytest.raises(CatalogError):
+            catalog.list_sessions(cursor=bad)
+
+
+def test_insert_only_columns_keep_their_first_value(catalog):
+    catalog.record_device('p1', first_seen=10.0, last_seen=10.0, user_agent='a')
+    catalog.record_device('p1', first_seen=20.0, last_seen=20.0)
+    catalog.record_session('s1', created_at=10.0, status='recording')
+    # Without its insert-only columns a write only updates an existing row
+    catalog.record_session('s1', status='stopped')
+    catalog.record_session('s2', status='stopped')
+    assert catalog.flush(5)
+
+    device = catalog.list_devices()['items'][0]
+    assert (device['first_seen'], device['last_seen'], device['user_agent']) == (10.0, 20.0, 'a')
+    session = catalog.get_session('s1')
+    assert (session['created_at'], session['status']) == (10.0, 'stopped')
+    assert catalog.get_session('s2') is None
+    with pytest.raises(CatalogError):
+        catalog.record_session('s1', colour='red')
+
+
+def test_old_catalogs_are_migrated(tmp_path):
+    path = str(tmp_path / 'catalog.db')
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE sessions (session_id TEXT PRIMARY KEY, created_at REAL NOT NULL,
+                               start_time REAL, mode TEXT, status TEXT, device_count INTEGER,
+                               synced_devices INTEGER, max_sync_error REAL, readiness TEXT);
+        CREATE TABLE takes (session_id TEXT NOT NULL, take INTEGER NOT NULL DEFAULT 0,
+                            device_id TEXT NOT NULL, started_at REAL, clock_synced INTEGER,
+                            error_bound REAL, profile TEXT,
+                            PRIMARY KEY (session_id, take, device_id));
+        CREATE TABLE files (path TEXT PRIMARY KEY, session_id TEXT NOT NULL,
+                            take INTEGER NOT NULL DEFAULT 0, device_id TEXT, kind TEXT NOT NULL,
+                            size INTEGER, chunks INTEGER, complete INTEGER, duration REAL,
+                            updated_at REAL);
+        INSERT INTO takes (session_id, device_id, started_at) VALUES ('old', 'p1', 5.0);
+    ''')
+    conn.close()
+
+    catalog = Catalog(path, batch_delay=0.01)
+    try:
+        for table, column, _ in MIGRATIONS:
+            info = catalog._reader.execute(f'PRAGMA table_info({table})')
+            assert column in {row['name'] for row in info}, (table, column)
+        catalog.record_take('old', 'p1', state='stopped', quality={'fps': 30})
+        assert catalog.flush(5)
+        take, = catalog.list_takes('p1')['items']
+        assert (take['started_at'], take['state'], take['quality']) == (5.0, 'stopped', {'fps': 30})
+    finally:
+        catalog.close()
@@ -0,0 +1,104 @@
+import os
+
+from anam_xri import chunkstore
+from anam_xri.chunkstore import CORRUPT, INCOMPLETE, MISSING, VERIFIED
+from anam_xri.ingest import STATUS_DUPLICATE, STATUS_OK, ChunkIngest
+
+CHUNKS = [b'header' * 100, b'cluster-1' * 100, b'cluster-2' * 100]
+
+
+def upload(ingest, device_id, chunks=CHUNKS, session_id='s1', take=0):
+    for seq, data in enumerate(chunks):
+        assert ingest.append(session_id, device_id, seq, data, take) == (STATUS_OK, seq + 1)
+    return ingest.stream_path(session_id, device_id, take)
+
+
+def objects(root):
+    directory = os.path.join(root, chunkstore.CHUNKS_DIR)
+    return sorted(name for _, _, names in os.walk(directory) for name in names)
+
+
+def damage(path):
+    with open(path, 'r+b') as f:
+        f.seek(10)
+        f.write(b'!')
+
+
+def test_identical_chunks_are_stored_once(tmp_path):
+    ingest = ChunkIngest(str(tmp_path))
+    upload(ingest, 'p1')
+    upload(ingest, 'p2')
+    assert len(objects(str(tmp_path))) == len(CHUNKS)
+    assert ingest.store.deduplicated_bytes == sum(len(c) for c in CHUNKS)
+
+    ingest.finalize('s1', 'p1', len(CHUNKS))
+    # p2 still links every chunk
+    assert len(objects(str(tmp_path))) == len(CHUNKS)
+    state = ingest.finalize('s1', 'p2', len(CHUNKS))
+    assert objects(str(tmp_path)) == []
+    assert state['checksum'] == chunkstore.file_digest(ingest.stream_path('s1', 'p2'))
+
+
+def test_a_take_uploaded_again_after_finalize(tmp_path):
+    ingest = ChunkIngest(str(tmp_path))
+    path = upload(ingest, 'p1')
+    state = ingest.finalize('s1', 'p1', len(CHUNKS))
+    with open(path, 'rb') as f:
+        assembled = f.read()
+
+    # Resent to the same stream: acknowledged, nothing stored or rewritten
+    for seq, data in enumerate(CHUNKS):
+        assert ingest.append('s1', 'p1', seq, data) == (STATUS_DUPLICATE, len(CHUNKS))
+    assert ingest.finalize('s1', 'p1', len(CHUNKS)) == state
+    assert objects(str(tmp_path)) == []
+    with open(path, 'rb') as f:
+        assert f.read() == assembled
+
+    # The chunks were released at assembly, so another take stores them again
+    upload(ingest, 'p1', take=1)
+    assert len(objects(str(tmp_path))) == len(CHUNKS)
+    assert ingest.store.deduplicated_bytes == 0
+
+
+def test_verify_finds_a_corrupted_chunk_before_assembly(tmp_path):
+    ingest = ChunkIngest(str(tmp_path))
+    path = upload(ingest, 'p1')
+    assert chunkstore.verify_stream(path)['status'] == INCOMPLETE
+
+    damage(chunkstore.staged_chunk(path, 1))
+    result = chunkstore.verify_stream(path)
+    assert result['status'] == CORRUPT and result['detail'] == 'damaged chunks: [1]'
+    assert (result['session_id'], result['take'], result['device_id']) == ('s1', 0, 'p1')
+
+
+def test_corrupted_chunk_is_resent_at_assembly(tmp_path):
+    ingest = ChunkIngest(str(tmp_path))
+    path = upload(ingest, 'p1')
+    damage(chunkstore.staged_chunk(path, 1))
+
+    # The stream rewinds to the damaged chunk and the damaged copy is dropped
+    state = ingest.finalize('s1', 'p1', len(CHUNKS))
+    assert not state['complete'] and state['next_seq'] == 1
+    assert state['size'] == len(CHUNKS[0])
+    assert ingest.append('s1', 'p1', 1, CHUNKS[1]) == (STATUS_OK, 2)
+    assert ingest.append('s1', 'p1', 2, CHUNKS[2]) == (STATUS_OK, 3)
+    state = ingest.finalize('s1', 'p1', len(CHUNKS))
+    assert state['complete']
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(CHUNKS)
+    assert chunkstore.verify_stream(path)['status'] == VERIFIED
+
+
+def test_verify_complete_uploads(tmp_path):
+    ingest = ChunkIngest(str(tmp_path))
+    path = upload(ingest, 'p1', take=2)
+    ingest.finalize('s1', 'p1', len(CHUNKS), take=2)
+    assert chunkstore.find_streams(ingest.take_dir('s1')) == [path]
+    result = chunkstore.verify_stream(path)
+    assert result['status'] == VERIFIED and result['take'] == 2
+
+    damage(path)
+    assert chunkstore.verify_stream(path)['status'] == CORRUPT
+    os.remove(path)
+    assert chunkstore.verify_stream(path)['status'] == MISSING
+    assert chunkstore.verify_stream(str(tmp_path / 's1' / 'p9.webm'))['status'] == MISSING
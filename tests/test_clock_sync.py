@@ -0,0 +1,83 @@
+import pytest
+
+from anam_xri.clock_sync import (BEST_SAMPLES, MAX_SAMPLES, MIN_DRIFT_SPAN, ClockEstimate,
+                                 compute_sample)
+
+
+def ping(sent_at, offset, up, down, processing=0.001):
+    """[t0, t1, t2, t3] for a ping sent at server time ``sent_at`` to a device
+    whose clock is ``offset`` behind, with one-way delays ``up`` and ``down``"""
+    t1 = sent_at + up
+    t2 = t1 + processing
+    return [sent_at - offset, t1, t2, t2 + down - offset]
+
+
+def test_compute_sample():
+    offset, rtt = compute_sample(*ping(1000.0, 2.5, 0.01, 0.01))
+    assert offset == pytest.approx(2.5) and rtt == pytest.approx(0.02)
+    # Asymmetric delay shows up as half the difference
+    offset, rtt = compute_sample(*ping(1000.0, 2.5, 0.05, 0.01))
+    assert offset == pytest.approx(2.52) and rtt == pytest.approx(0.06)
+
+
+def test_lowest_rtt_samples_and_median():
+    estimate = ClockEstimate()
+    # Congested pings with queueing on the way up, then four quick ones
+    samples = [ping(1000.0 + i, 2.5, 0.2 + 0.01 * i, 0.01) for i in range(6)]
+    samples += [ping(1010.0, 2.5, 0.010, 0.010), ping(1011.0, 2.5, 0.014, 0.010),
+                ping(1012.0, 2.5, 0.010, 0.012), ping(1013.0, 2.5, 0.011, 0.011)]
+    assert estimate.update(samples, now=1020.0)
+    assert estimate.rtt == pytest.approx(0.02)
+    # Best four offsets: 2.5, 2.502, 2.499, 2.5; median of the middle two
+    assert estimate.offset == pytest.approx(2.5)
+    assert estimate.error_bound == pytest.approx(0.02 / 2 + (2.502 - 2.499) / 2)
+    assert estimate.reference_time == pytest.approx(1010.01)
+    assert len(samples) > BEST_SAMPLES and estimate.updated_at == 1020.0
+
+    odd = ClockEstimate()
+    assert odd.update([ping(1000.0, 1.0, 0.01, 0.01), ping(1001.0, 1.0, 0.02, 0.01),
+                       ping(1002.0, 1.0, 0.01, 0.03)])
+    assert odd.offset == pytest.approx(1.0)
+
+
+def test_drift_needs_a_long_enough_span():
+    estimate = ClockEstimate()
+    drift = 50e-6
+    for n in range(8):
+        at = 1000.0 + 5.0 * n
+        assert estimate.update([ping(at, 2.5 + drift * (at - 1000.0), 0.01, 0.01)], now=at)
+        if at - 1000.0 < MIN_DRIFT_SPAN:
+            assert estimate.drift == 0.0
+    assert estimate.drift == pytest.approx(drift, rel=1e-3)
+
+    predicted = estimate.offset_at(1100.0)
+    assert predicted == pytest.approx(2.5 + drift * 100.0, abs=1e-6)
+    assert estimate.to_device_time(1100.0) == pytest.approx(1100.0 - predicted)
+
+
+def test_unusable_samples_are_rejected():
+    estimate = ClockEstimate()
+    for samples in (None, 'abcd', {'t0': 1}, [[1, 2, 3]], [['a', 1, 2, 3]],
+                    [[float('nan'), 1, 2, 3]], [[0, float('inf'), 2, 3]], [[0, 1, 2, 'inf']],
+                    # Negative round trip
+                    [[10.0, 1.0, 1.0, 9.0]]):
+        assert not estimate.update(samples), samples
+    assert not estimate.synced and estimate.offset_at(1000.0) is None
+
+    assert estimate.update([[float('nan'), 1, 2, 3], ping(1000.0, 2.5, 0.01, 0.01)])
+    assert estimate.offset == pytest.approx(2.5)
+
+
+def test_samples_past_the_cap_are_ignored():
+    estimate = ClockEstimate()
+    samples = [ping(1000.0, 2.5, 0.1, 0.1)] * MAX_SAMPLES + [ping(1000.0, 3.0, 0.01, 0.01)]
+    assert estimate.update(samples)
+    assert estimate.offset == pytest.approx(2.5) and estimate.rtt == pytest.approx(0.2)
+
+
+def test_dict_round_trip():
+    estimate = ClockEstimate()
+    estimate.update([ping(1000.0, 2.5, 0.01, 0.01)], now=1000.0)
+    copy = ClockEstimate.from_dict(estimate.as_dict())
+    assert copy.as_dict() == estimate.as_dict() and copy.synced
+    assert not ClockEstimate.from_dict(None).synced
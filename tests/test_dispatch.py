@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from anam_xri.dispatch import Dispatcher, DispatchBusy, StallDetector
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = Dispatcher(io_workers=4, cpu_workers=1, max_pending=8)
+    yield dispatcher
+    dispatcher.shutdown()
+
+
+def drain(dispatcher, count, timeout=5.0):
+    """Run callbacks until ``count`` tasks have finished"""
+    finished = []
+    deadline = time.time() + timeout
+    while len(finished) < count:
+        assert time.time() < deadline, 'timed out'
+        finished += dispatcher.run_callbacks()
+        time.sleep(0.005)
+    return finished
+
+
+def test_callbacks_run_on_the_calling_thread(dispatcher):
+    results = []
+
+    def callback(result, error):
+        results.append((result, error, threading.get_ident()))
+
+    dispatcher.submit(threading.get_ident, callback=callback)
+    drain(dispatcher, 1)
+    (worker, error, caller), = results
+    assert error is None and worker != caller == threading.get_ident()
+
+
+def test_tasks_with_a_key_run_in_order(dispatcher):
+    order = []
+
+    def write(n):
+        # Later tasks are quicker, so only the key keeps them in order
+        time.sleep(0.02 / (n + 1))
+        order.append(n)
+
+    for n in range(6):
+        dispatcher.submit(write, n, key='stream')
+    drain(dispatcher, 6)
+    assert order == list(range(6))
+    assert dispatcher.depths()['io'] == 0
+
+
+def test_full_pool_rejects_unless_forced(dispatcher):
+    release = threading.Event()
+    for _ in range(8):
+        dispatcher.submit(release.wait, 5)
+    with pytest.raises(DispatchBusy):
+        dispatcher.submit(release.wait, 5)
+    assert dispatcher.io.rejected == 1
+    dispatcher.submit(release.wait, 5, force=True)
+    assert dispatcher.depths()['io'] == 9
+    release.set()
+    drain(dispatcher, 9)
+    assert dispatcher.depths()['io'] == 0
+
+
+def test_call_returns_result_or_raises(dispatcher):
+    assert dispatcher.call(sum, [1, 2, 3]) == 6
+    with pytest.raises(ZeroDivisionError):
+        dispatcher.call(divmod, 1, 0)
+    # Waited-for tasks still pass through the completion queue quietly
+    assert len(dispatcher.run_callbacks()) == 2
+
+
+def test_errors_reach_the_callback(dispatcher):
+    errors = []
+    dispatcher.submit(int, 'x', callback=lambda result, error: errors.append(error))
+    drain(dispatcher, 1)
+    assert isinstance(errors[0], ValueError)
+
+
+def test_stall_detector_counts_late_beats():
+    detector = StallDetector(threshold=0.05, interval=0.01)
+    assert detector.beat() == 0.0
+    assert detector.beat() == 0.0
+    time.sleep(0.1)
+    assert detector.beat() > 0.05
+    assert detector.stalls == 1 and detector.max_lag > 0.05
+
+
+def test_stall_detector_reports_the_loop_stack():
+    detector = StallDetector(threshold=0.05, interval=0.01)
+    assert detector.start() and not detector.start()
+    try:
+        stack = detector.loop_stack()
+        assert 'test_stall_detector_reports_the_loop_stack' in stack
+    finally:
+        assert detector.stop()
+    assert not detector.running
@@ -0,0 +1,93 @@
+import os
+import time
+
+import pytest
+
+from anam_xri.ingest import (MAX_CHUNK_BYTES, STATUS_DUPLICATE, STATUS_OK, STATUS_OUT_OF_ORDER,
+                             ChunkIngest, IngestError)
+
+
+def test_duplicates_and_gaps_reply_with_next_seq(tmp_path):
+    ingest = ChunkIngest(str(tmp_path))
+    assert ingest.append('s1', 'p1', 0, b'first') == (STATUS_OK, 1)
+    assert ingest.append('s1', 'p1', 1, b'second') == (STATUS_OK, 2)
+    # A resent chunk is acknowledged without being written again
+    assert ingest.append('s1', 'p1', 0, b'first') == (STATUS_DUPLICATE, 2)
+    # A gap is refused with the chunk the server expects next
+    assert ingest.append('s1', 'p1', 3, b'fourth') == (STATUS_OUT_OF_ORDER, 2)
+    assert ingest.next_seq('s1', 'p1') == {'next_seq': 2, 'size': len(b'firstsecond'),
+                                           'complete': False, 'checksum': None}
+
+    # A restarted server resumes from the sidecar
+    restarted = ChunkIngest(str(tmp_path))
+    assert restarted.next_seq('s1', 'p1')['next_seq'] == 2
+    assert restarted.append('s1', 'p1', 2, b'third') == (STATUS_OK, 3)
+
+
+def test_oversized_chunks_and_bad_ids_are_rejected(tmp_path):
+    ingest = ChunkIngest(str(tmp_path))
+    with pytest.raises(IngestError):
+        ingest.append('s1', 'p1', 0, b'x' * (MAX_CHUNK_BYTES + 1))
+    assert ingest.next_seq('s1', 'p1')['next_seq'] == 0
+    for session_id, device_id, take in (('../s1', 'p1', 0), ('s1', 'p 1', 0), ('s1', 'p1', -1),
+                                        ('s1', 'p1', 'x'), ('', 'p1', 0)):
+        with pytest.raises(IngestError):
+            ingest.append(session_id, device_id, 0, b'data', take)
+
+
+def test_finalize_waits_for_every_chunk(tmp_path):
+    ingest = ChunkIngest(str(tmp_path))
+    ingest.append('s1', 'p1', 0, b'first', take=1)
+    ingest.append('s1', 'p1', 1, b'second', take=1)
+    state = ingest.finalize('s1', 'p1', 3, take=1)
+    assert not state['complete'] and state['next_seq'] == 2
+    path = ingest.stream_path('s1', 'p1', take=1)
+    assert path == os.path.join(str(tmp_path), 's1', 'take1', 'p1.webm')
+    assert not os.path.exists(path)
+
+    ingest.append('s1', 'p1', 2, b'third', take=1)
+    state = ingest.finalize('s1', 'p1', 3, take=1)
+    assert state['complete'] and state['checksum']
+    with open(path, 'rb') as f:
+        assert f.read() == b'firstsecondthird'
+    # Complete streams never change again
+    assert ingest.append('s1', 'p1', 3, b'late', take=1) == (STATUS_DUPLICATE, 3)
+
+
+def test_http_upload_protocol(server):
+    client = server.app.test_client()
+    assert client.get('/upload/h1/p1').get_json()['next_seq'] == 0
+    response = client.post('/upload/h1/p1/0', data=b'first')
+    assert response.status_code == 200
+    assert response.get_json() == {'status': STATUS_OK, 'seq': 0, 'next_seq': 1}
+    assert client.post('/upload/h1/p1/0', data=b'first').get_json()['status'] == STATUS_DUPLICATE
+
+    response = client.post('/upload/h1/p1/5', data=b'sixth')
+    assert response.status_code == 409
+    assert response.get_json() == {'status': STATUS_OUT_OF_ORDER, 'seq': 5, 'next_seq': 1}
+    response = client.post('/upload/h1/p1/1', data=b'x' * (MAX_CHUNK_BYTES + 1))
+    assert response.status_code == 413
+    assert client.post('/upload/h1/p%201/0', data=b'first').status_code == 400
+    assert client.get('/upload/h1/p1?take=2').get_json()['next_seq'] == 0
+
+def test_sweep_drops_idle_streams_only(tmp_path):
+    ingest = ChunkIngest(str(tmp_path), idle_timeout=60)
+    assert ingest.append('s1', 'p1', 0, b'first', take=0) == (STATUS_OK, 1)
+    assert ingest.append('s1', 'p2', 0, b'other', take=0) == (STATUS_OK, 1)
+    assert len(ingest) == 2
+
+    now = time.time()
+    ingest.next_seq('s1', 'p2')
+    assert ingest.sweep(now=now + 30) == []
+    ingest._streams[('s1', 'p1', 0)]['used_at'] = now - 60
+    assert ingest.sweep(now=now + 30) == [('s1', 'p1', 0)]
+    assert len(ingest) == 1
+
+    # A late chunk picks up where the sidecar says the stream stopped
+    assert ingest.append('s1', 'p1', 0, b'first') == (STATUS_DUPLICATE, 1)
+    assert ingest.append('s1', 'p1', 2, b'third') == (STATUS_OUT_OF_ORDER, 1)
+    assert ingest.append('s1', 'p1', 1, b'second') == (STATUS_OK, 2)
+    state = ingest.finalize('s1', 'p1', 2)
+    assert state['complete'] and state['size'] == len(b'firstsecond')
+    with open(ingest.stream_path('s1', 'p1'), 'rb') as f:
+        assert f.read() == b'firstsecond'
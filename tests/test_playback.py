@@ -0,0 +1,104 @@
+import json
+import os
+
+from anam_xri import webm_index
+from anam_xri.playback import PLAYBACK_BLOCK_SIZE, RecordingFiles, take_angles
+
+
+def write_upload(take_dir, device_id, data, started_at, duration=None):
+    """A complete upload with its start time, indexed if ``duration`` is given"""
+    os.makedirs(take_dir, exist_ok=True)
+    path = os.path.join(take_dir, device_id + '.webm')
+    with open(path, 'wb') as f:
+        f.write(data)
+    with open(path + '.idx', 'w') as f:
+        json.dump({'next_seq': 1, 'size': len(data), 'complete': True}, f)
+    with open(os.path.join(take_dir, device_id + '.meta.json'), 'w') as f:
+        json.dump({'started_at': started_at}, f)
+    if duration is not None:
+        stat = os.stat(path)
+        with open(webm_index.index_path(path), 'w') as f:
+            json.dump({'version': webm_index.INDEX_VERSION, 'size': stat.st_size,
+                       'mtime_ns': stat.st_mtime_ns, 'duration': duration}, f)
+    return path
+
+
+def test_metadata_is_cached_until_the_file_changes(tmp_path):
+    files = RecordingFiles(max_entries=2)
+    path = write_upload(str(tmp_path), 'p1', b'x' * 10, 100.0, duration=1.5)
+    entry = files.get(path)
+    assert entry['size'] == 10 and entry['index']['duration'] == 1.5
+    assert files.get(path) is entry
+
+    with open(path, 'ab') as f:
+        f.write(b'more')
+    changed = files.get(path)
+    assert changed is not entry and changed['size'] == 14 and changed['etag'] != entry['etag']
+    # The index no longer matches the file
+    assert changed['index'] is None
+
+    os.remove(path)
+    assert files.get(path) is None
+
+
+def test_entries_are_evicted_least_recently_used(tmp_path):
+    files = RecordingFiles(max_entries=2)
+    paths = [write_upload(str(tmp_path), f'p{n}', b'x', 100.0) for n in range(3)]
+    first = files.get(paths[0])
+    files.get(paths[1])
+    assert files.get(paths[0]) is first
+    files.get(paths[2])
+    assert files.get(paths[0]) is first
+    assert len(files._entries) == 2 and paths[1] not in files._entries
+
+
+def test_take_angles_share_one_timeline(tmp_path):
+    take_dir = str(tmp_path / 's1')
+    write_upload(take_dir, 'p1', b'x' * 10, 100.0, duration=10.0)
+    write_upload(take_dir, 'p2', b'y' * 10, 100.5, duration=8.0)
+    write_upload(take_dir, 'p3', b'z' * 10, 101.0)
+    with open(os.path.join(take_dir, 'session.json'), 'w') as f:
+        json.dump({'start_time': 102.0}, f)
+
+    timeline = take_angles(RecordingFiles(), take_dir)
+    assert timeline['origin'] == 100.0 and timeline['start'] == 2.0
+    assert timeline['duration'] == 10.0
+    assert [(a['device_id'], a['offset'], a['duration'], a['seekable'])
+            for a in timeline['angles']] == [('p1', 0.0, 10.0, True), ('p2', 0.5, 8.0, True),
+                                             ('p3', 1.0, None, False)]
+
+
+def test_recordings_are_served_with_ranges(server):
+    take_dir = os.path.join(server.app.config['RECORDINGS_DIR'], 'play1')
+    data = bytes(range(256)) * 4
+    write_upload(take_dir, 'p1', data, 100.0)
+    client = server.app.test_client()
+
+    response = client.get('/recordings/play1/p1.webm', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206 and response.data == data[10:20]
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(data)}'
+    etag = response.headers['ETag']
+
+    response = client.get('/recordings/play1/p1.webm', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert client.get('/recordings/play1/p9.webm').status_code == 404
+    assert client.get('/recordings/play1/p1.webm?take=x').status_code == 400
+
+
+def test_recording_blocks_are_read_on_the_io_pool(server, monkeypatch):
+    take_dir = os.path.join(server.app.config['RECORDINGS_DIR'], 'play2')
+    data = os.urandom(2 * PLAYBACK_BLOCK_SIZE + 100)
+    write_upload(take_dir, 'p1', data, 100.0)
+    reads = []
+    run_blocking = server.run_blocking
+
+    def record(fn, *args, **kwargs):
+        reads.append(getattr(fn, '__name__', None))
+        return run_blocking(fn, *args, **kwargs)
+
+    monkeypatch.setattr(server, 'run_blocking', record)
+    end = 2 * PLAYBACK_BLOCK_SIZE + 50
+    response = server.app.test_client().get('/recordings/play2/p1.webm',
+                                            headers={'Range': f'bytes=100-{end}'})
+    assert response.status_code == 206 and response.data == data[100:end + 1]
+    assert reads.count('read') >= 2
@@ -0,0 +1,155 @@
+import os
+from concurrent.futures import Future
+
+import pytest
+
+from anam_xri import chunkstore, postprocess
+from anam_xri.postprocess import JOB_DONE, JOB_QUEUED, PipelineQueue
+
+
+class ManualExecutor:
+    """Records submissions; the test completes their futures"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.submitted.append((fn, args, future))
+        return future
+
+
+def finish(executor, fn, result):
+    for submitted_fn, _, future in executor.submitted:
+        if submitted_fn is fn and not future.done():
+            future.set_running_or_notify_cancel()
+            future.set_result(result)
+            return
+    raise AssertionError(f'{fn.__name__} was not submitted')
+
+
+def test_estimate_lag_recovers_a_known_offset():
+    np = postprocess.load_numpy()
+    if np is None:
+        pytest.skip('numpy not installed')
+    rate = postprocess.REFINE_SAMPLE_RATE
+    noise = np.random.default_rng(7).standard_normal(3 * rate).astype(np.float32)
+    reference = noise[rate:2 * rate]
+    for shift in (987, -412, 0):
+        # The same sound `shift` samples later in the other clip
+        other = noise[rate - shift:2 * rate - shift]
+        lag = postprocess.estimate_lag(reference, other)
+        assert lag == pytest.approx(shift / rate, abs=0.5 / rate), shift
+    assert postprocess.estimate_lag(reference, np.zeros(rate, dtype=np.float32)) is None
+    assert postprocess.estimate_lag(reference, reference[:0]) is None
+
+
+def test_verify_and_align_wait_for_index(tmp_path):
+    executor = ManualExecutor()
+    queue = PipelineQueue(executor=executor)
+    session_dir = str(tmp_path)
+    path = os.path.join(session_dir, 'p1.webm')
+    other = os.path.join(session_dir, 'take1', 'p1.webm')
+
+    queue.submit_index('index-p1', path, 's1', 0, 'p1')
+    verify = queue.submit_verify('verify-p1', path)
+    align = queue.submit('s1', session_dir + os.sep)
+    unrelated = queue.submit_verify('verify-take1-p1', other)
+    assert [fn for fn, _, _ in executor.submitted] == [postprocess.index_recording,
+                                                       chunkstore.verify_stream]
+    assert executor.submitted[1][1] == (other,)
+    assert verify['status'] == align['status'] == JOB_QUEUED
+
+    queue.poll()
+    assert len(executor.submitted) == 2 and unrelated['future'] is not None
+
+    finish(executor, postprocess.index_recording, {'path': path})
+    queue.poll()
+    assert [fn for fn, _, _ in executor.submitted[2:]] == [chunkstore.verify_stream,
+                                                           postprocess.process_session]
+    assert executor.submitted[3][1] == (session_dir, False)
+
+    # Nothing left to wait for once the index job has finished
+    finish(executor, chunkstore.verify_stream, {'status': 'verified'})
+    queue.poll()
+    assert queue.submit_verify('verify-p1-again', path)['future'] is not None
+
+
+def test_waiting_job_fails_if_the_pool_is_busy(tmp_path):
+    executor = ManualExecutor()
+    queue = PipelineQueue(executor=executor)
+    path = str(tmp_path / 'p1.webm')
+    queue.submit_index('index-p1', path, 's1', 0, 'p1')
+    verify = queue.submit_verify('verify-p1', path)
+
+    def busy(fn, *args):
+        raise RuntimeError('cpu pool has 4 jobs pending')
+
+    finish(executor, postprocess.index_recording, {'path': path})
+    executor.submit = busy
+    changed = queue.poll()
+    assert verify in changed and verify['error'] == 'cpu pool has 4 jobs pending'
+    assert queue.describe(verify)['status'] == 'failed'
+    assert queue.jobs['index-p1']['status'] == JOB_DONE
+
+
+def test_paused_takes_are_cut_to_the_common_segments(tmp_path, monkeypatch):
+    cut = {}
+    monkeypatch.setattr(postprocess, 'cut_clip',
+                        lambda path, cuts, output: cut.update({path: cuts}))
+    # p2 starts later and pauses and resumes a little after p1
+    clips = [
+        {'device_id': 'p1', 'path': 'p1.webm', 'started_at': 100.0, 'duration': 15.0,
+         'events': [{'state': 'paused', 'at': 105.0}, {'state': 'recording', 'at': 110.0}]},
+        {'device_id': 'p2', 'path': 'p2.webm', 'started_at': 100.5, 'duration': 14.4,
+         'events': [{'state': 'recording', 'at': 100.5}, {'state': 'paused', 'at': 105.2},
+                    {'state': 'recording', 'at': 110.3}, {'state': 'stopped', 'at': 120.0}]},
+    ]
+    assert postprocess.recording_intervals(clips[1]) == [(100.5, 105.2), (110.3, 120.0)]
+
+    summary = postprocess._align(str(tmp_path), {'start_time': 100.5}, clips, False, False, 0.0)
+    assert summary['segments'] == [[0.0, 4.5], [pytest.approx(9.8), pytest.approx(19.5)]]
+    assert summary['duration'] == pytest.approx(14.2)
+    # The same moments of both angles, each in its own timeline
+    assert cut['p1.webm'] == [(0.5, 4.5), (pytest.approx(5.3), pytest.approx(9.7))]
+    assert cut['p2.webm'] == [(0.0, 4.5), (pytest.approx(4.7), pytest.approx(9.7))]
+
+
+def test_recording_intervals_follow_the_media():
+    clip = {'started_at': 10.0, 'duration': 3.0,
+            'events': [{'state': 'paused', 'at': 12.0}, {'state': 'paused', 'at': 12.5},
+                       {'state': 'recording', 'at': 5.0}]}
+    # Paused at the end: the file still holds three seconds
+    assert postprocess.recording_intervals(clip) == [(10.0, 13.0)]
+    clip['events'].append({'state': 'recording', 'at': 20.0})
+    assert postprocess.recording_intervals(clip) == [(10.0, 12.0), (20.0, 21.0)]
+    assert postprocess.media_time([(10.0, 12.0), (20.0, 21.0)], 15.0) == 2.0
+    segments = postprocess.common_segments([[(0.0, 5.0)], [(1.0, 2.0), (4.95, 9.0)]], 0.5)
+    assert segments == [(1.0, 2.0)]
+
+
+def test_refinement_corrects_a_reported_start(tmp_path, monkeypatch):
+    np = postprocess.load_numpy()
+    if np is None:
+        pytest.skip('numpy not installed')
+    rate = postprocess.REFINE_SAMPLE_RATE
+    noise = np.random.default_rng(3).standard_normal(40 * rate).astype(np.float32)
+    # p2 reports a start 50 ms later than it really began recording
+    true_start = {'p1.webm': 100.0, 'p2.webm': 100.45}
+
+    def read_audio_window(path, start, duration):
+        first = int(round((true_start[path] + start - 95.0) * rate))
+        return noise[first:first + int(duration * rate)]
+
+    cut = {}
+    monkeypatch.setattr(postprocess, 'read_audio_window', read_audio_window)
+    monkeypatch.setattr(postprocess, 'cut_clip',
+                        lambda path, cuts, output: cut.update({path: cuts}))
+    clips = [{'device_id': 'p1', 'path': 'p1.webm', 'started_at': 100.0, 'duration': 20.0},
+             {'device_id': 'p2', 'path': 'p2.webm', 'started_at': 100.5, 'duration': 20.0}]
+    summary = postprocess._align(str(tmp_path), {}, clips, False, True, 0.0)
+    assert summary['refined']
+    assert summary['clips'][1]['refinement'] == pytest.approx(0.05, abs=0.5 / rate)
+    assert cut['p1.webm'][0][0] == pytest.approx(0.5)
+    assert cut['p2.webm'][0][0] == pytest.approx(0.05, abs=0.5 / rate)
+    assert summary['duration'] == pytest.approx(19.5, abs=0.5 / rate)
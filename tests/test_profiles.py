@@ -0,0 +1,83 @@
+from anam_xri.profiles import (AUDIO_BITRATE, PROFILE_LADDER, BacklogTracker, ProfileAssignments,
+                               allocate, ceiling_rung, normalize_capabilities)
+
+VP9 = 'video/webm;codecs=vp9,opus'
+VP8 = 'video/webm;codecs=vp8,opus'
+
+
+def device(device_id, **capabilities):
+    capabilities.setdefault('mime_types', [VP9, VP8])
+    return {'device_id': device_id, 'info': {'capabilities': normalize_capabilities(capabilities)}}
+
+
+def rungs(profiles):
+    return {device_id: profile['rung'] for device_id, profile in profiles.items()}
+
+
+def bitrate(rung):
+    return PROFILE_LADDER[rung]['video_bitrate'] + AUDIO_BITRATE
+
+
+def test_devices_within_budget_get_their_ceiling():
+    devices = [device('p1'), device('p2', max_width=720, max_height=1280),
+               device('p3', battery_level=0.1), device('p4', thermal='critical')]
+    profiles = allocate(devices, budget_bps=100000000)
+    assert rungs(profiles) == {'p1': 0, 'p2': 1, 'p3': 2, 'p4': 3}
+    assert profiles['p1']['mime_type'] == VP9 and profiles['p1']['name'] == '1080p'
+    # Hot or low-battery phones are steered to the cheaper codec
+    assert profiles['p3']['mime_type'] == profiles['p4']['mime_type'] == VP8
+
+
+def test_the_most_expensive_device_steps_down_first():
+    devices = [device('p1'), device('p2'), device('p3', max_width=1280, max_height=720)]
+    budget = bitrate(0) + bitrate(1) + bitrate(1)
+    profiles = allocate(devices, budget_bps=budget)
+    # p1 and p2 tie at 1080p; the first by id steps down
+    assert rungs(profiles) == {'p1': 1, 'p2': 0, 'p3': 1}
+    assert sum(p['video_bitrate'] + p['audio_bitrate'] for p in profiles.values()) <= budget
+
+    profiles = allocate(devices, budget_bps=3 * bitrate(2))
+    assert rungs(profiles) == {'p1': 2, 'p2': 2, 'p3': 2}
+    # Nothing fits: everyone records at the lowest rung
+    assert set(rungs(allocate(devices, budget_bps=1)).values()) == {len(PROFILE_LADDER) - 1}
+
+
+def test_backlog_floor_limits_the_ceiling():
+    slow = device('p1')
+    slow['info']['min_rung'] = 2
+    assert rungs(allocate([slow, device('p2')], budget_bps=100000000)) == {'p1': 2, 'p2': 0}
+
+
+def test_backlog_steps_down_and_recovers():
+    tracker = BacklogTracker(high=3, low=1, step_down_cooldown=5.0, step_up_after=20.0)
+    assert tracker.report('p1', 4, min_rung=0, current_rung=0, now=100.0) == 1
+    # Still backed up, but within the cooldown
+    assert tracker.report('p1', 6, min_rung=1, current_rung=1, now=102.0) == 1
+    assert tracker.report('p1', 6, min_rung=1, current_rung=1, now=105.0) == 2
+    # A queue between low and high holds the floor
+    assert tracker.report('p1', 2, min_rung=2, current_rung=2, now=106.0) == 2
+
+    assert tracker.report('p1', 0, min_rung=2, current_rung=2, now=110.0) == 2
+    assert tracker.report('p1', 1, min_rung=2, current_rung=2, now=129.0) == 2
+    assert tracker.report('p1', 0, min_rung=2, current_rung=2, now=130.0) == 1
+    # One rung at a time: another full drained period for the next
+    assert tracker.report('p1', 0, min_rung=1, current_rung=1, now=140.0) == 1
+    assert tracker.report('p1', 2, min_rung=1, current_rung=1, now=145.0) == 1
+    assert tracker.report('p1', 0, min_rung=1, current_rung=1, now=160.0) == 1
+    assert tracker.report('p1', 0, min_rung=1, current_rung=1, now=180.0) == 0
+    assert tracker.report('p1', 0, min_rung=0, current_rung=0, now=500.0) == 0
+
+
+def test_capabilities_and_assignments():
+    capabilities = normalize_capabilities({'mime_types': [VP9, 'video/ogg'], 'max_width': '-5',
+                                           'battery_level': 7, 'thermal': 'melting'})
+    assert capabilities['mime_types'] == [VP9] and capabilities['max_width'] == 1
+    assert capabilities['battery_level'] == 1.0 and capabilities['thermal'] is None
+    assert ceiling_rung(normalize_capabilities('junk')) == 0
+
+    assignments = ProfileAssignments()
+    profiles = allocate([device('p1'), device('p2')])
+    assert assignments.changed(profiles) == profiles
+    assert assignments.changed(profiles) == {}
+    assignments.forget('p1')
+    assert list(assignments.changed(profiles)) == ['p1']
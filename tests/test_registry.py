@@ -0,0 +1,83 @@
+import json
+
+from anam_xri.backends import LocalStateBackend
+from anam_xri.registry import (DEFAULT_GROUP, STATUS_CONNECTED, STATUS_DISCONNECTED,
+                               STATUS_STALE, DeviceRegistry, SessionStore, valid_group)
+
+
+def test_register_reconnect_keeps_identity():
+    registry = DeviceRegistry()
+    device, reconnected = registry.register('sid1', 'p1', {'user_agent': 'a'}, now=100)
+    assert not reconnected and len(registry) == 1
+    device['clock'].offset = 0.25
+
+    assert registry.disconnect('sid1', now=110) is device
+    assert device['status'] == STATUS_DISCONNECTED and len(registry) == 0
+    assert registry.get_by_sid('sid1') is None
+
+    again, reconnected = registry.register('sid2', 'p1', now=120)
+    assert reconnected and again is device and again['clock'].offset == 0.25
+    assert again['info'] == {'user_agent': 'a'}
+    assert registry.get_by_sid('sid2') is device and len(registry) == 1
+
+
+def test_heartbeat_and_sweep():
+    registry = DeviceRegistry(stale_after=15, retain_after=300)
+    registry.register('sid1', 'p1', now=0)
+    registry.register('sid2', 'p2', now=0)
+    assert registry.heartbeat('sid2', now=10) == (registry.get('p2'), False)
+    assert registry.heartbeat('unknown', now=10) == (None, False)
+
+    stale, removed = registry.sweep(now=20)
+    assert [d['device_id'] for d in stale] == ['p1'] and removed == []
+    assert registry.get('p1')['status'] == STATUS_STALE and len(registry) == 1
+    device, revived = registry.heartbeat('sid1', now=21)
+    assert revived and device['status'] == STATUS_CONNECTED and len(registry) == 2
+
+    stale, removed = registry.sweep(now=400)
+    assert sorted(removed) == ['p1', 'p2'] and len(registry) == 0
+    assert registry.backend.hgetall('devices') == {}
+    assert registry.backend.hgetall('group:' + DEFAULT_GROUP) == {}
+
+
+def test_cluster_view_across_workers():
+    backend = LocalStateBackend()
+    worker_a = DeviceRegistry(backend=backend, worker_id='a')
+    worker_b = DeviceRegistry(backend=backend, worker_id='b')
+    worker_a.register('sid1', 'p1', {'group': 'stage1'}, now=100)
+    worker_b.register('sid2', 'p2', now=100)
+    worker_b.register('sid3', 'p3', now=50)
+
+    devices = {d['device_id']: d for d in worker_a.cluster_devices(now=110)}
+    assert set(devices) == {'p1', 'p2', 'p3'}
+    assert devices['p2']['worker'] == 'b' and devices['p3']['status'] == STATUS_STALE
+    assert [d['device_id'] for d in worker_b.cluster_connected(now=110, group='stage1')] == ['p1']
+
+    # A move updates the group indexes for every worker
+    assert worker_a.set_group(worker_a.get('p1'), 'stage2') == 'stage1'
+    assert worker_b.cluster_devices(now=110, group='stage1') == []
+    assert [d['device_id'] for d in worker_b.cluster_devices(now=110, group='stage2')] == ['p1']
+    assert json.loads(backend.hget('devices', 'p1'))['info']['group'] == 'stage2'
+
+
+def test_valid_group():
+    assert valid_group('stage-1_a') and not valid_group('bad name!')
+    assert not valid_group('x' * 33) and not valid_group(None)
+
+
+def test_session_store_is_bounded():
+    store = SessionStore(max_sessions=2)
+    for n in range(3):
+        store.add(f's{n}', {'takes': []}, now=n)
+    assert len(store) == 2 and 's0' not in store
+    assert [s['created_at'] for s in store.values()] == [1, 2]
+    # The backend copy outlives the local entry until its TTL
+    assert store.get('s0')['created_at'] == 0
+
+
+def test_session_store_sweeps_by_age():
+    store = SessionStore(ttl=10)
+    for n in range(3):
+        store.add(f's{n}', {'takes': []}, now=5 * n)
+    assert store.sweep(now=14) == ['s0']
+    assert 's0' not in store and len(store) == 2
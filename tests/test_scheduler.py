@@ -0,0 +1,67 @@
+import pytest
+
+from anam_xri.scheduler import (DEFAULT_RTT, MAX_LEAD_TIME, MIN_LEAD_TIME, PREPARE_TIME,
+                                READINESS_MARGIN, SAFETY_MARGIN, STATE_LATE, STATE_MISSING,
+                                STATE_READY, FanoutTimer, classify_ack, plan_lead_time,
+                                readiness_report)
+
+
+def test_lead_time_covers_the_slowest_device():
+    fixed = PREPARE_TIME + READINESS_MARGIN + SAFETY_MARGIN
+    assert plan_lead_time([0.05, 0.4, 0.1], 0.2) == pytest.approx(0.2 + 0.4 + fixed)
+    # Devices without clock sync count as DEFAULT_RTT
+    assert plan_lead_time([0.05, None], 0.2) == pytest.approx(0.2 + DEFAULT_RTT + fixed)
+    assert plan_lead_time([], 0.0) == pytest.approx(max(MIN_LEAD_TIME, DEFAULT_RTT + fixed))
+    assert plan_lead_time([0.001], 0.0, margin=0.0) == MIN_LEAD_TIME
+    assert plan_lead_time([30.0], 0.5) == MAX_LEAD_TIME
+
+
+def test_fanout_timer_tracks_cost_per_device():
+    timer = FanoutTimer(initial=0.001, weight=0.5)
+    timer.record(0.3, 100)
+    assert timer.per_device == pytest.approx(0.002)
+    timer.record(1.0, 0)
+    assert timer.estimate(50) == pytest.approx(0.1)
+
+
+def test_classify_ack():
+    assert classify_ack(100.0, 100.0 - PREPARE_TIME) == STATE_READY
+    assert classify_ack(100.0, 100.0 - PREPARE_TIME / 2) == STATE_LATE
+    assert classify_ack(100.0, 99.0, prepare_time=2.0) == STATE_LATE
+
+
+def test_readiness_report():
+    report = readiness_report(['p1', 'p2', 'p3'], {'p1': STATE_READY, 'p3': STATE_LATE,
+                                                   'p9': STATE_READY})
+    assert report == {STATE_READY: ['p1'], STATE_LATE: ['p3'], STATE_MISSING: ['p2']}
+
+
+def control_replies(client):
+    return [message['args'][0] for message in client.get_received()
+            if message['name'] in ('sync_command_sent', 'sync_control_sent')]
+
+
+def test_start_and_stop_commands_are_validated(server):
+    client = server.socketio.test_client(server.app)
+    client.emit('join_admin')
+    client.get_received()
+
+    client.emit('sync_record_command', {'mode': 'warp'})
+    assert control_replies(client) == [{'session_id': None, 'mode': 'warp',
+                                        'error': 'unknown mode'}]
+
+    client.emit('sync_record_command', {'mode': 'fixed', 'duration': 'inf'})
+    started, = control_replies(client)
+    assert started['lead_time'] == 3.0 and started['stop_time'] is None
+    session_id = started['session_id']
+
+    for after in ('inf', 'nan', '-1', 'soon'):
+        client.emit('sync_control_command', {'session_id': session_id, 'action': 'stop',
+                                             'after': after})
+        assert control_replies(client)[0]['error'] == 'invalid delay', after
+
+    client.emit('sync_control_command', {'session_id': session_id, 'action': 'stop',
+                                         'after': '2'})
+    stopped, = control_replies(client)
+    assert stopped['status'] == 'stopped' and stopped['lead_time'] == pytest.approx(2.0, abs=0.1)
+    client.disconnect()
@@ -0,0 +1,64 @@
+import gzip
+
+from flask import Flask
+
+from anam_xri.static_pages import PrerenderedPage
+
+HTML = '<!doctype html><title>Sync</title>' + '<p>recording</p>' * 200
+
+
+def page_client(page):
+    app = Flask(__name__)
+    app.add_url_rule('/', 'page', page.response)
+    return app.test_client()
+
+
+def test_variants_and_conditional_get():
+    page = PrerenderedPage(HTML)
+    client = page_client(page)
+
+    response = client.get('/', headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200 and response.data == HTML.encode()
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    etag = response.headers['ETag']
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == HTML.encode()
+    gzip_etag = response.headers['ETag']
+    assert gzip_etag != etag
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzip_etag})
+    assert response.status_code == 304 and response.data == b''
+    assert response.headers['ETag'] == gzip_etag
+    # The ETag of another variant doesn't match
+    response = client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+def test_brotli_is_preferred_when_accepted():
+    page = PrerenderedPage(HTML)
+    # Stands in for the variant built when the brotli package is installed
+    page.variants.setdefault('br', (b'brotli body', page.variants['identity'][1] + '-br'))
+    client = page_client(page)
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.headers['ETag'].endswith('-br"')
+    response = client.get('/', headers={'Accept-Encoding': 'br;q=0.5, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    response = client.get('/', headers={'Accept-Encoding': 'br;q=0, gzip;q=0'})
+    assert 'Content-Encoding' not in response.headers and response.data == HTML.encode()
+
+
+def test_server_pages(server):
+    client = server.app.test_client()
+    for path in ('/', '/admin'):
+        response = client.get(path, headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200 and response.headers['Content-Encoding'] == 'gzip'
+        assert b'<html' in gzip.decompress(response.data)
+        response = client.get(path, headers={'Accept-Encoding': 'gzip',
+                                             'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
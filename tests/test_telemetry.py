@@ -0,0 +1,88 @@
+import pytest
+
+from anam_xri.telemetry import (ANOMALY_BITRATE_DROP, ANOMALY_CLOCK_DRIFT, ANOMALY_DROPPED_FRAMES,
+                                ANOMALY_LOW_BATTERY, ANOMALY_LOW_FPS, ANOMALY_STALLED,
+                                TelemetryAggregator, TelemetryError, parse_report,
+                                session_summary)
+
+
+def report(**fields):
+    data = {'interval': 2.0, 'bytes': 500000, 'chunks': 2, 'frames': 60, 'dropped': 0,
+            'clock_drift': 0.0, 'battery': 0.8, 'charging': False}
+    data.update(fields)
+    return parse_report(data)
+
+
+def test_parse_report_validates():
+    assert report(frames=None)['frames'] is None
+    assert report(clock_drift=None)['clock_drift'] == 0.0
+    for fields in ({'interval': 0}, {'bytes': -1}, {'battery': 1.5}, {'chunks': 'x'},
+                   {'interval': float('nan')}):
+        with pytest.raises(TelemetryError):
+            report(**fields)
+    with pytest.raises(TelemetryError):
+        parse_report({'interval': 2.0})
+
+
+def test_anomalies_are_raised_and_cleared():
+    aggregator = TelemetryAggregator(window=5)
+    for _ in range(4):
+        summary, raised, cleared = aggregator.report('s1', 0, 'p1', report(), expected_fps=30)
+        assert raised == cleared == []
+    assert summary['bitrate'] == pytest.approx(500000 * 8 / 2.0)
+    assert summary['fps'] == pytest.approx(30.0)
+
+    summary, raised, _ = aggregator.report('s1', 0, 'p1', report(bytes=0, chunks=0),
+                                           expected_fps=30)
+    assert raised == sorted([ANOMALY_STALLED, ANOMALY_BITRATE_DROP])
+    assert summary['anomalies'] == raised
+
+    _, raised, cleared = aggregator.report('s1', 0, 'p1', report(), expected_fps=30)
+    assert raised == [] and cleared == sorted([ANOMALY_STALLED, ANOMALY_BITRATE_DROP])
+
+
+def test_window_checks():
+    aggregator = TelemetryAggregator(window=5)
+    for _ in range(3):
+        _, raised, _ = aggregator.report('s1', 0, 'p1', report(frames=40, dropped=10),
+                                         expected_fps=30)
+    assert raised == sorted([ANOMALY_DROPPED_FRAMES, ANOMALY_LOW_FPS])
+
+    _, raised, _ = aggregator.report('s1', 0, 'p2', report(clock_drift=0.05))
+    assert raised == [ANOMALY_CLOCK_DRIFT]
+    _, raised, _ = aggregator.report('s1', 0, 'p3', report(battery=0.1))
+    assert raised == [ANOMALY_LOW_BATTERY]
+    _, raised, _ = aggregator.report('s1', 0, 'p4', report(battery=0.1, charging=True))
+    assert raised == []
+
+
+def test_window_is_bounded_and_finished():
+    aggregator = TelemetryAggregator(window=3, max_streams=2)
+    for _ in range(5):
+        summary, _, _ = aggregator.report('s1', 0, 'p1', report())
+    assert summary['reports'] == 3 and summary['seconds'] == 6.0
+
+    aggregator.report('s1', 0, 'p2', report())
+    aggregator.report('s1', 1, 'p1', report())
+    # The least recently updated stream was evicted
+    assert len(aggregator) == 2
+    assert aggregator.finish('s1', 0, 'p1') is None
+    assert aggregator.finish('s1', 1, 'p1')['reports'] == 1
+    assert aggregator.latest('p2')['reports'] == 1
+
+    aggregator.forget('p2')
+    assert aggregator.latest('p2') is None and len(aggregator) == 0
+
+
+def test_session_summary():
+    assert session_summary({})['devices'] == 0
+    aggregator = TelemetryAggregator()
+    summaries = {}
+    for device_id, fields in (('p1', {}), ('p2', {'battery': 0.1, 'clock_drift': -0.03})):
+        summaries[device_id], _, _ = aggregator.report('s1', 0, device_id, report(**fields))
+    summary = session_summary(summaries)
+    assert summary['devices'] == 2
+    assert summary['bitrate'] == pytest.approx(2 * 500000 * 8 / 2.0)
+    assert summary['min_battery'] == 0.1
+    assert summary['max_clock_drift'] == pytest.approx(0.03)
+    assert summary['flagged'] == {'p2': sorted([ANOMALY_CLOCK_DRIFT, ANOMALY_LOW_BATTERY])}
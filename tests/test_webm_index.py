@@ -0,0 +1,168 @@
+import struct
+import threading
+
+import pytest
+
+from anam_xri import chunkstore, webm_index
+from anam_xri.webm_index import WebMError
+
+UNKNOWN_SIZE = b'\x01\xff\xff\xff\xff\xff\xff\xff'
+# Synthetic take: 30 fps video with a keyframe every second, 20 ms audio
+SECONDS = 3
+FRAME_MS = 33
+AUDIO_MS = 20
+# Last video frame of a cluster, plus one frame interval
+CLUSTER_DURATION = (999 // FRAME_MS * FRAME_MS + FRAME_MS) / 1000
+
+
+def vint(size):
+    for length in range(1, 9):
+        if size < (1 << (7 * length)) - 1:
+            return ((1 << (7 * length)) | size).to_bytes(length, 'big')
+    raise ValueError(size)
+
+
+def element(element_id, payload, size=None):
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+    return id_bytes + (size if size is not None else vint(len(payload))) + payload
+
+
+def uint(element_id, value):
+    return element(element_id, value.to_bytes(4, 'big'))
+
+
+def simple_block(track, relative, key, payload=b'\x00' * 40):
+    return element(webm_index.SIMPLE_BLOCK, vint(track) + struct.pack(
+        '>hB', relative, 0x80 if key else 0) + payload)
+
+
+def media_recorder_webm(seconds=SECONDS):
+    """WebM as MediaRecorder streams it: unknown sizes, no Duration, no Cues"""
+    header = element(webm_index.EBML, element(0x4282, b'webm'))
+    info = element(webm_index.INFO, uint(webm_index.TIMECODE_SCALE, 1000000) +
+                   element(0x4D80, b'synthetic'))
+    tracks = element(webm_index.TRACKS, element(webm_index.TRACK_ENTRY, b''.join((
+        uint(webm_index.TRACK_NUMBER, 1), uint(webm_index.TRACK_TYPE, 1),
+        element(webm_index.CODEC_ID, b'V_VP8')))) + element(webm_index.TRACK_ENTRY, b''.join((
+            uint(webm_index.TRACK_NUMBER, 2), uint(webm_index.TRACK_TYPE, 2),
+            element(webm_index.CODEC_ID, b'A_OPUS')))))
+    clusters = []
+    for second in range(seconds):
+        blocks = [(relative, 1, relative == 0) for relative in range(0, 1000, FRAME_MS)]
+        blocks += [(relative, 2, True) for relative in range(0, 1000, AUDIO_MS)]
+        clusters.append(element(webm_index.CLUSTER, uint(webm_index.TIMECODE, second * 1000) +
+                                b''.join(simple_block(track, relative, key)
+                                         for relative, track, key in sorted(blocks)),
+                                size=UNKNOWN_SIZE))
+    return header + element(webm_index.SEGMENT, info + tracks + b''.join(clusters),
+                            size=UNKNOWN_SIZE)
+
+
+@pytest.fixture
+def recording(tmp_path):
+    path = str(tmp_path / 'p1.webm')
+    with open(path, 'wb') as f:
+        f.write(media_recorder_webm())
+    return path
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_make_seekable_indexes_and_rewrites(recording):
+    index = webm_index.make_seekable(recording)
+    assert index['duration'] == pytest.approx(SECONDS - 1 + CLUSTER_DURATION)
+    assert len(index['clusters']) == SECONDS
+    assert [time for time, _ in index['keyframes']] == [0.0, 1.0, 2.0]
+    assert index['cue_track'] == 1
+    assert index['digest'] == chunkstore.file_digest(recording)
+
+    # Sizes are known now and the file parses with Cues and Duration in place
+    data = read(recording)
+    assert index['size'] == len(data)
+    with open(recording, 'rb') as f:
+        layout = webm_index.parse(f.read())
+    assert [c['timecode'] for c in layout['clusters']] == [0, 1000, 2000]
+    for _, offset, length in index['clusters']:
+        assert data[offset:offset + 4] == b'\x1f\x43\xb6\x75'
+        assert offset + length <= len(data)
+    ranges = webm_index.seek(index, 1.5)
+    assert ranges['time'] == 1.0 and ranges['cluster_range'][0] == index['clusters'][1][1]
+    assert ranges['init_range'] == [0, index['init_end'] - 1]
+
+
+def test_make_seekable_is_idempotent(recording):
+    first = webm_index.make_seekable(recording)
+    data = read(recording)
+    # Cached: the file isn't touched again
+    assert webm_index.make_seekable(recording)['mtime_ns'] == first['mtime_ns']
+    # Rewriting a seekable file gives the same bytes and index
+    again = webm_index.make_seekable(recording, force=True)
+    assert read(recording) == data
+    for key in ('duration', 'clusters', 'keyframes', 'digest', 'init_end', 'size'):
+        assert again[key] == first[key]
+
+
+def test_truncated_upload_keeps_complete_blocks(tmp_path):
+    data = media_recorder_webm()
+    path = str(tmp_path / 'cut.webm')
+    # Cut off in the middle of the last cluster's last block
+    with open(path, 'wb') as f:
+        f.write(data[:-20])
+    index = webm_index.make_seekable(path)
+    assert len(index['clusters']) == SECONDS
+    assert SECONDS - 1 < index['duration'] < SECONDS - 1 + CLUSTER_DURATION
+    assert webm_index.make_seekable(path, force=True)['digest'] == index['digest']
+
+    # Cut inside the last cluster's header: that cluster is dropped
+    last_cluster = data.rindex(b'\x1f\x43\xb6\x75')
+    with open(path, 'wb') as f:
+        f.write(data[:last_cluster + 6])
+    index = webm_index.make_seekable(path)
+    assert len(index['clusters']) == SECONDS - 1
+    assert index['duration'] == pytest.approx(SECONDS - 2 + CLUSTER_DURATION)
+
+
+def test_unusable_files_raise(tmp_path):
+    data = media_recorder_webm()
+    cases = {
+        'empty': b'',
+        'mp4': b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 64,
+        'header_only': data[:data.index(b'\x1f\x43\xb6\x75')],
+        'cut_in_tracks': data[:data.index(b'A_OPUS')],
+    }
+    for name, content in cases.items():
+        path = str(tmp_path / f'{name}.webm')
+        with open(path, 'wb') as f:
+            f.write(content)
+        with pytest.raises(WebMError):
+            webm_index.make_seekable(path)
+        # The original is left alone
+        assert read(path) == content
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith('.tmp')]
+
+@pytest.mark.skipif(webm_index.fcntl is None, reason='no fcntl')
+def test_readers_wait_for_the_rewrite(tmp_path):
+    path = str(tmp_path / 'p1.webm')
+    order = []
+
+    def read():
+        with webm_index.recording_lock(path, shared=True):
+            order.append('read')
+
+    with webm_index.recording_lock(path):
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join(0.2)
+        order.append('rewrite')
+    reader.join(5)
+    assert order == ['rewrite', 'read']
+
+    # Readers don't exclude each other
+    with webm_index.recording_lock(path, shared=True):
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join(5)
+        assert order[-1] == 'read' and not reader.is_alive()
@@ -0,0 +1,116 @@
+import json
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from anam_xri import wire
+from anam_xri.profiles import build_profile
+
+NOW = 1760000000.123456
+
+PAYLOADS = [
+    ('heartbeat', {}),
+    ('clock_sync_ping', {'t0': NOW}),
+    ('sync_command_ack', {'session_id': 'a1b2c3d4', 'take': 2, 'device_id': 'mobile_k3j9x2q7a',
+                          'received_at': NOW + 0.012}),
+    ('upload_backlog', {'queued_chunks': 12, 'uploads': 1}),
+    ('recording_telemetry', {'session_id': 'a1b2c3d4', 'take': 0, 'interval': 2.0013,
+                             'bytes': 1048211, 'chunks': 2, 'frames': 60, 'dropped': 0,
+                             'clock_drift': -0.0004, 'battery': 0.73, 'charging': False}),
+    ('recording_telemetry', {'session_id': 'a1b2c3d4', 'take': 0, 'interval': 2.0,
+                             'bytes': 0, 'chunks': 0, 'frames': None, 'dropped': None,
+                             'clock_drift': 0.0, 'battery': None, 'charging': True}),
+    ('clock_sync_pong', {'t0': NOW, 't1': NOW + 0.0213, 't2': NOW + 0.0214}),
+    ('chunk_ack', {'session_id': 'a1b2c3d4', 'take': 0, 'seq': 41, 'status': 'ok',
+                   'next_seq': 42}),
+    ('chunk_ack', {'session_id': 'a1b2c3d4', 'take': 1, 'seq': None, 'status': 'resume',
+                   'next_seq': 0}),
+    ('sync_recording_command', {
+        'session_id': 'a1b2c3d4', 'take': 0, 'start_timestamp': NOW + 1.2,
+        'stop_timestamp': None, 'server_time': NOW, 'command': 'start_recording',
+        'local_start_timestamp': NOW + 1.1873, 'local_stop_timestamp': None,
+        'profile': build_profile(1, {'mime_types': ['video/webm;codecs=vp9,opus']}),
+        'ack_requested': True}),
+    ('sync_recording_command', {
+        'session_id': 'ß-take', 'take': 3, 'start_timestamp': NOW, 'stop_timestamp': NOW + 60,
+        'server_time': NOW, 'local_start_timestamp': None, 'local_stop_timestamp': None,
+        'profile': None, 'ack_requested': False}),
+    ('sync_control', {'session_id': 'a1b2c3d4', 'take': 0, 'action': 'pause',
+                      'timestamp': NOW + 0.8, 'server_time': NOW, 'local_timestamp': NOW + 0.7873}),
+]
+
+# Payloads a frame can't carry; both codecs must fall back to JSON
+UNFRAMED = [
+    ('registration_confirmed', {'device_id': 'p1'}),
+    ('heartbeat', {'extra': 1}),
+    ('upload_backlog', {'queued_chunks': -1, 'uploads': 1}),
+    ('upload_backlog', {'queued_chunks': 1.5, 'uploads': 1}),
+    ('chunk_ack', {'session_id': 's1', 'take': 0, 'seq': 1, 'status': 'lost', 'next_seq': 2}),
+    ('sync_command_ack', {'session_id': 'x' * 256, 'take': 0, 'device_id': 'p1',
+                          'received_at': NOW}),
+    ('sync_recording_command', {'session_id': 's1', 'take': 0, 'command': 'stop',
+                                'start_timestamp': NOW, 'stop_timestamp': None,
+                                'server_time': NOW, 'local_start_timestamp': None,
+                                'local_stop_timestamp': None, 'profile': None,
+                                'ack_requested': False}),
+]
+
+HARNESS = '''
+const lines = require('fs').readFileSync(0, 'utf8').trim().split('\\n');
+const codec = new WireCodec(WIRE_FRAMES);
+for (const line of lines) {
+    const [event, payload, frame] = JSON.parse(line);
+    const decoded = frame === null ? null : codec.decode(frame);
+    console.log(JSON.stringify([codec.encode(event, payload), decoded]));
+}
+'''
+
+
+def test_round_trip():
+    for event, payload in PAYLOADS:
+        frame = wire.encode(event, payload)
+        assert frame is not None, event
+        decoded_event, decoded = wire.decode(frame)
+        expected = dict(payload)
+        if event == 'sync_recording_command':
+            expected['command'] = 'start_recording'
+        assert (decoded_event, decoded) == (event, expected)
+
+
+def test_unframed_payloads_fall_back_to_json():
+    for event, payload in UNFRAMED:
+        assert wire.encode(event, payload) is None, (event, payload)
+
+
+def test_bad_frames():
+    for text in ('', '!!', 'fw=='):
+        with pytest.raises(wire.WireError):
+            wire.decode(text)
+
+
+def test_negotiate():
+    assert wire.negotiate(['json', 'binary']) == wire.FORMAT_BINARY
+    assert wire.negotiate(['json']) == wire.FORMAT_JSON
+    assert wire.negotiate(None) == wire.FORMAT_JSON
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node not installed')
+def test_matches_the_phone_codec(server):
+    page = server.app.test_client().get('/').get_data(as_text=True)
+    script = re.search(r'<script>(.*?)</script>', page, re.S).group(1)
+    codec = script[script.index('const WIRE_FRAMES'):script.index('class ChunkStore')]
+    cases = PAYLOADS + UNFRAMED
+    lines = '\n'.join(json.dumps([event, payload, wire.encode(event, payload)])
+                      for event, payload in cases)
+    output = subprocess.run(['node', '-e', codec + HARNESS], input=lines, capture_output=True,
+                            text=True, check=True).stdout.splitlines()
+    assert len(output) == len(cases)
+    for (event, payload), line in zip(cases, output):
+        js_frame, js_decoded = json.loads(line)
+        frame = wire.encode(event, payload)
+        # Byte for byte the same frame, and the same payload decoded from it
+        assert js_frame == frame, (event, payload)
+        if frame is not None:
+            assert js_decoded == list(wire.decode(frame)), event